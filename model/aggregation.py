@@ -0,0 +1,316 @@
+import re
+import numpy as np
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.tree._tree import Tree
+
+# Incremental aggregation of federation packages.
+#
+# Packages are folded in one at a time with a running weighted mean, so only
+# the current package and the running state are held in memory. Weights are
+# either the contributor's training sample count, their reputation, or
+# uniform. When packages carry their exported trees (see export_trees) the
+# trees are concatenated into one global forest whose votes are weighted, so
+# each package's trees together count with the package's weight however many
+# there are (see WeightedForestClassifier). Otherwise a forest with the
+# averaged hyperparameters is returned for central training as before.
+#
+# Sample counts are reported by the contributors themselves. A package's
+# n_samples must be positive, and it counts for no more than the samples its
+# trees were fitted on (the weighted sample count of their root nodes) nor
+# than max_samples, so a single package can't claim most of the weight.
+#
+# Trees are exported through scikit-learn's private Tree __getstate__ and
+# __setstate__. Their layout (max_depth, node_count, a structured nodes array
+# and values) is unchanged from 1.3, when nodes gained missing_go_to_left,
+# through the 1.x releases; other versions are refused instead of risking
+# corrupt trees. Packages record the version that exported them, and trees
+# whose node layout doesn't match the installed version are refused too.
+
+WEIGHTINGS = ("samples", "reputation", "uniform")
+TREE_FIELDS = ("tree_nodes", "tree_node_counts", "tree_values", "tree_max_depths", "classes")
+# [lowest, first unsupported) scikit-learn (major, minor) for the Tree state
+TREE_STATE_VERSIONS = ((1, 3), (2, 0))
+TREE_STATE_KEYS = {"max_depth", "node_count", "nodes", "values"}
+
+def check_tree_state_support():
+  low, high = TREE_STATE_VERSIONS
+  installed = tuple(int(part) for part in re.findall(r"\d+", sklearn.__version__)[:2])
+  if not low <= installed < high:
+    raise RuntimeError(
+      f"Exported trees use scikit-learn's private Tree state, which is only known to be compatible with "
+      f"versions {low[0]}.{low[1]} up to {high[0]}.{high[1]}; scikit-learn {sklearn.__version__} is installed"
+    )
+
+class WeightedForestClassifier(RandomForestClassifier):
+  """A forest merged from several packages' trees. predict_proba (and so
+  predict) is the mean of the trees' probabilities weighted by tree_weights_."""
+
+  def predict_proba(self, X):
+    X = self._validate_X_predict(X)
+    proba = np.zeros((X.shape[0], self.n_classes_))
+    for weight, estimator in zip(self.tree_weights_, self.estimators_):
+      proba += weight * estimator.predict_proba(X, check_input=False)
+    return proba / np.sum(self.tree_weights_)
+
+# flattens a fitted forest's trees into plain arrays for the npz package.
+def export_trees(forest):
+  check_tree_state_support()
+  states = [estimator.tree_.__getstate__() for estimator in forest.estimators_]
+  exported = {
+    "tree_nodes": np.concatenate([state["nodes"] for state in states]).astype(states[0]["nodes"].dtype),
+    "tree_node_counts": np.array([state["node_count"] for state in states], dtype=np.int64),
+    "tree_values": np.concatenate([state["values"] for state in states]),
+    "tree_max_depths": np.array([state["max_depth"] for state in states], dtype=np.int64),
+    "classes": np.asarray(forest.classes_),
+    "n_features": int(forest.n_features_in_),
+    "sklearn_version": sklearn.__version__
+  }
+  if getattr(forest, "tree_weights_", None) is not None:
+    exported["tree_weights"] = np.asarray(forest.tree_weights_, dtype=np.float64)
+  return exported
+
+def import_trees(package):
+  check_tree_state_support()
+  n_features = int(package["n_features"])
+  classes = np.asarray(package["classes"])
+  n_classes = np.array([len(classes)], dtype=np.intp)
+  state = Tree(n_features, n_classes, 1).__getstate__()
+  if not TREE_STATE_KEYS <= set(state):
+    raise RuntimeError(f"scikit-learn {sklearn.__version__} changed the Tree state, trees can't be imported")
+  node_dtype = state["nodes"].dtype
+  nodes = package["tree_nodes"]
+  if nodes.dtype.names != node_dtype.names:
+    raise ValueError(
+      f"Package trees were exported with scikit-learn {package.get('sklearn_version', 'before 1.6')}, "
+      f"whose node layout differs from the installed {sklearn.__version__}"
+    )
+  if nodes.dtype != node_dtype:
+    nodes = nodes.astype(node_dtype)
+
+  estimators = []
+  start = 0
+  for node_count, max_depth in zip(package["tree_node_counts"], package["tree_max_depths"]):
+    end = start + int(node_count)
+    tree = Tree(n_features, n_classes, 1)
+    tree.__setstate__({
+      "max_depth": int(max_depth),
+      "node_count": int(node_count),
+      "nodes": np.ascontiguousarray(nodes[start:end]),
+      "values": np.ascontiguousarray(package["tree_values"][start:end])
+    })
+    estimator = DecisionTreeClassifier()
+    estimator.tree_ = tree
+    estimator.n_features_in_ = n_features
+    estimator.n_outputs_ = 1
+    estimator.classes_ = classes
+    estimator.n_classes_ = len(classes)
+    estimator.max_features_ = n_features
+    estimators.append(estimator)
+    start = end
+  return estimators
+
+# a plain forest, or a WeightedForestClassifier when tree_weights are given
+def build_forest(estimators, classes, n_features, tree_weights=None):
+  if tree_weights is None:
+    forest = RandomForestClassifier(n_estimators=len(estimators))
+  else:
+    forest = WeightedForestClassifier(n_estimators=len(estimators))
+    forest.tree_weights_ = np.asarray(tree_weights, dtype=np.float64)
+  forest.estimator_ = DecisionTreeClassifier()
+  forest.estimators_ = list(estimators)
+  forest.classes_ = classes
+  forest.n_classes_ = len(classes)
+  forest.n_outputs_ = 1
+  forest.n_features_in_ = n_features
+  return forest
+
+# fitted forest from a package's exported trees.
+def forest_from_package(package):
+  return build_forest(
+    import_trees(package), np.asarray(package["classes"]), int(package["n_features"]), package.get("tree_weights")
+  )
+
+# weights of a package's trees that add up to weight, keeping the relative
+# weights of a package that is itself a merged forest.
+def spread_weight(package, estimators, weight):
+  if not estimators:
+    return []
+  tree_weights = package.get("tree_weights")
+  if tree_weights is None or len(tree_weights) != len(estimators):
+    return [weight / len(estimators)] * len(estimators)
+  tree_weights = np.asarray(tree_weights, dtype=np.float64)
+  return list(weight * tree_weights / tree_weights.sum())
+
+# the most samples any of the package's trees was fitted on, None without trees
+def tree_sample_count(package):
+  if not all(field in package for field in ("tree_nodes", "tree_node_counts")):
+    return None
+  node_counts = np.asarray(package["tree_node_counts"], dtype=np.int64)
+  if not node_counts.size or "weighted_n_node_samples" not in (package["tree_nodes"].dtype.names or ()):
+    return None
+  roots = np.concatenate(([0], np.cumsum(node_counts)[:-1]))
+  return float(package["tree_nodes"]["weighted_n_node_samples"][roots].max())
+
+class FederatedAggregator:
+  def __init__(self, weighting="samples", merge_trees=True, max_samples=None):
+    if weighting not in WEIGHTINGS:
+      raise ValueError(f"weighting must be one of {WEIGHTINGS}")
+    self.weighting = weighting
+    self.merge_trees = merge_trees
+    self.max_samples = max_samples
+    self.total_weight = 0.0
+    self.package_count = 0
+    self.predictions = None
+    self.importances = None
+    self.n_estimators_sum = 0
+    self.max_depth_sum = 0
+    self.max_features = None
+    self.estimators = []
+    self.tree_weights = []
+    self.classes = None
+    self.n_features = None
+
+  def package_weight(self, package, reputation=None):
+    if self.weighting == "reputation":
+      return float(reputation if reputation is not None else 0)
+    if self.weighting == "samples":
+      if "n_samples" not in package:
+        return float(len(package.get("predictions", ())) or 1)
+      try:
+        n_samples = float(package["n_samples"])
+      except (TypeError, ValueError):
+        raise ValueError(f"n_samples must be a number, not {package['n_samples']!r}")
+      if not np.isfinite(n_samples) or n_samples <= 0:
+        raise ValueError(f"n_samples must be a positive number, not {n_samples}")
+      fitted = tree_sample_count(package)
+      if fitted is not None:
+        n_samples = min(n_samples, fitted)
+      if self.max_samples is not None:
+        n_samples = min(n_samples, float(self.max_samples))
+      return n_samples
+    return 1.0
+
+  def _fold(self, mean, values, weight):
+    values = np.asarray(values, dtype=np.float64)
+    if mean is None:
+      return values.copy()
+    if mean.shape != values.shape:
+      raise ValueError(f"Cannot aggregate arrays of shape {values.shape} into {mean.shape}")
+    mean += (weight / self.total_weight) * (values - mean)
+    return mean
+
+  def _check_shape(self, mean, values):
+    values = np.asarray(values)
+    if mean is not None and mean.shape != values.shape:
+      raise ValueError(f"Cannot aggregate arrays of shape {values.shape} into {mean.shape}")
+
+  def add(self, package, reputation=None):
+    weight = self.package_weight(package, reputation)
+    if weight <= 0:
+      return False
+
+    # everything that can reject the package is checked before the running
+    # state changes, so a bad package leaves the aggregate as it was
+    self._check_shape(self.importances, package["feature_importances"])
+    has_predictions = package.get("predictions") is not None
+    if has_predictions:
+      self._check_shape(self.predictions, package["predictions"])
+    n_estimators, max_depth = int(package["n_estimators"]), int(package["max_depth"])
+    estimators = None
+    if self.merge_trees and all(field in package for field in TREE_FIELDS):
+      classes = np.asarray(package["classes"])
+      if self.classes is not None and (not np.array_equal(self.classes, classes) or self.n_features != int(package["n_features"])):
+        raise ValueError("Package trees were trained on different classes or features")
+      estimators = import_trees(package)
+
+    self.total_weight += weight
+    self.package_count += 1
+    if has_predictions:
+      self.predictions = self._fold(self.predictions, package["predictions"], weight)
+    self.importances = self._fold(self.importances, package["feature_importances"], weight)
+
+    self.n_estimators_sum += n_estimators
+    self.max_depth_sum += max_depth
+    if self.max_features is None:
+      self.max_features = package["max_features"]
+
+    if estimators is not None:
+      if self.classes is None:
+        self.classes, self.n_features = classes, int(package["n_features"])
+      self.estimators.extend(estimators)
+      self.tree_weights.extend(spread_weight(package, estimators, weight))
+    return True
+
+  # scalar running state, stored with a published model so the aggregate can
+  # be restored and extended later without refetching earlier packages.
+  def summary(self):
+    return {
+      "weighting": self.weighting,
+      "total_weight": self.total_weight,
+      "package_count": self.package_count,
+      "n_estimators_sum": self.n_estimators_sum,
+      "max_depth_sum": self.max_depth_sum,
+      "max_features": self.max_features
+    }
+
+  @classmethod
+  def restore(cls, summary, importances, trees=None, merge_trees=True, max_samples=None):
+    aggregator = cls(summary["weighting"], merge_trees, max_samples)
+    aggregator.total_weight = float(summary["total_weight"])
+    aggregator.package_count = int(summary["package_count"])
+    aggregator.n_estimators_sum = int(summary["n_estimators_sum"])
+    aggregator.max_depth_sum = int(summary["max_depth_sum"])
+    aggregator.max_features = summary["max_features"]
+    aggregator.importances = np.array(importances, dtype=np.float64)
+    if trees is not None:
+      aggregator.classes = np.asarray(trees["classes"])
+      aggregator.n_features = int(trees["n_features"])
+      aggregator.estimators = import_trees(trees)
+      # forests published before the votes were weighted count as one package
+      # of the whole aggregate's weight
+      aggregator.tree_weights = spread_weight(trees, aggregator.estimators, aggregator.total_weight)
+    return aggregator
+
+  # aggregate seeded with a global model published without aggregate state,
+  # e.g. from the Aggregator notebook: its trees and importances count as the
+  # recorded number of contributors, of the recorded total weight (one unit
+  # per contributor when the metadata has none).
+  @classmethod
+  def from_published(cls, package, weighting="samples", merge_trees=True, max_samples=None):
+    metadata = package.get("metadata") or {}
+    package_count = int(metadata.get("contributors") or 1)
+    summary = {
+      "weighting": weighting,
+      "total_weight": float(metadata.get("total_weight") or package_count),
+      "package_count": package_count,
+      "n_estimators_sum": int(package["n_estimators"]),
+      "max_depth_sum": int(max(package["tree_max_depths"], default=0)) * package_count,
+      "max_features": metadata.get("max_features")
+    }
+    return cls.restore(summary, package["feature_importances"], package, merge_trees, max_samples)
+
+  def has_merged_forest(self):
+    return bool(self.estimators)
+
+  def global_model(self):
+    if self.package_count == 0:
+      raise ValueError("No packages have been aggregated")
+
+    if self.has_merged_forest():
+      return build_forest(self.estimators, self.classes, self.n_features, self.tree_weights)
+
+    avg_max_depth = self.max_depth_sum / self.package_count
+    return RandomForestClassifier(
+      n_estimators=int(self.n_estimators_sum / self.package_count),
+      max_features=self.max_features,
+      max_depth=int(avg_max_depth) if avg_max_depth > 0 else None
+    )
+
+# drop-in replacement for the notebook's get_global_model.
+def get_global_model(federation_packages, weighting="samples", merge_trees=True, reputations=None):
+  aggregator = FederatedAggregator(weighting, merge_trees)
+  for index, package in enumerate(federation_packages):
+    aggregator.add(package, reputations[index] if reputations else None)
+  return aggregator.global_model(), aggregator.predictions, aggregator.importances
@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
+
+from aggregation import FederatedAggregator
+from federation import fetch_package
+from model_registry import model_registry
+from database import get_contract_contributors
+from instrumentation import get_logger
+
+load_dotenv()
+
+log = get_logger("aggregation")
+
+# Incremental aggregation rounds in the backend.
+#
+# Every time contributors' parameters are posted for a contract, only the
+# packages that haven't been folded into that contract's aggregate yet (keyed
+# by their IPFS hash) are downloaded. They are added to the running aggregate
+# and a new global model version is published to the model registry. The
+# published version carries the aggregate's running state, so another worker
+# process, or this one after a restart, picks the aggregate up from the
+# registry rather than reprocessing earlier packages. Folding and publishing
+# a contract happens under the registry's per-contract lock.
+#
+# /aggregate is open to anyone, so only packages of the contract's
+# subscribers (see get_contract_contributors) are folded, each weighted by
+# at most AGGREGATION_MAX_SAMPLES samples (see aggregation.py), and packages
+# are decoded as npz only: a legacy pickle package is reported as a failure,
+# whatever ALLOW_PICKLE_PARAMS says. Others are reported as failures too.
+
+AGGREGATION_WORKERS = int(os.getenv("AGGREGATION_WORKERS", "2"))
+AGGREGATION_FETCH_WORKERS = int(os.getenv("AGGREGATION_FETCH_WORKERS", "8"))
+AGGREGATION_WEIGHTING = os.getenv("AGGREGATION_WEIGHTING", "samples")
+# set to false to only stage posted parameters, as before
+AGGREGATION_AUTO = os.getenv("AGGREGATION_AUTO", "true").lower() == "true"
+AGGREGATION_MAX_SAMPLES = int(os.getenv("AGGREGATION_MAX_SAMPLES", "1000000"))
+MAX_REPORTED_FAILURES = 50
+
+class ContractAggregate:
+  def __init__(self, contract_id):
+    self.contract_id = contract_id
+    self.aggregator = FederatedAggregator(AGGREGATION_WEIGHTING, max_samples=AGGREGATION_MAX_SAMPLES)
+    self.folded = set()
+    self.version = None
+    self.pending = 0
+    self.failures = []
+    self.published_at = None
+
+  # the aggregate as of the registry's latest version, when that is newer.
+  def sync(self):
+    latest = model_registry.latest_version(self.contract_id)
+    if latest is None or latest == self.version:
+      return
+    package, version = model_registry.load_package(self.contract_id, latest)
+    state = package["metadata"].get("aggregate")
+    if state is None:
+      # published by hand (e.g. from the notebook): its forest is the starting
+      # point, otherwise the next publish would replace it with a model of
+      # the newly folded packages only
+      self.aggregator = FederatedAggregator.from_published(
+        package, AGGREGATION_WEIGHTING, max_samples=AGGREGATION_MAX_SAMPLES
+      )
+      self.folded = set(package["metadata"].get("folded", ()))
+      log.info("Seeded the aggregate of %s from hand-published version %s", self.contract_id, version)
+    else:
+      self.aggregator = FederatedAggregator.restore(
+        state["summary"], package["aggregate_importances"], package, max_samples=AGGREGATION_MAX_SAMPLES
+      )
+      self.folded = set(state["folded"])
+    self.version = version
+    self.published_at = package["published_at"]
+
+  # only the latest MAX_REPORTED_FAILURES are kept
+  def add_failure(self, failure):
+    self.failures.append(failure)
+    del self.failures[:-MAX_REPORTED_FAILURES]
+
+  def publish(self):
+    if not self.aggregator.has_merged_forest():
+      return None
+    metadata = {
+      "contributors": self.aggregator.package_count,
+      "aggregate": {"summary": self.aggregator.summary(), "folded": sorted(self.folded)}
+    }
+    extra = {"aggregate_importances": np.asarray(self.aggregator.importances, dtype=np.float64)}
+    self.version = model_registry.publish(self.contract_id, self.aggregator.global_model(), metadata, extra)
+    self.published_at = time.time()
+    return self.version
+
+  def status(self):
+    return {
+      "contractId": self.contract_id,
+      "version": self.version,
+      "packages": self.aggregator.package_count,
+      "totalWeight": self.aggregator.total_weight,
+      "pending": self.pending,
+      "publishedAt": self.published_at,
+      "failures": list(self.failures)
+    }
+
+class AggregationScheduler:
+  # contributors(contract_id) is the {address: reputation} of the
+  # contributors whose packages may be folded into the contract's model.
+  def __init__(self, max_workers=AGGREGATION_WORKERS, fetch_workers=AGGREGATION_FETCH_WORKERS, contributors=None):
+    self._contributors = contributors or (lambda contract_id: get_contract_contributors(int(contract_id)))
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aggregation")
+    self._fetch_executor = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="aggregation-fetch")
+    self._contracts = {}
+    self._lock = threading.Lock()
+
+  def contract(self, contract_id):
+    with self._lock:
+      aggregate = self._contracts.get(contract_id)
+      if aggregate is None:
+        aggregate = self._contracts[contract_id] = ContractAggregate(contract_id)
+      return aggregate
+
+  # params is the contributor -> {paramHash, paramKey} mapping posted to
+  # /aggregate. Returns how many packages were queued, ValueError when the
+  # contract ID isn't one.
+  def submit(self, contract_id, params):
+    try:
+      contributors = self._contributors(contract_id)
+    except (TypeError, ValueError):
+      raise ValueError(f"Invalid contract ID {contract_id!r}")
+    aggregate = self.contract(contract_id)
+    if aggregate.pending == 0 and model_registry.latest_version(contract_id) not in (None, aggregate.version):
+      # catch up with versions published by other workers before deduplicating
+      with model_registry.lock(contract_id):
+        aggregate.sync()
+    items = {
+      contributor: item for contributor, item in params.items()
+      if isinstance(item, dict) and item.get("paramHash") and item.get("paramKey")
+      and item["paramHash"] not in aggregate.folded
+    }
+    for contributor in [contributor for contributor in items if contributor not in contributors]:
+      item = items.pop(contributor)
+      log.warning("Refused the package of %s for %s, not a subscriber of the contract", contributor, contract_id)
+      aggregate.add_failure({
+        "contributor": contributor, "ipfsHash": item["paramHash"], "ok": False,
+        "error": "Not a subscriber of the contract"
+      })
+    if not items:
+      return 0
+    with self._lock:
+      aggregate.pending += len(items)
+    self._executor.submit(self._process, aggregate, items, contributors)
+    return len(items)
+
+  def _process(self, aggregate, items, contributors):
+    try:
+      # downloads happen outside the lock, only folding is serialized
+      results = list(self._fetch_executor.map(
+        lambda entry: fetch_package(*entry, allow_pickle=False), items.items()
+      ))
+      with model_registry.lock(aggregate.contract_id):
+        aggregate.sync()
+        added = 0
+        for result in results:
+          if result.ipfs_hash in aggregate.folded:
+            continue
+          if not result.ok or not result.package:
+            aggregate.add_failure(result.to_dict())
+            continue
+          try:
+            if aggregate.aggregator.add(result.package, contributors.get(result.contributor)):
+              added += 1
+            aggregate.folded.add(result.ipfs_hash)
+          except (KeyError, ValueError) as e:
+            aggregate.add_failure(dict(result.to_dict(), ok=False, error=f"Aggregation failed: {e}"))
+        if added:
+          version = aggregate.publish()
+          log.info("Folded %d packages into %s, published version %s", added, aggregate.contract_id, version)
+    except Exception:
+      log.exception("Aggregation of %s failed", aggregate.contract_id)
+    finally:
+      with self._lock:
+        aggregate.pending -= len(items)
+
+  def status(self, contract_id):
+    aggregate = self.contract(contract_id)
+    if aggregate.pending == 0 and model_registry.latest_version(contract_id) is not None:
+      with model_registry.lock(contract_id):
+        aggregate.sync()
+    return aggregate.status()
+
+aggregation_scheduler = AggregationScheduler()
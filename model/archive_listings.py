@@ -0,0 +1,255 @@
+import os
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, ReplaceOne, DeleteOne
+from dotenv import load_dotenv
+
+from database import (
+  created_listing_collection,
+  subscribed_listing_collection,
+  reported_listing_collection,
+  archived_created_listing_collection,
+  archived_subscribed_listing_collection,
+  ensure_indexes,
+  contracts_filter,
+  pending_reports_filter,
+  invalidate_created_listings,
+  invalidate_subscribed_listings
+)
+from instrumentation import get_logger, metrics
+from jobs import job_queue, JobQueueFull
+
+try:
+  import fcntl
+except ImportError:
+  # Windows runs a single waitress process, which is the only scheduler
+  fcntl = None
+
+load_dotenv()
+
+log = get_logger("archive")
+
+# Compaction of the live listing collections.
+#
+# Created listings that expired more than ARCHIVE_GRACE_DAYS ago, or that
+# were paid and have expired, are moved to archivedCreatedListings together
+# with their subscriptions (archivedSubscribedListings), unless a report on
+# them is still pending. Listings are processed in batches: each batch is
+# copied with bulk upserts first and then deleted from the live collections,
+# only where the document is unchanged since it was copied, so a rerun after
+# a crash or a concurrent write never loses anything. A listing written to
+# in between stays live and its copies are removed from the archive again. A
+# subscription written to in between (e.g. given feedback) is copied again
+# in its current version before it is deleted, since its listing is gone
+# already; the last of ARCHIVE_SUBSCRIPTION_ATTEMPTS deletes it by _id
+# whatever changed. Between batches the
+# job sleeps so that it writes for at most ARCHIVE_DUTY_CYCLE of the time.
+#
+# The backend runs it through the job queue every ARCHIVE_INTERVAL_SECONDS.
+# The server starts the schedule in every worker once it has forked (see
+# serve.py), and the worker holding ARCHIVE_LOCK_PATH is the one that runs it;
+# it can also be run by hand:
+#
+#   python archive_listings.py [--dry-run] [--max-batches N]
+
+ARCHIVE_GRACE_DAYS = float(os.getenv("ARCHIVE_GRACE_DAYS", "7"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_DUTY_CYCLE = float(os.getenv("ARCHIVE_DUTY_CYCLE", "0.2"))
+ARCHIVE_MAX_BATCHES = int(os.getenv("ARCHIVE_MAX_BATCHES", "0"))
+ARCHIVE_SUBSCRIPTION_ATTEMPTS = 3
+# 0 turns the scheduled run off
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_LOCK_PATH = os.getenv(
+  "ARCHIVE_LOCK_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive.lock")
+)
+
+archived_listings = metrics.counter(
+  "dmlchain_archived_listings_total", "Listings moved to the archive", labels=("collection",)
+)
+
+def archive_query(now, pending_ids):
+  return {
+    "$or": [
+      {"expiresAtTs": {"$lt": now - timedelta(days=ARCHIVE_GRACE_DAYS)}},
+      {"paid": True, "expiresAtTs": {"$lt": now}}
+    ],
+    "contractId": {"$nin": pending_ids}
+  }
+
+def without_id(document, **fields):
+  record = {key: value for key, value in document.items() if key != "_id"}
+  record.update(fields)
+  return record
+
+def copy_subscriptions(subscriptions, expiry, archived_at):
+  archived_subscribed_listing_collection.bulk_write([
+    ReplaceOne(
+      {"subscriberAddress": subscription["subscriberAddress"], "contractId": subscription["contractId"]},
+      without_id(subscription, expiresAtTs=expiry[subscription["contractId"]], archivedAt=archived_at),
+      upsert=True
+    )
+    for subscription in subscriptions
+  ], ordered=False)
+
+# deletes the copied subscriptions, copying the ones written to since again
+def move_subscriptions(subscriptions, expiry, archived_at):
+  for attempt in range(1, ARCHIVE_SUBSCRIPTION_ATTEMPTS + 1):
+    last = attempt == ARCHIVE_SUBSCRIPTION_ATTEMPTS
+    result = subscribed_listing_collection.bulk_write([
+      DeleteOne({"_id": subscription["_id"]} if last else subscription) for subscription in subscriptions
+    ], ordered=False)
+    if last or result.deleted_count == len(subscriptions):
+      return
+    ids = [subscription["_id"] for subscription in subscriptions]
+    subscriptions = list(subscribed_listing_collection.find({"_id": {"$in": ids}}))
+    if not subscriptions:
+      return
+    copy_subscriptions(subscriptions, expiry, archived_at)
+
+# (created, subscribed) listings archived in one batch
+def archive_batch(now, pending_ids, batch_size):
+  listings = list(created_listing_collection.find(archive_query(now, pending_ids)).sort("expiresAtTs", ASCENDING).limit(batch_size))
+  if not listings:
+    return 0, 0
+  contract_ids = [listing["contractId"] for listing in listings]
+  expiry = {listing["contractId"]: listing.get("expiresAtTs") for listing in listings}
+  subscriptions = list(subscribed_listing_collection.find(contracts_filter(contract_ids)))
+  archived_at = datetime.now(timezone.utc)
+
+  archived_created_listing_collection.bulk_write([
+    ReplaceOne({"contractId": listing["contractId"]}, without_id(listing, archivedAt=archived_at), upsert=True)
+    for listing in listings
+  ], ordered=False)
+  if subscriptions:
+    copy_subscriptions(subscriptions, expiry, archived_at)
+
+  # the whole document is the filter, a listing written to since it was read
+  # stays live and is archived again by a later batch
+  created_listing_collection.bulk_write([DeleteOne(listing) for listing in listings], ordered=False)
+  remaining = set(created_listing_collection.distinct("contractId", contracts_filter(contract_ids)))
+  if remaining:
+    archived_created_listing_collection.delete_many(contracts_filter(remaining))
+    archived_subscribed_listing_collection.delete_many(contracts_filter(remaining))
+    subscriptions = [subscription for subscription in subscriptions if subscription["contractId"] not in remaining]
+  if subscriptions:
+    move_subscriptions(subscriptions, expiry, archived_at)
+
+  invalidate_created_listings(*{listing["creatorAddress"] for listing in listings if "creatorAddress" in listing})
+  invalidate_subscribed_listings(*{subscription["subscriberAddress"] for subscription in subscriptions})
+  created = len(listings) - len(remaining)
+  archived_listings.inc("createdListings", amount=created)
+  archived_listings.inc("subscribedListings", amount=len(subscriptions))
+  return created, len(subscriptions)
+
+def archive_listings(dry_run=False, max_batches=ARCHIVE_MAX_BATCHES, batch_size=ARCHIVE_BATCH_SIZE):
+  now = datetime.now(timezone.utc)
+  pending_ids = reported_listing_collection.distinct("contractId", pending_reports_filter())
+  stats = {"createdListings": 0, "subscribedListings": 0, "batches": 0, "skippedPendingReports": len(pending_ids)}
+
+  if dry_run:
+    query = archive_query(now, pending_ids)
+    contract_ids = created_listing_collection.distinct("contractId", query)
+    stats["createdListings"] = len(contract_ids)
+    stats["subscribedListings"] = subscribed_listing_collection.count_documents(contracts_filter(contract_ids))
+    return stats
+
+  started = time.monotonic()
+  while not max_batches or stats["batches"] < max_batches:
+    batch_started = time.monotonic()
+    created, subscribed = archive_batch(now, pending_ids, batch_size)
+    if not created and not subscribed:
+      break
+    stats["batches"] += 1
+    stats["createdListings"] += created
+    stats["subscribedListings"] += subscribed
+    # leave the database to live traffic for the rest of the cycle
+    elapsed = time.monotonic() - batch_started
+    time.sleep(elapsed * (1 - ARCHIVE_DUTY_CYCLE) / ARCHIVE_DUTY_CYCLE)
+
+  stats["seconds"] = round(time.monotonic() - started, 3)
+  if stats["batches"]:
+    log.info("Archived listings", extra=stats)
+  return stats
+
+# submits an archival job every interval, with some jitter; the job queue
+# runs one at a time. Every process may start the schedule, but only the one
+# holding the lock file runs it. The others try to take the lock at every
+# interval, so one of them takes over when that process exits, e.g. when
+# gunicorn recycles it.
+class ArchiveSchedule:
+  def __init__(self, interval=ARCHIVE_INTERVAL_SECONDS, lock_path=ARCHIVE_LOCK_PATH):
+    self.interval = interval
+    self.lock_path = lock_path
+    self.leader = False
+    self._lock_file = None
+    self._thread = None
+    self._stopped = threading.Event()
+    self._lock = threading.Lock()
+
+  def submit(self):
+    return job_queue.submit("archive-listings", "all", archive_listings)
+
+  # whether this process runs the schedule, taking the lock file when it is free
+  def _acquire(self):
+    if self.leader:
+      return True
+    if fcntl:
+      try:
+        if self._lock_file is None:
+          self._lock_file = open(self.lock_path, "a")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        return False
+      except OSError:
+        log.exception("Could not lock %s for listing archival", self.lock_path)
+        return False
+    self.leader = True
+    log.info("Scheduling listing archival every %s seconds in process %d", self.interval, os.getpid())
+    return True
+
+  def _run(self):
+    while not self._stopped.wait(self.interval * random.uniform(0.9, 1.1)):
+      if not self._acquire():
+        continue
+      try:
+        self.submit()
+      except JobQueueFull:
+        log.warning("Skipped a scheduled listing archival, the job queue is full")
+      except Exception:
+        log.exception("Could not schedule listing archival")
+
+  def start(self):
+    with self._lock:
+      if self.interval <= 0 or self._thread is not None:
+        return
+      self._stopped.clear()
+      self._thread = threading.Thread(target=self._run, name="archive-schedule", daemon=True)
+      self._thread.start()
+
+  def stop(self):
+    with self._lock:
+      thread, self._thread = self._thread, None
+    if thread is None:
+      return
+    self._stopped.set()
+    thread.join()
+    if self._lock_file is not None:
+      # closing the file releases the lock for the other processes
+      self._lock_file.close()
+      self._lock_file = None
+    self.leader = False
+
+archive_schedule = ArchiveSchedule()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Move expired and paid listings to the archive collections.")
+  parser.add_argument('--dry-run', action='store_true', help="only count what would be archived")
+  parser.add_argument('--max-batches', type=int, default=ARCHIVE_MAX_BATCHES, help="stop after this many batches, 0 for all")
+  parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+  args = parser.parse_args()
+
+  ensure_indexes()
+  print(archive_listings(args.dry_run, args.max_batches, args.batch_size))
@@ -1,56 +1,297 @@
-from flask import Flask, jsonify, request, send_file
+from serve import BACKEND_MODE, run_production
+
+# `python backend.py` with BACKEND_MODE=prod hands over to serve.py before
+# anything else is imported: the gunicorn master must not hold the app's
+# database clients, SQLite handles or threads when it forks workers. Each
+# worker imports this module itself.
+if __name__ == '__main__' and BACKEND_MODE == 'prod':
+  run_production()
+  raise SystemExit(0)
+
+import io
+import os
+import numpy as np
+import requests
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
-from ipfs_configs import retrieve_model
-from database import create_user, address_exists, get_user_by_address, add_listing_to_created, get_filtered_listings, add_listing_to_subscribed, get_subscribed_listings, update_user_reputation, get_created_listings, update_feedback, mark_contract_as_paid, add_reported_listing, get_created_listings, get_reported_listings, update_reported_listing_status
+from ipfs_configs import fetch_to_cache, stream_from_ipfs
+from staging_store import staging_store, DEFAULT_ROUND
+from model_registry import model_registry
+from inference import scoring_service, parse_rows, ModelNotFound
+from aggregation_scheduler import aggregation_scheduler, AGGREGATION_AUTO
+from blob_cache import blob_cache, BlobMismatch
+from instrumentation import get_logger, instrument_app, metrics
+from jobs import job_queue, JobQueueFull, JobFailed
+from archive_listings import archive_schedule, archive_listings
+from responses import install_response_layer, parse_fields, select_fields
+from database import LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE, EXPIRY_FORMAT, parse_expiry, CREATED_LISTING_FIELDS, SUBSCRIBED_LISTING_FIELDS, REPORTED_LISTING_FIELDS, warm_up, decode_cursor, decode_id_cursor, get_cache_stats, marketplace_feed, create_user, address_exists, get_user_by_address, get_user_with_listings, add_listing_to_created, get_filtered_listings, add_listing_to_subscribed, get_subscribed_listings, apply_reputation_changes, get_created_listings, update_feedback, mark_contract_as_paid, add_reported_listing, get_created_listings, get_reported_listings, update_reported_listing_status, get_archived_created_listings, get_archived_subscribed_listings
 
 app = Flask(__name__)
-CORS(app)
-
-# Global variable to store data
-shared_data = None
-
-# fetch data from shared memory.
+# the paged list endpoints return the next page's cursor in X-Next-Cursor
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag'])
+instrument_app(app)
+install_response_layer(app)
+
+log = get_logger("backend")
+
+MODEL_MIMETYPE = 'application/x-ipynb+json'
+MODEL_MAX_AGE = 365 * 24 * 3600
+ARCHIVE_PAGE_SIZE = 50
+ARCHIVE_MAX_PAGE_SIZE = 500
+FILTERED_LISTING_FIELDS = {'contractId', 'createdAt', 'expiresAt', 'url', 'paid', 'creator', 'reputation'}
+
+# an integer query argument, ValueError when it isn't one or is out of range
+def int_arg(name, default=None, minimum=None, maximum=None):
+  value = request.args.get(name)
+  if value is None:
+    return default
+  try:
+    value = int(value)
+  except ValueError:
+    raise ValueError(f"{name} must be an integer")
+  if maximum is not None and not minimum <= value <= maximum:
+    raise ValueError(f"{name} must be between {minimum} and {maximum}")
+  if maximum is None and minimum is not None and value < minimum:
+    raise ValueError(f"{name} must be at least {minimum}")
+  return value
+
+# ValueError unless every key of the JSON body is a timestamp as the frontend
+# sends them, e.g. 2025-01-31T12:00:00.000Z
+def check_timestamps(data, *keys):
+  for key in keys:
+    try:
+      parse_expiry(data[key])
+    except (TypeError, ValueError):
+      raise ValueError(f"{key} must be a timestamp in the format {EXPIRY_FORMAT}")
+
+# (limit, cursor) of a request for a page of a list, ValueError when either is invalid
+def page_args(decode=decode_id_cursor, default=LIST_PAGE_SIZE, maximum=LIST_MAX_PAGE_SIZE):
+  limit = int_arg('limit', default, 1, maximum)
+  return limit, decode(request.args.get('cursor'))
+
+def page_response(items, next_cursor):
+  response = jsonify(items)
+  if next_cursor:
+    response.headers['X-Next-Cursor'] = next_cursor
+  return response
+
+# stats the caches and the scoring service already keep, exported on /metrics
+def collect_service_metrics():
+  lookup = get_cache_stats()
+  blobs = blob_cache.stats()
+  yield "dmlchain_lookup_cache_hits_total", "counter", "User and listing lookup cache hits", [({}, lookup["hits"])]
+  yield "dmlchain_lookup_cache_misses_total", "counter", "User and listing lookup cache misses", [({}, lookup["misses"])]
+  yield "dmlchain_lookup_cache_entries", "gauge", "Entries in the lookup cache", [({}, lookup["size"])]
+  yield "dmlchain_blob_cache_hits_total", "counter", "IPFS blob cache hits", [({}, blobs["hits"])]
+  yield "dmlchain_blob_cache_misses_total", "counter", "IPFS blob cache misses", [({}, blobs["misses"])]
+  yield "dmlchain_blob_cache_bytes", "gauge", "Bytes held by the IPFS blob cache", [({}, blobs["sizeBytes"])]
+  feed = marketplace_feed.stats()
+  yield "dmlchain_feed_listings", "gauge", "Unexpired listings in the marketplace feed", [({}, feed["listings"])]
+  yield "dmlchain_feed_thresholds", "gauge", "Reputation thresholds materialized in the marketplace feed", [({}, feed["thresholds"])]
+  scoring = scoring_service.stats()
+  yield "dmlchain_score_requests_total", "counter", "Scoring requests by contract", [
+    ({"contract": contract_id}, stats["requests"]) for contract_id, stats in scoring.items()
+  ]
+  yield "dmlchain_score_rows_total", "counter", "Rows scored by contract", [
+    ({"contract": contract_id}, stats["rows"]) for contract_id, stats in scoring.items()
+  ]
+  yield "dmlchain_score_batches_total", "counter", "Micro-batches run by contract", [
+    ({"contract": contract_id}, stats["batches"]) for contract_id, stats in scoring.items()
+  ]
+
+metrics.register_collector(collect_service_metrics)
+
+# Prometheus scrape endpoint, see instrumentation.py
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+  return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# fetch a staged round, the default round when no contractId is given.
 @app.route('/data', methods=['GET'])
 def get_data():
-    if shared_data is None:
+    payload = staging_store.get(request.args.get('contractId', DEFAULT_ROUND))
+    if payload is None:
         return jsonify({"message": "No data available"}), 404
-    return jsonify(shared_data)
+    return Response(payload, mimetype='application/json')
 
-# update shared memory from the notebook.
+# stage data posted from the notebook.
 @app.route('/update-data', methods=['POST'])
 def update_data():
-    global shared_data
-    shared_data = request.json
+    if request.get_json(silent=True) is None:
+        return jsonify({"error": "Request body must be JSON"}), 400
+    staging_store.put(request.args.get('contractId', DEFAULT_ROUND), request.get_data())
     return jsonify({"message": "Data updated successfully"}), 200
 
-# retrieve and download model from IPFS.
+# download a contract's model notebook. IPFS content never changes, so the CID
+# is a strong ETag: conditional requests are answered without touching the
+# gateway, and cached files are sent by send_file, which handles Range
+# requests and lets gunicorn hand the file to the kernel with sendfile. A
+# notebook that isn't cached yet is streamed from the gateway as it arrives
+# and cached for the next request, or with `Prefer: respond-async` fetched by
+# a background job (see /prefetch-model).
 @app.route('/retrieve-model/<contract_id>/<ipfs_hash>', methods=['GET'])
 def get_ipfs_model(ipfs_hash, contract_id):
-  print(f"Retrieving model with IPFS hash: {ipfs_hash}, Contract ID: {contract_id}")
+  download_name = f"{contract_id}_model.ipynb"
   try:
-    filepath = retrieve_model(ipfs_hash, contract_id)
-    return filepath
+    if request.if_none_match.contains(ipfs_hash):
+      response = Response(status=304)
+      response.set_etag(ipfs_hash)
+    else:
+      cached_path = blob_cache.path(ipfs_hash)
+      cache_status = 'HIT' if cached_path else 'MISS'
+      if cached_path is None and 'respond-async' in request.headers.get('Prefer', ''):
+        return job_response("prefetch-model", ipfs_hash, prefetch_model, ipfs_hash)
+      if cached_path is None and request.range:
+        # resuming a download that never finished caching, fetch it whole first
+        cached_path = fetch_to_cache(ipfs_hash)
+      if cached_path is not None:
+        response = send_file(
+          cached_path, mimetype=MODEL_MIMETYPE, as_attachment=True, download_name=download_name,
+          etag=ipfs_hash, conditional=True, max_age=MODEL_MAX_AGE
+        )
+      else:
+        chunks, length = stream_from_ipfs(ipfs_hash)
+        response = Response(chunks, mimetype=MODEL_MIMETYPE, direct_passthrough=True)
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        if length is not None:
+          response.content_length = length
+        response.set_etag(ipfs_hash)
+      response.headers['X-Cache'] = cache_status
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+  except (requests.RequestException, BlobMismatch) as e:
+    log.warning("Fetching model %s from the gateway failed: %s", ipfs_hash, e)
+    return jsonify({"error": "Failed to fetch the model from IPFS", "details": str(e)}), 502
   except Exception as e:
+    log.exception("Serving model %s failed", ipfs_hash)
     return jsonify({"error": str(e)}), 500
 
-# retrieve for aggregation
+  response.headers['Accept-Ranges'] = 'bytes'
+  response.headers['Cache-Control'] = f'public, max-age={MODEL_MAX_AGE}, immutable'
+  return response
+
+# answer for a submitted job: 202 with where to poll, 503 when the queue is full.
+def job_response(kind, key, fn, *args):
+  try:
+    job, created = job_queue.submit(kind, key, fn, *args)
+  except JobQueueFull as e:
+    response = jsonify({"error": "Too many queued jobs, try again later", "details": str(e)})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+  response = jsonify(dict(job, deduplicated=not created, statusUrl=f"/jobs/{job['jobId']}"))
+  response.headers['Location'] = f"/jobs/{job['jobId']}"
+  return response, 202
+
+def prefetch_model(ipfs_hash):
+  try:
+    return {"sizeBytes": os.path.getsize(fetch_to_cache(ipfs_hash))}
+  except (requests.RequestException, BlobMismatch) as e:
+    raise JobFailed(f"Failed to fetch the model from IPFS: {e}")
+
+# warm the cache with a model notebook in the background, so the download
+# itself is served from disk instead of waiting on the gateway.
+@app.route('/prefetch-model/<contract_id>/<ipfs_hash>', methods=['POST'])
+def prefetch_ipfs_model(contract_id, ipfs_hash):
+  try:
+    cached_path = blob_cache.path(ipfs_hash)
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+  if cached_path is not None:
+    return jsonify({"status": "succeeded", "result": {"sizeBytes": os.path.getsize(cached_path)}}), 200
+  return job_response("prefetch-model", ipfs_hash, prefetch_model, ipfs_hash)
+
+# status and, once finished, result or error of a background job
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+  job = job_queue.get(job_id)
+  if job is None:
+    return jsonify({"error": "Job not found"}), 404
+  return jsonify(job), 200
+
+# stage contributors' parameters for the aggregator. Without a contractId
+# they are staged in the default round for the notebook, but never folded
+# into a contract's model.
 @app.route('/aggregate', methods=['POST'])
 def aggregate_model():
   try:
-    global shared_data
-    params = request.json
-    print('params', params)
-    shared_data = params
-    return jsonify({"message": "Model data stored for aggregation successfully"}), 200
+    params = request.get_json(silent=True)
+    if params is None:
+      raise ValueError("Request body must be JSON")
+    round_id = request.args.get('contractId')
+    if round_id is None:
+      if AGGREGATION_AUTO:
+        raise ValueError("contractId is required")
+      round_id = DEFAULT_ROUND
+    if not isinstance(params, dict):
+      raise ValueError("Parameters must be an object keyed by contributor")
+    # only packages that aren't in the round's aggregate yet are fetched
+    queued = aggregation_scheduler.submit(round_id, params) if AGGREGATION_AUTO else 0
+    version = staging_store.put(round_id, request.get_data())
+    log.info("Staged %d parameter sets for round %s (version %s)", len(params), round_id, version)
+    return jsonify({"message": "Model data stored for aggregation successfully", "queued": queued}), 200
 
   except ValueError as e:
-    print(f"ValueError: {e}")
+    log.warning("Invalid aggregation parameters: %s", e)
     return jsonify({"error": "Invalid parameters", "details": str(e)}), 400
   except Exception as e:
-    print(f"Exception: {e}")
+    log.exception("Staging aggregation parameters failed")
     return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
 
+# progress of a contract's incremental aggregation
+@app.route('/aggregation-status/<contract_id>', methods=['GET'])
+def aggregation_status(contract_id):
+  try:
+    return jsonify(aggregation_scheduler.status(contract_id)), 200
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+
+# score a batch of transactions with the contract's latest global model. The
+# body is JSON rows, an .npy array or raw float32 rows with X-Row-Width; an
+# Accept of application/x-npy returns the scores as an .npy array.
+@app.route('/score/<contract_id>', methods=['POST'])
+def score_transactions(contract_id):
+  try:
+    rows = parse_rows(request.get_data(), request.content_type, request.headers.get('X-Row-Width', type=int))
+    scores, version = scoring_service.score(contract_id, rows)
+  except ModelNotFound as e:
+    return jsonify({"error": str(e)}), 404
+  except ValueError as e:
+    return jsonify({"error": "Invalid rows", "details": str(e)}), 400
+  except Exception as e:
+    log.exception("Scoring failed for contract %s", contract_id)
+    return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+  if request.accept_mimetypes.best == 'application/x-npy':
+    buffer = io.BytesIO()
+    np.save(buffer, scores.astype(np.float32), allow_pickle=False)
+    response = Response(buffer.getvalue(), mimetype='application/x-npy')
+  else:
+    response = jsonify({"contractId": contract_id, "modelVersion": version, "scores": scores.tolist()})
+  response.headers['X-Model-Version'] = str(version)
+  return response, 200
+
+# latency percentiles and throughput of the scoring endpoint per contract
+@app.route('/score-stats', methods=['GET'])
+def score_stats():
+  return jsonify(scoring_service.stats()), 200
+
+# the latest published global model of a contract
+@app.route('/global-model/<contract_id>', methods=['GET'])
+def global_model_info(contract_id):
+  try:
+    info = model_registry.describe(contract_id)
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+  if info is None:
+    return jsonify({"error": "No global model has been published"}), 404
+  return jsonify(info), 200
+
+# hit/miss counters of the user and listing lookup cache
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+  return jsonify(get_cache_stats()), 200
+
 # check for address existence
 @app.route('/check-address/<address>', methods=['GET'])
 def check_address(address):
@@ -82,9 +323,19 @@ def get_user(address):
     if not address:
         return jsonify({"error": "Address parameter is required"}), 400
 
-    user_data = get_user_by_address(address)
+    # e.g. ?fields=reputation,admin skips the listing lookups; the embedded
+    # listings are the first listingsLimit of each, see /get-created-listings
+    # and /get-subscribed-listings for the rest
+    try:
+        listings_limit = int_arg('listingsLimit', LIST_PAGE_SIZE, 1, LIST_MAX_PAGE_SIZE)
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    user_data = get_user_with_listings(address, fields, listings_limit)
     if user_data:
-        user_data['_id'] = str(user_data['_id'])
+        if '_id' in user_data:
+            user_data['_id'] = str(user_data['_id'])
         return jsonify(user_data), 200
     else:
         return jsonify({"error": "User not found"}), 404
@@ -101,6 +352,10 @@ def add_listing():
 
     if not address or not contract_id or not created_at or not expires_at or not url:
         return jsonify({"error": "All parameters (address, contractId, createdAt, expiresAt, URL) are required"}), 400
+    try:
+        check_timestamps(data, 'createdAt', 'expiresAt')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     if not address_exists(address):
         return jsonify({"error": "User does not exist"}), 404
@@ -118,9 +373,22 @@ def get_filtered_listings_endpoint(address):
     if not address:
         return jsonify({"error": "Address parameter is required"}), 400
 
-    listings = get_filtered_listings(address)
-    if listings is not None:
-        return jsonify(listings), 200
+    try:
+        limit, cursor = page_args(decode_cursor)
+        fields = parse_fields(request.args.get('fields'), FILTERED_LISTING_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    result = get_filtered_listings(address, limit, cursor)
+    if result is not None:
+        listings, next_cursor, last_modified = result
+        response = page_response([select_fields(listing, fields) for listing in listings], next_cursor)
+        # polling clients revalidate and get a 304 while the page is unchanged
+        response.add_etag()
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     else:
         return jsonify({"error": "Failed to retrieve listings"}), 500
 
@@ -138,6 +406,10 @@ def add_subscribed_listing():
 
     if not all([address, contract_id, created_at, expires_at, url, creator_address, reputation]):
         return jsonify({"error": "All parameters are required"}), 400
+    try:
+        check_timestamps(data, 'createdAt', 'expiresAt')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     if not address_exists(address):
         return jsonify({"error": "User does not exist"}), 404
@@ -153,9 +425,15 @@ def get_subscribed_listings_endpoint(address):
     if not address:
         return jsonify({"error": "Address parameter is required"}), 400
 
-    listings = get_subscribed_listings(address)
-    if listings is not None:
-        return jsonify(listings), 200
+    try:
+        limit, cursor = page_args()
+        fields = parse_fields(request.args.get('fields'), SUBSCRIBED_LISTING_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    result = get_subscribed_listings(address, limit, cursor, fields)
+    if result is not None:
+        return page_response(*result), 200
     else:
         return jsonify({"error": "Failed to retrieve subscribed listings"}), 500
 
@@ -164,64 +442,50 @@ def get_subscribed_listings_endpoint(address):
 def update_reputation():
   data = request.json
   if not data:
-    print("Request body is missing")
     return jsonify({"error": "Request body is required"}), 400
 
   address = data.get('address')
   action = data.get('action')
 
   if not address:
-    print("Address is missing")
     return jsonify({"error": "Address is required"}), 400
   if action not in ['merit', 'demerit']:
-    print(f"Invalid action: {action}")
     return jsonify({"error": "Action must be either 'merit' or 'demerit'"}), 400
 
-  user = get_user_by_address(address)
-  if not user:
-    print(f"User not found for address: {address}")
-    return jsonify({"error": "User not found"}), 404
-
-  if 'reputation' not in user:
-    print(f"User has no reputation score for address: {address}")
-    return jsonify({"error": "User has no reputation score"}), 400
-
-  current_reputation = user['reputation']
-  print(f"Current reputation for address {address}: {current_reputation}")
+  results = apply_reputation_changes([address] if action == 'merit' else [], [address] if action == 'demerit' else [])
+  if results is None:
+    return jsonify({"error": "Failed to update reputation"}), 500
 
-  if action == 'merit':
-    new_reputation = min(100, current_reputation + 1)
-  else:
-    new_reputation = max(0, current_reputation - 2)
+  if results["failed"]:
+    reason = results["failed"][0]["reason"]
+    return jsonify({"error": reason}), 404 if reason == "User not found" else 400
 
-  print(f"New reputation for address {address}: {new_reputation}")
+  change = results["successful"][0]
+  current_reputation = change["previousReputation"]
+  new_reputation = change["newReputation"]
+  log.info("Reputation of %s: %s -> %s", address, current_reputation, new_reputation)
 
-  if new_reputation != current_reputation:
-    success = update_user_reputation(address, new_reputation)
-  else:
-    success = True
-
-  if success:
-    print(f"Reputation handled successfully for address {address}")
-    return jsonify({
-      "message": "Reputation handled successfully",
-      "previousReputation": current_reputation,
-      "newReputation": new_reputation,
-      "changed": new_reputation != current_reputation
-    }), 200
-  else:
-    print(f"Failed to update reputation for address {address}")
-    return jsonify({"error": "Failed to update reputation"}), 500
+  return jsonify({
+    "message": "Reputation handled successfully",
+    "previousReputation": current_reputation,
+    "newReputation": new_reputation,
+    "changed": new_reputation != current_reputation
+  }), 200
 
 @app.route('/get-created-listings/<address>', methods=['GET'])
 def get_created_listings_endpoint(address):
     if not address:
         return jsonify({"error": "Address parameter is required"}), 400
 
-    listings = get_created_listings(address)
-    print(f"Created listings for address {address}: {listings}")
-    if listings is not None:
-        return jsonify(listings), 200
+    try:
+        limit, cursor = page_args()
+        fields = parse_fields(request.args.get('fields'), CREATED_LISTING_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    result = get_created_listings(address, limit, cursor, fields)
+    if result is not None:
+        return page_response(*result), 200
     else:
         return jsonify({"error": "Failed to retrieve created listings"}), 500
 
@@ -235,62 +499,9 @@ def update_multiple_reputations():
   merit_addresses = data.get('meritAddresses', [])
   demerit_addresses = data.get('demeritAddresses', [])
 
-  results = {
-    "successful": [],
-    "failed": []
-  }
-
-  # Process merit addresses
-  for address in merit_addresses:
-    user = get_user_by_address(address)
-    if not user or 'reputation' not in user:
-      results["failed"].append({
-        "address": address,
-        "reason": "User not found or no reputation score"
-      })
-      continue
-
-    current_reputation = user['reputation']
-    new_reputation = min(100, current_reputation + 1)
-
-    if update_user_reputation(address, new_reputation):
-      results["successful"].append({
-        "address": address,
-        "previousReputation": current_reputation,
-        "newReputation": new_reputation,
-        "action": "merit"
-      })
-    else:
-      results["failed"].append({
-        "address": address,
-        "reason": "Database update failed"
-      })
-
-  # Process demerit addresses
-  for address in demerit_addresses:
-    user = get_user_by_address(address)
-    if not user or 'reputation' not in user:
-      results["failed"].append({
-        "address": address,
-        "reason": "User not found or no reputation score"
-      })
-      continue
-
-    current_reputation = user['reputation']
-    new_reputation = max(0, current_reputation - 2)
-
-    if update_user_reputation(address, new_reputation):
-      results["successful"].append({
-        "address": address,
-        "previousReputation": current_reputation,
-        "newReputation": new_reputation,
-        "action": "demerit"
-      })
-    else:
-      results["failed"].append({
-        "address": address,
-        "reason": "Database update failed"
-      })
+  results = apply_reputation_changes(merit_addresses, demerit_addresses)
+  if results is None:
+    return jsonify({"error": "Failed to update reputations"}), 500
 
   return jsonify({
     "message": f"Processed {len(results['successful'])} successful updates and {len(results['failed'])} failed updates",
@@ -334,6 +545,14 @@ def update_feedback_endpoint():
     else:
         return jsonify({"error": "Failed to update feedback"}), 500
 
+def report_listing_job(contract_id):
+    result = add_reported_listing(contract_id)
+    if result is False:
+        raise JobFailed("Listing already reported or not found")
+    if result is None:
+        raise RuntimeError("Failed to report listing")
+    return {"message": "Listing reported successfully", "reportId": str(result)}
+
 @app.route('/report-listing', methods=['POST'])
 def report_listing():
     data = request.json
@@ -344,19 +563,23 @@ def report_listing():
     if not contract_id:
         return jsonify({"error": "Contract ID is required"}), 400
 
-    result = add_reported_listing(contract_id)
-    if result:
-        return jsonify({"message": "Listing reported successfully", "reportId": str(result)}), 200
-    elif result is False:
-        return jsonify({"error": "Listing already reported or not found"}), 400
-    else:
-        return jsonify({"error": "Failed to report listing"}), 500
+    # gathering the subscribers takes several queries, the report is filed
+    # as a job and the client polls /jobs/<id> for the reportId
+    return job_response("report-listing", contract_id, report_listing_job, contract_id)
 
 @app.route('/get-reported-listings', methods=['GET'])
 def get_reported_listings_endpoint():
-    listings = get_reported_listings()
-    if listings is not None:
-        return jsonify(listings), 200
+    # subscribersLimit trims each report's subscriberAddresses
+    try:
+        subscribers_limit = int_arg('subscribersLimit', minimum=0)
+        limit, cursor = page_args()
+        fields = parse_fields(request.args.get('fields'), REPORTED_LISTING_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    result = get_reported_listings(limit, cursor, fields, subscribers_limit)
+    if result is not None:
+        return page_response(*result), 200
     else:
         return jsonify({"error": "Failed to retrieve reported listings"}), 500
 
@@ -378,5 +601,34 @@ def update_reported_listing_status_endpoint():
     else:
         return jsonify({"error": "Failed to update status"}), 500
 
+# move expired and paid listings to the archive now instead of waiting for
+# the scheduled run
+@app.route('/archive-listings', methods=['POST'])
+def archive_listings_endpoint():
+  return job_response("archive-listings", "all", archive_listings)
+
+# a user's archived created or subscribed listings, most recently expired
+# first, paged with the X-Next-Cursor header like /get-filtered-listings
+@app.route('/archived-listings/<kind>/<address>', methods=['GET'])
+def archived_listings(kind, address):
+  fetch = {"created": get_archived_created_listings, "subscribed": get_archived_subscribed_listings}.get(kind)
+  if fetch is None:
+    return jsonify({"error": "Archive kind must be 'created' or 'subscribed'"}), 404
+  try:
+    limit, cursor = page_args(decode_cursor, ARCHIVE_PAGE_SIZE, ARCHIVE_MAX_PAGE_SIZE)
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+
+  result = fetch(address, limit, cursor)
+  if result is None:
+    return jsonify({"error": "Failed to retrieve archived listings"}), 500
+  return page_response(*result), 200
+
+# development server; production mode was handed over to serve.py above.
+# The reloader runs this module in a watcher process and again in the
+# serving process, background work only starts in the latter.
 if __name__ == '__main__':
+  if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    warm_up()
+    archive_schedule.start()
   app.run(debug=True)
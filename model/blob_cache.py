@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import sqlite3
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+from instrumentation import get_logger
+from unixfs_cid import parse_cid, cid_hasher, matches_cid
+
+# IPFS content is immutable, so downloads are kept on disk keyed by their CID.
+# Each blob is stored as <dir>/<cid[:2]>/<cid> and is only admitted once its
+# content hashes to the CID it was requested by (see unixfs_cid); a truncated
+# or wrong gateway response raises BlobMismatch and is never cached. Blobs are
+# written to a temp file and renamed into place.
+#
+# Sizes and last use times are kept in <dir>/index.sqlite3, shared by every
+# worker process, so hits, stats and eviction never read the blobs or walk
+# the directory. Once the cache exceeds max_bytes the least recently used
+# blobs are evicted; last use is recorded at most every USED_AT_RESOLUTION
+# seconds per blob, so most hits don't write to the index.
+
+load_dotenv()
+
+log = get_logger("blob_cache")
+
+CID_PATTERN = re.compile(r'^[A-Za-z0-9]{16,128}$')
+USED_AT_RESOLUTION = 60
+
+class BlobMismatch(Exception):
+  pass
+
+class BlobCache:
+  def __init__(self, directory, max_bytes):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def _connection(self):
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      os.makedirs(self.directory, exist_ok=True)
+      connection = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), timeout=30, isolation_level=None)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      connection.execute("BEGIN IMMEDIATE")
+      try:
+        created = connection.execute(
+          "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blobs'"
+        ).fetchone() is None
+        if created:
+          connection.execute(
+            "CREATE TABLE blobs (cid TEXT PRIMARY KEY, size INTEGER NOT NULL, used_at REAL NOT NULL)"
+          )
+          connection.execute("CREATE INDEX blobs_used_at ON blobs (used_at)")
+          self._drop_unindexed()
+        connection.execute("COMMIT")
+      except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+      self._local.connection = connection
+    return connection
+
+  # blobs from before the index was created were never checked against
+  # their CID, they are fetched again when next requested. Only files named
+  # like blobs (and their .sha256 digests) in shard directories are removed,
+  # in case the directory is shared with other files.
+  def _drop_unindexed(self):
+    for shard in os.listdir(self.directory):
+      shard_path = os.path.join(self.directory, shard)
+      if len(shard) != 2 or not os.path.isdir(shard_path):
+        continue
+      for name in os.listdir(shard_path):
+        cid = name[:-len(".sha256")] if name.endswith(".sha256") else name
+        if not cid.startswith(shard) or not self._is_cid(cid):
+          continue
+        try:
+          os.remove(os.path.join(shard_path, name))
+        except FileNotFoundError:
+          pass
+
+  @staticmethod
+  def _is_cid(name):
+    if not CID_PATTERN.match(name):
+      return False
+    try:
+      parse_cid(name)
+    except ValueError:
+      return False
+    return True
+
+  def _blob_path(self, cid):
+    if not CID_PATTERN.match(cid or ''):
+      raise ValueError(f"Invalid IPFS hash: {cid}")
+    parse_cid(cid)
+    return os.path.join(self.directory, cid[:2], cid)
+
+  def path(self, cid):
+    blob_path = self._blob_path(cid)
+    connection = self._connection()
+    row = connection.execute("SELECT size, used_at FROM blobs WHERE cid = ?", (cid,)).fetchone()
+    if row is not None:
+      try:
+        size = os.stat(blob_path).st_size
+      except FileNotFoundError:
+        size = None
+      if size == row[0]:
+        now = time.time()
+        if now - row[1] > USED_AT_RESOLUTION:
+          connection.execute("UPDATE blobs SET used_at = ? WHERE cid = ?", (now, cid))
+        self.hits += 1
+        return blob_path
+      self._forget(cid, blob_path)
+    self.misses += 1
+    return None
+
+  def get(self, cid):
+    blob_path = self.path(cid)
+    if blob_path is None:
+      return None
+    with open(blob_path, 'rb') as f:
+      return f.read()
+
+  def put(self, cid, data):
+    return self.put_stream(cid, [data])
+
+  # streams an iterable of byte chunks into the cache without buffering it.
+  def put_stream(self, cid, chunks):
+    for _ in self.stream_through(cid, chunks):
+      pass
+    return self._blob_path(cid)
+
+  # passes chunks through while writing them to the cache, so a download can
+  # be forwarded as it arrives. The last chunk is held back until the content
+  # has been checked against the CID: on a mismatch BlobMismatch is raised
+  # instead, so the receiver never gets a complete body. The blob only
+  # appears in the cache once every chunk has been consumed; closing the
+  # generator early discards it.
+  def stream_through(self, cid, chunks):
+    blob_path = self._blob_path(cid)
+    connection = self._connection()
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    hasher = cid_hasher(cid)
+    size = 0
+    pending = None
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(blob_path), suffix='.part')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        for chunk in chunks:
+          hasher.update(chunk)
+          f.write(chunk)
+          size += len(chunk)
+          if pending is not None:
+            yield pending
+          pending = chunk
+      if not matches_cid(hasher, cid):
+        log.warning("Discarded %s bytes received for %s, the content doesn't match the CID", size, cid)
+        raise BlobMismatch(f"Content received for {cid} doesn't match its CID")
+      os.replace(temp_path, blob_path)
+    except BaseException:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+      raise
+    connection.execute(
+      "INSERT OR REPLACE INTO blobs (cid, size, used_at) VALUES (?, ?, ?)", (cid, size, time.time())
+    )
+    self._evict()
+    if pending is not None:
+      yield pending
+
+  def stats(self):
+    size, count = self._connection().execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM blobs").fetchone()
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+      "blobs": count,
+      "sizeBytes": size,
+      "maxBytes": self.max_bytes
+    }
+
+  def _forget(self, cid, blob_path):
+    self._connection().execute("DELETE FROM blobs WHERE cid = ?", (cid,))
+    try:
+      os.remove(blob_path)
+    except FileNotFoundError:
+      pass
+
+  def _evict(self):
+    connection = self._connection()
+    with self._lock:
+      connection.execute("BEGIN IMMEDIATE")
+      try:
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        evicted = []
+        if total > self.max_bytes:
+          for cid, size in connection.execute("SELECT cid, size FROM blobs ORDER BY used_at"):
+            if total <= self.max_bytes:
+              break
+            evicted.append(cid)
+            total -= size
+          connection.executemany("DELETE FROM blobs WHERE cid = ?", [(cid,) for cid in evicted])
+        connection.execute("COMMIT")
+      except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    for cid in evicted:
+      try:
+        os.remove(os.path.join(self.directory, cid[:2], cid))
+      except FileNotFoundError:
+        pass
+    self.evictions += len(evicted)
+
+blob_cache = BlobCache(
+  directory=os.getenv("IPFS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '.ipfs_cache')),
+  max_bytes=int(os.getenv("IPFS_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+)
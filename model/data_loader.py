@@ -0,0 +1,164 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+# Columnar, memory-mapped cache of a training CSV (or Parquet shard).
+#
+# The first load parses the source once in chunks and writes the feature
+# matrix as a raw float32 file plus a label file; later loads memory-map them,
+# so reruns skip parsing entirely. Float32 is what scikit-learn's forests
+# train on, so the mapped matrix is passed to fit() without a conversion copy.
+#
+# load_split goes one step further and lays a copy of the cache out in
+# train-then-test order for a given split, so xTrain and xTest are plain
+# slices of one memmap. The row order matches train_test_split on the
+# original data with the same test_size/random_state.
+#
+# The copy is deliberate. train_test_split shuffles, so the training rows are
+# scattered over the base cache, and indexing the base memmap with them
+# (features[train_index]) gathers ~80% of the dataset into RAM on every load,
+# which is what mapping the cache is meant to avoid; fit() needs xTrain as one
+# array, so the rows can't stay where they are. The copy costs disk instead:
+# it is written once per split, in blocks, and mapped on later loads. Only the
+# most recently written split of a source is kept, so the cache never holds
+# more than twice the dataset.
+
+CHUNK_SIZE = 100_000
+GATHER_BLOCK = 65_536
+
+def _cache_paths(source, cache_dir, suffix=""):
+  cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source)), ".data_cache")
+  os.makedirs(cache_dir, exist_ok=True)
+  base = os.path.join(cache_dir, os.path.splitext(os.path.basename(source))[0] + suffix)
+  return {"features": base + ".X.f32", "labels": base + ".y.i32", "meta": base + ".meta.json"}
+
+def _source_signature(source):
+  stat = os.stat(source)
+  return {"source": os.path.abspath(source), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def _read_meta(paths, signature, **expected):
+  try:
+    with open(paths["meta"]) as f:
+      meta = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if meta.get("signature") != signature or any(meta.get(key) != value for key, value in expected.items()):
+    return None
+  if not os.path.exists(paths["features"]) or not os.path.exists(paths["labels"]):
+    return None
+  return meta
+
+def _write_meta(paths, meta):
+  temp_path = paths["meta"] + ".part"
+  with open(temp_path, "w") as f:
+    json.dump(meta, f)
+  os.replace(temp_path, paths["meta"])
+
+def _iter_chunks(source):
+  if source.endswith(".parquet"):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(source).iter_batches(batch_size=CHUNK_SIZE):
+      yield batch.to_pandas()
+  else:
+    yield from pd.read_csv(source, chunksize=CHUNK_SIZE)
+
+def build_cache(source, label_column="Class", cache_dir=None):
+  paths = _cache_paths(source, cache_dir)
+  signature = _source_signature(source)
+
+  rows = 0
+  columns = None
+  with open(paths["features"] + ".part", "wb") as features, open(paths["labels"] + ".part", "wb") as labels:
+    for chunk in _iter_chunks(source):
+      if columns is None:
+        columns = [column for column in chunk.columns if column != label_column]
+      features.write(np.ascontiguousarray(chunk[columns].to_numpy(dtype=np.float32)).tobytes())
+      labels.write(chunk[label_column].to_numpy(dtype=np.int32).tobytes())
+      rows += len(chunk)
+  os.replace(paths["features"] + ".part", paths["features"])
+  os.replace(paths["labels"] + ".part", paths["labels"])
+
+  meta = {"signature": signature, "label_column": label_column, "columns": columns, "rows": rows}
+  _write_meta(paths, meta)
+  return meta
+
+def _map(paths, meta, mode="r"):
+  shape = (meta["rows"], len(meta["columns"]))
+  if meta["rows"] == 0:
+    return np.empty(shape, dtype=np.float32), np.empty(0, dtype=np.int32)
+  features = np.memmap(paths["features"], dtype=np.float32, mode=mode, shape=shape)
+  labels = np.memmap(paths["labels"], dtype=np.int32, mode=mode, shape=(meta["rows"],))
+  return features, labels
+
+# (features, labels, feature column names), building the cache when stale.
+def load_dataset(source, label_column="Class", cache_dir=None):
+  paths = _cache_paths(source, cache_dir)
+  meta = _read_meta(paths, _source_signature(source), label_column=label_column)
+  if meta is None:
+    meta = build_cache(source, label_column, cache_dir)
+  features, labels = _map(paths, meta)
+  return features, labels, meta["columns"]
+
+def split_indices(labels, test_size=0.2, random_state=42, stratify=False):
+  return train_test_split(
+    np.arange(len(labels)),
+    test_size=test_size,
+    random_state=random_state,
+    stratify=np.asarray(labels) if stratify else None
+  )
+
+def _remove_other_splits(source, cache_dir, keep):
+  base = _cache_paths(source, cache_dir)["meta"][:-len(".meta.json")]
+  for path in glob.glob(glob.escape(base) + ".split-*"):
+    if path not in keep.values():
+      try:
+        os.remove(path)
+      except OSError:
+        # still mapped by another process on Windows, removed next time
+        pass
+
+def load_split(source, label_column="Class", test_size=0.2, random_state=42, stratify=False, cache_dir=None):
+  features, labels, columns = load_dataset(source, label_column, cache_dir)
+  split = {"test_size": test_size, "random_state": random_state, "stratify": stratify}
+  split_key = hashlib.sha1(json.dumps(split, sort_keys=True).encode()).hexdigest()[:10]
+  paths = _cache_paths(source, cache_dir, suffix=f".split-{split_key}")
+  signature = _source_signature(source)
+
+  meta = _read_meta(paths, signature, label_column=label_column, split=split)
+  if meta is None:
+    train_index, test_index = split_indices(labels, test_size, random_state, stratify)
+    order = np.concatenate([train_index, test_index])
+    meta = {
+      "signature": signature,
+      "label_column": label_column,
+      "columns": columns,
+      "rows": len(order),
+      "train_rows": len(train_index),
+      "split": split
+    }
+    ordered_features = np.memmap(paths["features"], dtype=np.float32, mode="w+", shape=features.shape)
+    ordered_labels = np.memmap(paths["labels"], dtype=np.int32, mode="w+", shape=labels.shape)
+    # gather in blocks so only one block of rows is resident at a time
+    for start in range(0, len(order), GATHER_BLOCK):
+      block = np.sort(order[start:start + GATHER_BLOCK])
+      positions = np.argsort(np.argsort(order[start:start + GATHER_BLOCK]))
+      ordered_features[start:start + len(block)] = features[block][positions]
+      ordered_labels[start:start + len(block)] = labels[block][positions]
+    ordered_features.flush()
+    ordered_labels.flush()
+    del ordered_features, ordered_labels
+    _write_meta(paths, meta)
+    _remove_other_splits(source, cache_dir, paths)
+
+  ordered_features, ordered_labels = _map(paths, meta)
+  train_rows = meta["train_rows"]
+  return (
+    ordered_features[:train_rows],
+    ordered_features[train_rows:],
+    ordered_labels[:train_rows],
+    ordered_labels[train_rows:]
+  )
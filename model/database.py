@@ -1,66 +1,413 @@
 import os
+import json
+import base64
+import uuid
 import time
-from pymongo import MongoClient
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne, UpdateMany
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+from instrumentation import get_logger, mongo_listener
+from listing_feed import ListingFeed, feed_timestamp
 
 load_dotenv()
 
+log = get_logger("database")
+
 MONGO_URI = os.getenv("MONGO_CLIENT")
-client = MongoClient(MONGO_URI)
-db = client['DMLCHAIN']
+
+# Connection pool settings, sized per worker process. In production this
+# module is only imported by the workers, after the fork (see serve.py), and
+# connect=False further defers the first connection until the client is used.
+MONGO_POOL_OPTIONS = {
+  "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+  "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "5")),
+  "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+  "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+  "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+  "retryWrites": True,
+  "connect": False
+}
+
+# mongo_listener times every command for /metrics
+client = MongoClient(MONGO_URI, event_listeners=[mongo_listener], **MONGO_POOL_OPTIONS)
+db = client[os.getenv("MONGO_DB_NAME", "DMLCHAIN")]
 user_collection = db['users']
 reported_listing_collection = db['reportedListings']
+created_listing_collection = db['createdListings']
+subscribed_listing_collection = db['subscribedListings']
+# expired and paid listings moved out of the live collections by archive_listings.py
+archived_created_listing_collection = db['archivedCreatedListings']
+archived_subscribed_listing_collection = db['archivedSubscribedListings']
+
+# expiresAt is sent by the frontend as an ISO string, we keep it as-is for the
+# responses and store a native datetime next to it for indexed range queries.
+EXPIRY_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+MIN_REPUTATION = 0
+MAX_REPUTATION = 100
+REPUTATION_DELTAS = {"merit": 1, "demerit": -2}
+# snapshots a reputation run left behind, e.g. when its worker died before
+# removing them, are removed by the next run on the same user once they are
+# this old. No run takes nearly as long.
+REPUTATION_BATCH_TTL = int(os.getenv("REPUTATION_BATCH_TTL_SECONDS", "3600"))
+
+# /get-filtered-listings reads the in-memory feed in listing_feed.py, set to
+# false to run the aggregation pipeline per request instead.
+MARKETPLACE_FEED = os.getenv("MARKETPLACE_FEED", "true").lower() == "true"
+
+# response shapes of the listing endpoints, matching the old embedded arrays.
+CREATED_LISTING_PROJECTION = {"_id": 0, "contractId": 1, "createdAt": 1, "expiresAt": 1, "url": 1, "paid": 1}
+SUBSCRIBED_LISTING_PROJECTION = {"_id": 0, "subscriberAddress": 0}
+ARCHIVED_LISTING_PROJECTION = {"_id": 0, "feedUpdatedAt": 0}
+# fields a client may pick with ?fields=, see responses.parse_fields
+CREATED_LISTING_FIELDS = {"contractId", "createdAt", "expiresAt", "url", "paid"}
+SUBSCRIBED_LISTING_FIELDS = {"contractId", "createdAt", "expiresAt", "url", "creatorAddress", "reputation", "feedback"}
+REPORTED_LISTING_FIELDS = {"contractId", "creatorAddress", "subscriberAddresses", "reportedAt", "status"}
+
+# page size of the list endpoints, and of the listings /get-user embeds
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "100"))
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "1000"))
+
+# In-process read-through cache for user and listing lookups. Entries expire
+# after a TTL and the least recently used ones are evicted once the cache is
+# full. Each worker process has its own, so only lookups that a write in
+# another worker can't make stale are served from it without checking:
+#
+# - that an address exists; users are never deleted, and a missing user is
+#   always looked up again. User documents themselves (reputation, admin)
+#   are always read from MongoDB.
+# - the first page of a user's created and subscribed listings, stored with
+#   the listingsVersion of the user document it was read under. Every write
+#   to a user's listings bumps that version after the write, and a page is
+#   only served while the version read from MongoDB still matches, so the
+#   next lookup in any worker sees the write.
+class LookupCache:
+  def __init__(self, max_entries, ttl_seconds):
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry[0] < time.monotonic():
+        if entry is not None:
+          del self._entries[key]
+        self.misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return entry[1]
+
+  def set(self, key, value):
+    with self._lock:
+      self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def invalidate(self, *keys):
+    with self._lock:
+      for key in keys:
+        if self._entries.pop(key, None) is not None:
+          self.invalidations += 1
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "hitRate": self.hits / lookups if lookups else 0.0,
+        "evictions": self.evictions,
+        "invalidations": self.invalidations,
+        "size": len(self._entries),
+        "maxEntries": self.max_entries,
+        "ttlSeconds": self.ttl_seconds
+      }
+
+lookup_cache = LookupCache(
+  max_entries=int(os.getenv("LOOKUP_CACHE_SIZE", "10000")),
+  ttl_seconds=float(os.getenv("LOOKUP_CACHE_TTL", "30"))
+)
+
+# unexpired listings by reputation threshold, kept current by the writes below
+marketplace_feed = ListingFeed(created_listing_collection)
+
+def get_cache_stats():
+  return lookup_cache.stats()
+
+# the version the cached listing pages of a user were read under, None when
+# there is no such user.
+def listings_version(address):
+  user = user_collection.find_one(user_filter(address), {"_id": 0, "listingsVersion": 1})
+  if user is None:
+    return None
+  return user.get("listingsVersion", 0)
+
+def bump_listings_version(addresses):
+  if addresses:
+    user_collection.update_many(users_filter(addresses), {"$inc": {"listingsVersion": 1}})
+
+# called after a write to these users' listings, for every worker's cache
+def invalidate_created_listings(*addresses):
+  bump_listings_version(addresses)
+  lookup_cache.invalidate(*[("created", address) for address in addresses])
+
+def invalidate_subscribed_listings(*addresses):
+  bump_listings_version(addresses)
+  lookup_cache.invalidate(*[("subscribed", address) for address in addresses])
+
+# first page of a user's created or subscribed listings, from the cache while
+# the user's listingsVersion hasn't changed. None when there is no such user.
+def cached_listings_page(kind, address, load):
+  version = listings_version(address)
+  if version is None:
+    return None
+  cached = lookup_cache.get((kind, address))
+  if cached is not None and cached[0] == version:
+    return list(cached[1]), cached[2]
+  listings, next_cursor = load()
+  lookup_cache.set((kind, address), (version, listings, next_cursor))
+  return list(listings), next_cursor
+
+def parse_expiry(expires_at):
+  return datetime.strptime(expires_at, EXPIRY_FORMAT).replace(tzinfo=timezone.utc)
+
+# Filters of the queries in this module, one helper per access path.
+# index_audit.py explains the same helpers, so the audit follows any change to
+# what the code sends.
+def user_filter(address):
+  return {"address": address}
+
+def users_filter(addresses):
+  return {"address": {"$in": list(addresses)}}
+
+# users whose reputation the pipeline update can compute on
+def scored_user_filter(address):
+  return {"address": address, "reputation": {"$type": "number"}}
+
+def empty_batches_filter(addresses):
+  return dict(users_filter(addresses), reputationBatches={})
+
+def creator_filter(address):
+  return {"creatorAddress": address}
+
+def subscriber_filter(address):
+  return {"subscriberAddress": address}
+
+def contract_filter(contract_id):
+  return {"contractId": contract_id}
+
+def contracts_filter(contract_ids):
+  return {"contractId": {"$in": list(contract_ids)}}
+
+def created_listing_filter(address, contract_id):
+  return {"creatorAddress": address, "contractId": contract_id}
+
+def subscription_filter(address, contract_id):
+  return {"subscriberAddress": address, "contractId": contract_id}
+
+def pending_reports_filter():
+  return {"status": "pending"}
+
+# query narrowed to the page after an _id cursor, see find_page
+def page_filter(query, after=None):
+  if after is None:
+    return query
+  return dict(query, _id={"$gt": after})
+
+# every access path in this module, created by ensure_indexes at startup and
+# checked by index_audit.py.
+INDEXES = {
+  user_collection: [
+    ("address", {"unique": True, "name": "address"}),
+  ],
+  created_listing_collection: [
+    ("contractId", {"unique": True, "name": "contract_id"}),
+    ("creatorAddress", {"name": "creator"}),
+    ([("creatorReputation", ASCENDING), ("expiresAtTs", ASCENDING)], {"name": "reputation_expiry"}),
+    ([("expiresAtTs", ASCENDING), ("creatorReputation", ASCENDING)], {"name": "expiry_reputation"}),
+    ("feedUpdatedAt", {"name": "feed_updated_at"}),
+  ],
+  subscribed_listing_collection: [
+    ([("subscriberAddress", ASCENDING), ("contractId", ASCENDING)], {"unique": True, "name": "subscriber_contract_id"}),
+    ("contractId", {"name": "contract_id"}),
+  ],
+  reported_listing_collection: [
+    ("contractId", {"unique": True, "name": "contract_id"}),
+    ("status", {"name": "status"}),
+  ],
+  archived_created_listing_collection: [
+    ("contractId", {"unique": True, "name": "contract_id"}),
+    ([("creatorAddress", ASCENDING), ("expiresAtTs", DESCENDING), ("contractId", DESCENDING)], {"name": "creator_expiry"}),
+  ],
+  archived_subscribed_listing_collection: [
+    ([("subscriberAddress", ASCENDING), ("contractId", ASCENDING)], {"unique": True, "name": "subscriber_contract_id"}),
+    ([("subscriberAddress", ASCENDING), ("expiresAtTs", DESCENDING), ("contractId", DESCENDING)], {"name": "subscriber_expiry"}),
+    ("contractId", {"name": "contract_id"}),
+  ],
+}
+
+def ensure_indexes():
+  ok = True
+  for collection, indexes in INDEXES.items():
+    for keys, options in indexes:
+      try:
+        collection.create_index(keys, **options)
+      except Exception as e:
+        # e.g. duplicates left over from before the unique index existed
+        log.error("Failed to create index %s.%s: %s", collection.name, options['name'], e)
+        ok = False
+  return ok
+
+# opens the pool and provisions indexes before a worker takes traffic.
+def warm_up():
+  try:
+    client.admin.command("ping")
+  except Exception as e:
+    log.error("Failed to connect to MongoDB: %s", e)
+    return False
+  return ensure_indexes()
+
+def close_connections():
+  client.close()
+
+# cursors are opaque to clients: base64 of [expiry in ms, contractId].
+def encode_cursor(expires_at_ts, contract_id):
+  millis = int(expires_at_ts.replace(tzinfo=timezone.utc).timestamp() * 1000)
+  raw = json.dumps([millis, contract_id]).encode()
+  return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+  if not cursor:
+    return None
+  try:
+    millis, contract_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc), contract_id
+  except Exception:
+    raise ValueError("Invalid cursor")
+
+# cursors of the lists paged in insertion order: base64 of the last _id.
+def encode_id_cursor(object_id):
+  return base64.urlsafe_b64encode(str(object_id).encode()).decode()
+
+def decode_id_cursor(cursor):
+  if not cursor:
+    return None
+  try:
+    return ObjectId(base64.urlsafe_b64decode(cursor.encode()).decode())
+  except (ValueError, InvalidId):
+    raise ValueError("Invalid cursor")
+
+# the projection returning only the requested fields, or the default one.
+# _id is always returned for the cursor; find_page drops it again.
+def listing_projection(default, fields=None):
+  if fields is None:
+    return {key: value for key, value in default.items() if key != "_id"}
+  return {field: 1 for field in fields}
+
+# (documents, next cursor) of one page in _id order, after the cursor's _id.
+def find_page(collection, query, projection, limit, after=None):
+  documents = list(collection.find(page_filter(query, after), projection).sort("_id", ASCENDING).limit(limit))
+  next_cursor = encode_id_cursor(documents[-1]["_id"]) if len(documents) == limit else None
+  for document in documents:
+    del document["_id"]
+  return documents, next_cursor
 
 def create_user(address):
   try:
     formatted_record = {
       "address": address,
-      "reputation": 100,
-      "createdListings": [],
-      "subscribedListings": []
+      "reputation": 100
     }
     result = user_collection.insert_one(formatted_record)
     return result.inserted_id
   except Exception as e:
-    print(f"An error occurred: {e}")
+    log.exception("Failed to create user %s", address)
     return None
 
 def address_exists(address):
-    try:
-        result = user_collection.find_one({"address": address})
-        return result is not None
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return False
+  if lookup_cache.get(("exists", address)):
+    return True
+  try:
+    exists = user_collection.find_one(user_filter(address), {"_id": 1}) is not None
+  except Exception as e:
+    log.exception("Failed to look up user %s", address)
+    return False
+  if exists:
+    lookup_cache.set(("exists", address), True)
+  return exists
 
 def get_user_by_address(address):
   try:
-    user_record = user_collection.find_one({"address": address})
-    return user_record
+    return user_collection.find_one(user_filter(address), {"listingsVersion": 0, "reputationBatches": 0})
   except Exception as e:
-    print(f"An error occurred: {e}")
+    log.exception("Failed to look up user %s", address)
+    return None
+
+# user document with the first listings_limit of its listings attached, as
+# returned by /get-user. With fields, only those fields are returned and the
+# listings are only looked up when they are asked for.
+def get_user_with_listings(address, fields=None, listings_limit=LIST_PAGE_SIZE):
+  user = get_user_by_address(address)
+  if not user:
     return None
+  if fields is not None:
+    user = {key: value for key, value in user.items() if key in fields}
+  if fields is None or 'createdListings' in fields:
+    created = get_created_listings(address, listings_limit)
+    user['createdListings'] = created[0] if created else []
+  if fields is None or 'subscribedListings' in fields:
+    subscribed = get_subscribed_listings(address, listings_limit)
+    user['subscribedListings'] = subscribed[0] if subscribed else []
+  return user
 
 def add_listing_to_created(address, contract_id, created_at, expires_at, url):
-  listing = {
-    "contractId": contract_id,
-    "createdAt": created_at,
-    "expiresAt": expires_at,
-    "url": url
-  }
   try:
-    user_collection.update_one(
-      {"address": address},
-      {"$push": {"createdListings": listing}}
-    )
+    creator = get_user_by_address(address)
+    if not creator:
+      return False
+
+    listing = {
+      "creatorAddress": address,
+      "creatorReputation": creator.get('reputation', 0),
+      "contractId": contract_id,
+      "createdAt": created_at,
+      "expiresAt": expires_at,
+      "expiresAtTs": parse_expiry(expires_at),
+      "url": url,
+      "feedUpdatedAt": feed_timestamp()
+    }
+    created_listing_collection.insert_one(listing)
+    invalidate_created_listings(address)
+    marketplace_feed.invalidate()
     return True
+  except DuplicateKeyError:
+    log.info("Listing with contract ID %s already exists", contract_id)
+    return False
   except Exception as e:
-    print(f"An error occurred: {e}")
+    log.exception("Failed to add created listing %s", contract_id)
     return None
 
 def add_listing_to_subscribed(address, contract_id, created_at, expires_at, url, creator_address, reputation):
   listing = {
+    "subscriberAddress": address,
     "creatorAddress": creator_address,
     "reputation": reputation,
     "contractId": contract_id,
@@ -70,145 +417,314 @@ def add_listing_to_subscribed(address, contract_id, created_at, expires_at, url,
     "feedback": False
   }
   try:
-    user = user_collection.find_one({
-      "address": address,
-      "subscribedListings.contractId": contract_id
-    })
-
-    if user:
-      return False
-
-    user_collection.update_one(
-      {"address": address},
-      {"$push": {"subscribedListings": listing}}
-    )
+    subscribed_listing_collection.insert_one(listing)
+    invalidate_subscribed_listings(address)
     return True
+  except DuplicateKeyError:
+    return False
   except Exception as e:
-    print(f"An error occurred: {e}")
+    log.exception("Failed to add subscribed listing %s", contract_id)
     return None
 
-def get_subscribed_listings(address):
+# (listings, next cursor) of a page of the user's subscriptions. Only the
+# default first page is cached, see cached_listings_page.
+def get_subscribed_listings(address, limit=LIST_PAGE_SIZE, after=None, fields=None):
   try:
-    user = get_user_by_address(address)
-    if not user:
+    load = lambda: find_page(
+      subscribed_listing_collection,
+      subscriber_filter(address),
+      listing_projection(SUBSCRIBED_LISTING_PROJECTION, fields),
+      limit,
+      after
+    )
+    if after is None and fields is None and limit == LIST_PAGE_SIZE:
+      return cached_listings_page("subscribed", address, load)
+    if not address_exists(address):
       return None
-
-    subscribed_listings = user.get('subscribedListings', [])
-    return subscribed_listings
+    return load()
   except Exception as e:
-    print(f"An error occurred: {e}")
+    log.exception("Failed to fetch subscribed listings of %s", address)
     return None
 
-def get_filtered_listings(requested_address):
+# listings visible to a user of the given reputation, soonest expiry first.
+def filtered_listings_pipeline(user_reputation, now, limit=None, cursor=None):
+  match = {
+    "creatorReputation": {"$lte": user_reputation},
+    "expiresAtTs": {"$gt": now}
+  }
+  if cursor and cursor[0] > now:
+    after_ts, after_id = cursor
+    match["$or"] = [
+      {"expiresAtTs": {"$gt": after_ts}},
+      {"expiresAtTs": after_ts, "contractId": {"$gt": after_id}}
+    ]
+
+  pipeline = [
+    {"$match": match},
+    {"$sort": {"expiresAtTs": 1, "contractId": 1}},
+  ]
+  if limit:
+    pipeline.append({"$limit": limit})
+  pipeline.append({"$project": {
+    "_id": 0,
+    "contractId": 1,
+    "createdAt": 1,
+    "expiresAt": 1,
+    "expiresAtTs": 1,
+    "url": 1,
+    "paid": 1,
+    "creator": "$creatorAddress",
+    "reputation": "$creatorReputation"
+  }})
+  return pipeline
+
+# (listings, next cursor, last modified) for /get-filtered-listings. The last
+# modified time is None when the listings come from the pipeline.
+def get_filtered_listings(requested_address, limit=None, cursor=None):
   try:
-    user = get_user_by_address(requested_address)
+    if MARKETPLACE_FEED:
+      user = get_user_by_address(requested_address)
+      if not user:
+        return None
+      listings, next_key, last_modified = marketplace_feed.page(user.get('reputation', 0), limit, cursor)
+      next_cursor = encode_cursor(*next_key) if next_key else None
+      return listings, next_cursor, last_modified
+
+    user = user_collection.find_one(user_filter(requested_address), {"reputation": 1})
     if not user:
       return None
 
     user_reputation = user.get('reputation', 0)
-    current_time = int(time.time())
+    now = datetime.now(timezone.utc)
 
-    all_users = user_collection.find({})
-    filtered_listings = []
+    pipeline = filtered_listings_pipeline(user_reputation, now, limit, cursor)
+    filtered_listings = list(created_listing_collection.aggregate(pipeline))
 
-    for user in all_users:
-      for listing in user.get('createdListings', []):
-        expires_at = datetime.strptime(listing.get('expiresAt'), "%Y-%m-%dT%H:%M:%S.%fZ").timestamp()
-        if int(expires_at) > current_time:
-          creator_reputation = user.get('reputation', 0)
-          if creator_reputation <= user_reputation:
-            listing['creator'] = user['address']
-            listing['reputation'] = creator_reputation
-            filtered_listings.append(listing)
+    next_cursor = None
+    if limit and len(filtered_listings) == limit:
+      last = filtered_listings[-1]
+      next_cursor = encode_cursor(last['expiresAtTs'], last['contractId'])
+    for listing in filtered_listings:
+      listing.pop('expiresAtTs', None)
 
-    return filtered_listings
+    return filtered_listings, next_cursor, None
 
   except Exception as e:
-    print(f"An error occurred: {e}")
+    log.exception("Failed to fetch filtered listings for %s", requested_address)
     return None
 
 def update_user_reputation(address, new_reputation):
   try:
     result = user_collection.update_one(
-      {"address": address},
+      user_filter(address),
       {"$set": {"reputation": new_reputation}}
     )
+    if result.modified_count > 0:
+      created_listing_collection.update_many(
+        creator_filter(address),
+        {"$set": {"creatorReputation": new_reputation, "feedUpdatedAt": feed_timestamp()}}
+      )
+      marketplace_feed.invalidate()
     return result.modified_count > 0
   except Exception as e:
-    print(f"An error occurred: {e}")
+    log.exception("Failed to update reputation of %s", address)
     return False
 
-def get_created_listings(address):
+def clamp_reputation(reputation):
+  return min(MAX_REPUTATION, max(MIN_REPUTATION, reputation))
+
+# batch IDs start with the second they were created at
+def new_reputation_batch_id():
+  return f"{int(time.time())}-{uuid.uuid4().hex}"
+
+# keys of the snapshots of runs started more than REPUTATION_BATCH_TTL ago,
+# and of any snapshot whose key doesn't carry its creation time
+def stale_reputation_batches(batches, now):
+  stale = []
+  for batch_id in batches:
+    created_at, _, _ = batch_id.partition("-")
+    if not created_at.isdigit() or int(created_at) < now - REPUTATION_BATCH_TTL:
+      stale.append(batch_id)
+  return stale
+
+# Applies every merit and demerit in one bulk write. Each user gets a single
+# pipeline update that snapshots the current score under a per-batch key and
+# then applies its deltas in order, clamping after every step, so concurrent
+# updates can't interleave with the read of the previous value. The snapshots
+# are removed afterwards, along with stale ones of earlier runs.
+def apply_reputation_changes(merit_addresses, demerit_addresses):
+  changes = [(address, "merit") for address in merit_addresses]
+  changes += [(address, "demerit") for address in demerit_addresses]
+
+  deltas = {}
+  for address, action in changes:
+    deltas.setdefault(address, []).append(REPUTATION_DELTAS[action])
+
+  results = {"successful": [], "failed": []}
+  if not deltas:
+    return results
+
+  batch_id = new_reputation_batch_id()
+  batch_key = f"reputationBatches.{batch_id}"
   try:
-    user = get_user_by_address(address)
-    if not user:
-      return None
+    operations = []
+    for address, address_deltas in deltas.items():
+      pipeline = [{"$set": {batch_key: "$reputation"}}]
+      for delta in address_deltas:
+        pipeline.append({"$set": {"reputation": {"$min": [
+          MAX_REPUTATION,
+          {"$max": [MIN_REPUTATION, {"$add": ["$reputation", delta]}]}
+        ]}}})
+      operations.append(UpdateOne(scored_user_filter(address), pipeline))
+    user_collection.bulk_write(operations, ordered=False)
+
+    users = {
+      user["address"]: user
+      for user in user_collection.find(
+        users_filter(deltas),
+        {"address": 1, "reputation": 1, "reputationBatches": 1}
+      )
+    }
+    now = time.time()
+    cleanups = []
+    for address, user in users.items():
+      batches = user.get("reputationBatches", {})
+      stale = [key for key in stale_reputation_batches(batches, now) if key != batch_id]
+      if batch_id in batches or stale:
+        unset = {f"reputationBatches.{key}": "" for key in [batch_id, *stale]}
+        cleanups.append(UpdateOne(user_filter(address), {"$unset": unset}))
+    if cleanups:
+      user_collection.bulk_write(cleanups, ordered=False)
+    user_collection.update_many(
+      empty_batches_filter(deltas),
+      {"$unset": {"reputationBatches": ""}}
+    )
+  except Exception as e:
+    log.exception("Failed to apply reputation changes")
+    return None
+
+  # replay the deltas from the snapshot to report every step's before/after
+  current = {}
+  for address, user in users.items():
+    previous = user.get("reputationBatches", {}).get(batch_id)
+    if previous is not None:
+      current[address] = previous
+
+  for address, action in changes:
+    if address not in users:
+      results["failed"].append({"address": address, "reason": "User not found"})
+      continue
+    if address not in current:
+      results["failed"].append({"address": address, "reason": "User has no reputation score"})
+      continue
+
+    previous = current[address]
+    current[address] = clamp_reputation(previous + REPUTATION_DELTAS[action])
+    results["successful"].append({
+      "address": address,
+      "previousReputation": previous,
+      "newReputation": current[address],
+      "action": action
+    })
+
+  listing_updates = [
+    UpdateMany(
+      creator_filter(address),
+      {"$set": {"creatorReputation": users[address]["reputation"], "feedUpdatedAt": feed_timestamp()}}
+    )
+    for address in current
+  ]
+  try:
+    if listing_updates:
+      created_listing_collection.bulk_write(listing_updates, ordered=False)
+      marketplace_feed.invalidate()
+  except Exception as e:
+    log.exception("Failed to sync listing reputations")
 
-    created_listings = user.get('createdListings', [])
-    return created_listings
+  return results
+
+# (listings, next cursor) of a page of the user's listings, cached like
+# get_subscribed_listings.
+def get_created_listings(address, limit=LIST_PAGE_SIZE, after=None, fields=None):
+  try:
+    load = lambda: find_page(
+      created_listing_collection,
+      creator_filter(address),
+      listing_projection(CREATED_LISTING_PROJECTION, fields),
+      limit,
+      after
+    )
+    if after is None and fields is None and limit == LIST_PAGE_SIZE:
+      return cached_listings_page("created", address, load)
+    if not address_exists(address):
+      return None
+    return load()
   except Exception as e:
-    print(f"An error occurred: {e}")
+    log.exception("Failed to fetch created listings of %s", address)
     return None
 
 
 def mark_contract_as_paid(address, contract_id):
   try:
-    result = user_collection.update_one(
-      {"address": address, "createdListings.contractId": contract_id},
-      {"$set": {"createdListings.$.paid": True}}
+    result = created_listing_collection.update_one(
+      created_listing_filter(address, contract_id),
+      {"$set": {"paid": True, "feedUpdatedAt": feed_timestamp()}}
     )
+    invalidate_created_listings(address)
+    marketplace_feed.invalidate()
     if result.modified_count > 0:
       return True
     else:
-      print(f"No matching document found for address {address} and contract ID {contract_id}")
+      log.info("No listing of %s with contract ID %s to mark as paid", address, contract_id)
       return False
   except Exception as e:
-    print(f"An error occurred while marking contract as paid: {e}")
+    log.exception("Failed to mark contract %s as paid", contract_id)
     return False
 
 
 def update_feedback(subscriber_address, contract_id, feedback_value):
   try:
-    result = user_collection.update_one(
-      {"address": subscriber_address, "subscribedListings.contractId": contract_id},
-      {"$set": {"subscribedListings.$.feedback": feedback_value}}
+    result = subscribed_listing_collection.update_one(
+      subscription_filter(subscriber_address, contract_id),
+      {"$set": {"feedback": feedback_value}}
     )
+    invalidate_subscribed_listings(subscriber_address)
     if result.modified_count > 0:
       return True
     else:
-      print(f"No matching subscription found for address {subscriber_address} and contract ID {contract_id}")
+      log.info("No subscription of %s to contract ID %s", subscriber_address, contract_id)
       return False
   except Exception as e:
-    print(f"An error occurred while updating feedback: {e}")
+    log.exception("Failed to update feedback")
     return None
 
 def add_reported_listing(contract_id):
     try:
-        existing_report = reported_listing_collection.find_one({"contractId": contract_id})
+        existing_report = reported_listing_collection.find_one(contract_filter(contract_id))
         if existing_report:
             return False
 
-        creator = user_collection.find_one(
-            {"createdListings.contractId": contract_id},
-            {"address": 1}
+        creator = created_listing_collection.find_one(
+            contract_filter(contract_id),
+            {"creatorAddress": 1}
         )
 
         if not creator:
             return False
 
-        subscribers = user_collection.find(
-            {"subscribedListings.contractId": contract_id},
-            {"address": 1}
+        subscribers = subscribed_listing_collection.find(
+            contract_filter(contract_id),
+            {"subscriberAddress": 1}
         )
 
-        subscriber_addresses = [subscriber["address"] for subscriber in subscribers]
+        subscriber_addresses = [subscriber["subscriberAddress"] for subscriber in subscribers]
 
         if not subscriber_addresses:
             return False
 
         report_record = {
             "contractId": contract_id,
-            "creatorAddress": creator["address"],
+            "creatorAddress": creator["creatorAddress"],
             "subscriberAddresses": subscriber_addresses,
             "reportedAt": datetime.now(),
             "status": "pending"
@@ -217,36 +733,88 @@ def add_reported_listing(contract_id):
         result = reported_listing_collection.insert_one(report_record)
         return result.inserted_id
 
+    except DuplicateKeyError:
+        # reported concurrently, the unique index keeps a single report
+        return False
+
     except Exception as e:
-        print(f"An error occurred while reporting listing: {e}")
+        log.exception("Failed to report listing %s", contract_id)
         return None
 
-def get_reported_listings():
+# (reports, next cursor) of a page of reports in the order they were filed.
+# subscribers_limit returns only the first subscriber addresses of each.
+def get_reported_listings(limit=LIST_PAGE_SIZE, after=None, fields=None, subscribers_limit=None):
   try:
-    reports = list(reported_listing_collection.find({}, {"_id": 0}))
-    return reports
+    projection = listing_projection({"_id": 0}, fields)
+    if subscribers_limit is not None and (fields is None or "subscriberAddresses" in fields):
+      projection["subscriberAddresses"] = {"$slice": subscribers_limit}
+    return find_page(reported_listing_collection, {}, projection, limit, after)
   except Exception as e:
-    print(f"An error occurred while fetching reported listings: {e}")
+    log.exception("Failed to fetch reported listings")
     return None
 
 def update_reported_listing_status(contract_id: int, status: str):
     try:
         # Update status in reported listings
         result = reported_listing_collection.update_one(
-            {"contractId": contract_id},
+            contract_filter(contract_id),
             {"$set": {"status": status}}
         )
 
         if result.modified_count == 0:
             return False
 
-        # Find all users with this contract in their created listings and update paid status
-        user_collection.update_many(
-            {"createdListings.contractId": contract_id},
-            {"$set": {"createdListings.$.paid": True}}
+        # Mark the reported contract's listing as paid
+        listing = created_listing_collection.find_one_and_update(
+            contract_filter(contract_id),
+            {"$set": {"paid": True, "feedUpdatedAt": feed_timestamp()}},
+            {"creatorAddress": 1}
         )
+        if listing:
+            invalidate_created_listings(listing["creatorAddress"])
+            marketplace_feed.invalidate()
 
         return True
     except Exception as e:
-        print(f"An error occurred while updating reported listing status: {e}")
+        log.exception("Failed to update the status of reported listing %s", contract_id)
         return False
+
+# reputation of every user subscribed to the contract, by address: the
+# contributors whose parameters may be aggregated into its global model.
+# Subscriptions may already have been archived.
+def get_contract_contributors(contract_id: int):
+  addresses = set(subscribed_listing_collection.distinct("subscriberAddress", contract_filter(contract_id)))
+  addresses.update(archived_subscribed_listing_collection.distinct("subscriberAddress", contract_filter(contract_id)))
+  if not addresses:
+    return {}
+  users = user_collection.find(users_filter(addresses), {"_id": 0, "address": 1, "reputation": 1})
+  return {user["address"]: user.get("reputation", 0) for user in users}
+
+# a page of archived listings, most recently expired first, and the cursor
+# of the next page. key is creatorAddress or subscriberAddress.
+def get_archived_listings(collection, key, address, limit, cursor=None):
+  try:
+    query = {key: address}
+    if cursor:
+      before_ts, before_id = cursor
+      query["$or"] = [
+        {"expiresAtTs": {"$lt": before_ts}},
+        {"expiresAtTs": before_ts, "contractId": {"$lt": before_id}}
+      ]
+    listings = list(collection.find(query, ARCHIVED_LISTING_PROJECTION).sort([("expiresAtTs", DESCENDING), ("contractId", DESCENDING)]).limit(limit))
+
+    next_cursor = None
+    if len(listings) == limit:
+      next_cursor = encode_cursor(listings[-1]["expiresAtTs"], listings[-1]["contractId"])
+    for listing in listings:
+      listing.pop("expiresAtTs", None)
+    return listings, next_cursor
+  except Exception as e:
+    log.exception("Failed to fetch archived listings of %s", address)
+    return None
+
+def get_archived_created_listings(address, limit, cursor=None):
+  return get_archived_listings(archived_created_listing_collection, "creatorAddress", address, limit, cursor)
+
+def get_archived_subscribed_listings(address, limit, cursor=None):
+  return get_archived_listings(archived_subscribed_listing_collection, "subscriberAddress", address, limit, cursor)
@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import time
+import random
+import atexit
+import argparse
+import platform
+import subprocess
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Latency benchmark for the backend's Flask routes.
+#
+# Seeds a throwaway database with synthetic users, created and subscribed
+# listings and reports at the requested scale, then drives each route from
+# `concurrency` threads and writes per-route throughput, latency percentiles
+# and status counts as JSON. Two reports can be compared with --compare to
+# see what a commit changed.
+#
+# The database is a real MongoDB: an existing one (--mongo-uri, --db-name
+# defaults to dmlchain_benchmark and is dropped first) or a throwaway mongod
+# started for the run (--inmemory, uses pymongo_inmemory, which downloads the
+# mongod binary on first use). --mongomock swaps in the in-memory mongomock
+# stand-in instead; it evaluates queries in Python without indexes, so its
+# numbers only compare commits with each other. Requests go through Flask's
+# test client in this process, or to a running backend with --base-url.
+#
+# Routes that answer 202 with a background job (JOB_ROUTES) are timed until
+# /jobs/<id> reports the job finished, polling every JOB_POLL_SECONDS;
+# enqueueLatencyMs holds the time to the 202 alone. A failed job fails the
+# benchmark like an error response.
+#
+# Any response outside 2xx, during warmup or the run, fails the benchmark
+# with the route, its status counts and sample response bodies, so a report
+# never holds timings of error responses.
+#
+#   python endpoint_benchmark.py --inmemory --users 2000 --output before.json
+#   python endpoint_benchmark.py --inmemory --users 2000 --compare before.json
+
+ROUTES = (
+  "get-filtered-listings",
+  "get-user",
+  "get-created-listings",
+  "get-subscribed-listings",
+  "update-multiple-reputations",
+  "report-listing",
+)
+JOB_ROUTES = {"report-listing"}
+JOB_POLL_SECONDS = 0.005
+
+class BenchmarkFailed(Exception):
+  pass
+
+# pymongo passes sort=None to every bulk update, replace and delete, which
+# mongomock's BulkOperationBuilder doesn't accept. Dropping it is only correct
+# when no sort was asked for.
+def patch_mongomock_bulk_writes(mongomock):
+  builder = mongomock.collection.BulkOperationBuilder
+  def without_sort(add):
+    def wrapper(self, *args, sort=None, **kwargs):
+      if sort is not None:
+        raise NotImplementedError("mongomock can't sort bulk write operations")
+      return add(self, *args, **kwargs)
+    return wrapper
+  for name in ("add_update", "add_replace", "add_delete"):
+    setattr(builder, name, without_sort(getattr(builder, name)))
+
+def start_mongod():
+  try:
+    from pymongo_inmemory import Mongod
+  except ImportError:
+    sys.exit("--inmemory needs pymongo_inmemory, install it with `pip install pymongo_inmemory`")
+  mongod = Mongod(None)
+  mongod.start()
+  atexit.register(mongod.stop)
+  return mongod.connection_string
+
+def configure_database(args):
+  os.environ["MONGO_DB_NAME"] = args.db_name
+  if args.mongomock:
+    try:
+      import mongomock
+    except ImportError:
+      sys.exit("--mongomock needs mongomock, install it with `pip install mongomock`")
+    import pymongo
+    patch_mongomock_bulk_writes(mongomock)
+    pymongo.MongoClient = mongomock.MongoClient
+  elif args.inmemory:
+    os.environ["MONGO_CLIENT"] = start_mongod()
+  elif args.mongo_uri:
+    os.environ["MONGO_CLIENT"] = args.mongo_uri
+  import database
+  return database
+
+def expiry(days):
+  return (datetime.now(timezone.utc) + timedelta(days=days)).replace(tzinfo=None)
+
+# synthetic marketplace: addresses are user-<n>, contract IDs are sequential.
+def seed(database, users, listings_per_user, subscriptions_per_user, reports, rng):
+  database.client.drop_database(database.db.name)
+  database.ensure_indexes()
+
+  addresses = [f"user-{index:07d}" for index in range(users)]
+  reputations = {address: rng.randint(0, 100) for address in addresses}
+  database.user_collection.insert_many(
+    [{"address": address, "reputation": reputations[address]} for address in addresses], ordered=False
+  )
+
+  listings = []
+  for address in addresses:
+    for _ in range(listings_per_user):
+      expires_at = expiry(rng.uniform(-30, 90))
+      listings.append({
+        "creatorAddress": address,
+        "creatorReputation": reputations[address],
+        "contractId": len(listings) + 1,
+        "createdAt": (expires_at - timedelta(days=30)).strftime(database.EXPIRY_FORMAT),
+        "expiresAt": expires_at.strftime(database.EXPIRY_FORMAT),
+        "expiresAtTs": expires_at,
+        "url": f"https://example.com/listing/{len(listings) + 1}",
+        "paid": rng.random() < 0.2
+      })
+  for start in range(0, len(listings), 10_000):
+    database.created_listing_collection.insert_many(listings[start:start + 10_000], ordered=False)
+
+  subscriptions = []
+  for address in addresses:
+    for listing in rng.sample(listings, min(subscriptions_per_user, len(listings))):
+      if listing["creatorAddress"] == address:
+        continue
+      subscriptions.append({
+        "subscriberAddress": address,
+        "creatorAddress": listing["creatorAddress"],
+        "reputation": listing["creatorReputation"],
+        "contractId": listing["contractId"],
+        "createdAt": listing["createdAt"],
+        "expiresAt": listing["expiresAt"],
+        "url": listing["url"],
+        "feedback": False
+      })
+  for start in range(0, len(subscriptions), 10_000):
+    database.subscribed_listing_collection.insert_many(subscriptions[start:start + 10_000], ordered=False)
+
+  subscribed_ids = sorted({subscription["contractId"] for subscription in subscriptions})
+  reported = []
+  for contract_id in rng.sample(subscribed_ids, min(reports, len(subscribed_ids))):
+    listing = listings[contract_id - 1]
+    reported.append({
+      "contractId": contract_id,
+      "creatorAddress": listing["creatorAddress"],
+      "subscriberAddresses": [],
+      "reportedAt": datetime.now(),
+      "status": "pending"
+    })
+  if reported:
+    database.reported_listing_collection.insert_many(reported, ordered=False)
+
+  return {
+    "addresses": addresses,
+    "subscribedIds": subscribed_ids,
+    "reportedIds": {report["contractId"] for report in reported},
+    "counts": {
+      "users": len(addresses),
+      "createdListings": len(listings),
+      "subscribedListings": len(subscriptions),
+      "reportedListings": len(reported)
+    }
+  }
+
+def request_factory(route, data, rng, needed):
+  addresses = data["addresses"]
+  if route == "get-filtered-listings":
+    return lambda: ("GET", f"/get-filtered-listings/{rng.choice(addresses)}?limit=50", None)
+  if route == "get-user":
+    return lambda: ("GET", f"/get-user/{rng.choice(addresses)}", None)
+  if route == "get-created-listings":
+    return lambda: ("GET", f"/get-created-listings/{rng.choice(addresses)}", None)
+  if route == "get-subscribed-listings":
+    return lambda: ("GET", f"/get-subscribed-listings/{rng.choice(addresses)}", None)
+  if route == "update-multiple-reputations":
+    return lambda: ("POST", "/update-multiple-reputations", {
+      "meritAddresses": rng.sample(addresses, min(10, len(addresses))),
+      "demeritAddresses": rng.sample(addresses, min(10, len(addresses)))
+    })
+  if route == "report-listing":
+    # a listing can only be reported once, every request takes a fresh one
+    unreported = [contract_id for contract_id in data["subscribedIds"] if contract_id not in data["reportedIds"]]
+    if len(unreported) < needed:
+      raise BenchmarkFailed(
+        f"report-listing needs {needed} unreported listings, the seed has {len(unreported)}; "
+        "raise --users or --subscriptions-per-user, or lower --requests or --reports"
+      )
+    rng.shuffle(unreported)
+    pending = iter(unreported)
+    lock = threading.Lock()
+    def make():
+      with lock:
+        contract_id = next(pending)
+      return ("POST", "/report-listing", {"contractId": contract_id})
+    return make
+  raise ValueError(f"Unknown route {route}")
+
+class TestClientTransport:
+  def __init__(self):
+    from backend import app
+    self.app = app
+    self._local = threading.local()
+
+  def __call__(self, method, path, body):
+    client = getattr(self._local, "client", None)
+    if client is None:
+      client = self._local.client = self.app.test_client()
+    response = client.open(path, method=method, json=body)
+    response.close()
+    return response.status_code, response.get_data(as_text=True)
+
+class HttpTransport:
+  def __init__(self, base_url):
+    import requests
+    self.base_url = base_url.rstrip("/")
+    self.session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=256)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+  def __call__(self, method, path, body):
+    response = self.session.request(method, self.base_url + path, json=body, timeout=60)
+    return response.status_code, response.text
+
+def percentiles(latencies):
+  values = np.array(latencies) * 1000
+  return {
+    "p50": round(float(np.percentile(values, 50)), 3),
+    "p90": round(float(np.percentile(values, 90)), 3),
+    "p99": round(float(np.percentile(values, 99)), 3),
+    "max": round(float(values.max()), 3),
+    "mean": round(float(values.mean()), 3)
+  }
+
+def succeeded(status):
+  return isinstance(status, int) and 200 <= status < 300
+
+# polls the job a 202 response handed out until it finishes, returns the
+# final status and body like a transport does. A failed job counts as a 500.
+def wait_for_job(transport, text):
+  job = json.loads(text)
+  while job["status"] in ("queued", "running"):
+    time.sleep(JOB_POLL_SECONDS)
+    status, text = transport("GET", f"/jobs/{job['jobId']}", None)
+    if not succeeded(status):
+      return status, text
+    job = json.loads(text)
+  return (200 if job["status"] == "succeeded" else 500), text
+
+def drive(route, transport, make_request, requests, concurrency, warmup):
+  follow_jobs = route in JOB_ROUTES
+
+  for _ in range(warmup):
+    method, path, body = make_request()
+    status, text = transport(method, path, body)
+    if follow_jobs and status == 202:
+      status, text = wait_for_job(transport, text)
+    if not succeeded(status):
+      raise BenchmarkFailed(f"{route}: warmup {method} {path} returned {status}: {text[:300]}")
+
+  lock = threading.Lock()
+  latencies = []
+  enqueue_latencies = []
+  statuses = {}
+  errors = []
+
+  def one(_):
+    method, path, body = make_request()
+    started = time.perf_counter()
+    try:
+      status, text = transport(method, path, body)
+      if follow_jobs and status == 202:
+        with lock:
+          enqueue_latencies.append(time.perf_counter() - started)
+        status, text = wait_for_job(transport, text)
+    except Exception as e:
+      status, text = "exception", str(e)
+    elapsed = time.perf_counter() - started
+    with lock:
+      latencies.append(elapsed)
+      statuses[str(status)] = statuses.get(str(status), 0) + 1
+      if not succeeded(status):
+        errors.append(f"{method} {path} -> {status}: {text[:300]}")
+
+  started = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    list(executor.map(one, range(requests)))
+  seconds = time.perf_counter() - started
+
+  if errors:
+    raise BenchmarkFailed(
+      f"{route}: {len(errors)} of {requests} requests failed, statuses {dict(sorted(statuses.items()))}\n  "
+      + "\n  ".join(errors[:5])
+    )
+  result = {
+    "requests": requests,
+    "concurrency": concurrency,
+    "seconds": round(seconds, 4),
+    "requestsPerSecond": round(requests / seconds, 2),
+    "latencyMs": percentiles(latencies),
+    "statusCounts": dict(sorted(statuses.items()))
+  }
+  if follow_jobs:
+    result["enqueueLatencyMs"] = percentiles(enqueue_latencies)
+  return result
+
+def git_commit():
+  try:
+    return subprocess.run(
+      ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+      cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stdout.strip()
+  except Exception:
+    return None
+
+def compare(previous, current):
+  print(f"{'route':30} {'p50 ms':>18} {'p99 ms':>18} {'req/s':>18}")
+  for route, result in current["routes"].items():
+    before = previous.get("routes", {}).get(route)
+    if before is None:
+      continue
+    cells = []
+    for old, new in (
+      (before["latencyMs"]["p50"], result["latencyMs"]["p50"]),
+      (before["latencyMs"]["p99"], result["latencyMs"]["p99"]),
+      (before["requestsPerSecond"], result["requestsPerSecond"])
+    ):
+      change = (new - old) / old * 100 if old else 0.0
+      cells.append(f"{old:.1f}->{new:.1f} {change:+.0f}%")
+    print(f"{route:30} {cells[0]:>18} {cells[1]:>18} {cells[2]:>18}")
+
+def run_benchmark(args):
+  rng = random.Random(args.seed)
+  database = configure_database(args)
+
+  started = time.perf_counter()
+  data = seed(database, args.users, args.listings_per_user, args.subscriptions_per_user, args.reports, rng)
+  seed_seconds = time.perf_counter() - started
+
+  transport = HttpTransport(args.base_url) if args.base_url else TestClientTransport()
+  report = {
+    "meta": {
+      "commit": git_commit(),
+      "timestamp": datetime.now(timezone.utc).isoformat(),
+      "python": platform.python_version(),
+      "database": "mongomock" if args.mongomock else "mongod-inmemory" if args.inmemory else "mongodb",
+      "transport": "http" if args.base_url else "test-client",
+      "seed": args.seed,
+      "seedSeconds": round(seed_seconds, 3),
+      "scale": data["counts"]
+    },
+    "routes": {}
+  }
+  for route in args.routes:
+    report["routes"][route] = drive(
+      route, transport, request_factory(route, data, rng, args.requests + args.warmup), args.requests, args.concurrency, args.warmup
+    )
+  return report
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Seed a throwaway database and measure the backend routes under load.")
+  target = parser.add_mutually_exclusive_group()
+  target.add_argument('--inmemory', action='store_true', help="start a throwaway mongod for the run")
+  target.add_argument('--mongomock', action='store_true', help="use an in-memory mongomock database")
+  target.add_argument('--mongo-uri', help="MongoDB to seed, defaults to MONGO_CLIENT")
+  parser.add_argument('--db-name', default='dmlchain_benchmark', help="database that is dropped and seeded")
+  parser.add_argument('--base-url', help="drive a running backend (using the same database) instead of the test client")
+  parser.add_argument('--users', type=int, default=1000)
+  parser.add_argument('--listings-per-user', type=int, default=5)
+  parser.add_argument('--subscriptions-per-user', type=int, default=5)
+  parser.add_argument('--reports', type=int, default=50)
+  parser.add_argument('--requests', type=int, default=500, help="requests per route")
+  parser.add_argument('--concurrency', type=int, default=16)
+  parser.add_argument('--warmup', type=int, default=20)
+  parser.add_argument('--routes', nargs='+', choices=ROUTES, default=list(ROUTES))
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--output', help="write the JSON report here instead of stdout")
+  parser.add_argument('--compare', help="earlier report to compare against")
+  args = parser.parse_args()
+
+  if args.base_url and (args.mongomock or args.inmemory):
+    sys.exit("--base-url needs a MongoDB shared with the backend, pass it with --mongo-uri")
+  if args.db_name == "DMLCHAIN":
+    sys.exit("Refusing to seed the application database, pick another --db-name")
+
+  try:
+    report = run_benchmark(args)
+  except BenchmarkFailed as e:
+    sys.exit(f"Benchmark failed, no report written\n{e}")
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+  else:
+    print(json.dumps(report, indent=2))
+  if args.compare:
+    with open(args.compare) as f:
+      compare(json.load(f), report)
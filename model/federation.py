@@ -0,0 +1,89 @@
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from ipfs_configs import fetch_to_cache, decrypt_model_params_file
+from blob_cache import BlobMismatch
+
+# Downloads and decrypts every contributor's parameter package concurrently.
+# Each contributor is retried with exponential backoff on network errors and
+# downloads that don't match their CID, and a contributor that still fails is
+# reported instead of failing the round.
+# Legacy pickle packages are only decoded with allow_pickle=True (or
+# ALLOW_PICKLE_PARAMS=true), which is for trusted packages in the notebook.
+
+class FetchResult:
+  def __init__(self, contributor, ipfs_hash, package=None, error=None, attempts=0, fetch_seconds=0.0, decrypt_seconds=0.0):
+    self.contributor = contributor
+    self.ipfs_hash = ipfs_hash
+    self.package = package
+    self.error = error
+    self.attempts = attempts
+    self.fetch_seconds = fetch_seconds
+    self.decrypt_seconds = decrypt_seconds
+
+  @property
+  def ok(self):
+    return self.error is None
+
+  def to_dict(self):
+    return {
+      "contributor": self.contributor,
+      "ipfsHash": self.ipfs_hash,
+      "ok": self.ok,
+      "error": self.error,
+      "attempts": self.attempts,
+      "fetchSeconds": round(self.fetch_seconds, 4),
+      "decryptSeconds": round(self.decrypt_seconds, 4)
+    }
+
+def fetch_package(contributor, item, retries=3, backoff=0.5, allow_pickle=None):
+  result = FetchResult(contributor, item.get('paramHash'))
+  started = time.perf_counter()
+  cached_path = None
+
+  while cached_path is None:
+    result.attempts += 1
+    try:
+      cached_path = fetch_to_cache(item['paramHash'])
+    except (requests.RequestException, BlobMismatch) as e:
+      if result.attempts > retries:
+        result.error = f"Download failed after {result.attempts} attempts: {e}"
+        result.fetch_seconds = time.perf_counter() - started
+        return result
+      time.sleep(backoff * (2 ** (result.attempts - 1)) * (1 + random.random() / 2))
+    except Exception as e:
+      result.error = f"Download failed: {e}"
+      result.fetch_seconds = time.perf_counter() - started
+      return result
+
+  result.fetch_seconds = time.perf_counter() - started
+  started = time.perf_counter()
+  try:
+    result.package = decrypt_model_params_file(cached_path, item['paramKey'], allow_pickle)
+  except Exception as e:
+    result.error = f"Decryption failed: {e or type(e).__name__}"
+  result.decrypt_seconds = time.perf_counter() - started
+  return result
+
+# yields a FetchResult per contributor as soon as its package is ready.
+def iter_model_params(params_array, max_workers=8, retries=3, backoff=0.5, allow_pickle=None):
+  if not params_array:
+    return
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    futures = [
+      executor.submit(fetch_package, contributor, item, retries, backoff, allow_pickle)
+      for contributor, item in params_array.items()
+    ]
+    for future in as_completed(futures):
+      yield future.result()
+
+def get_model_params(params_array, max_workers=8, retries=3, backoff=0.5, allow_pickle=None):
+  federation_packages = []
+  report = []
+  for result in iter_model_params(params_array, max_workers, retries, backoff, allow_pickle):
+    report.append(result.to_dict())
+    if result.ok and result.package:
+      federation_packages.append(result.package)
+  return federation_packages, report
@@ -0,0 +1,145 @@
+import sys
+import json
+import argparse
+from datetime import datetime, timezone
+from bson import ObjectId
+
+from database import (
+  db, user_collection, created_listing_collection, subscribed_listing_collection, reported_listing_collection,
+  archived_created_listing_collection, archived_subscribed_listing_collection,
+  CREATED_LISTING_PROJECTION, SUBSCRIBED_LISTING_PROJECTION, ARCHIVED_LISTING_PROJECTION, ensure_indexes,
+  filtered_listings_pipeline, user_filter, users_filter, scored_user_filter, empty_batches_filter, creator_filter,
+  subscriber_filter, contract_filter, contracts_filter, created_listing_filter, subscription_filter,
+  pending_reports_filter, page_filter
+)
+from archive_listings import archive_query
+from listing_feed import FEED_FIELDS, unexpired_filter, changed_since_filter
+
+# Query-plan audit for database.py, archive_listings.py and listing_feed.py.
+#
+# Every query shape they issue is listed in audit_queries, built with the
+# same filter helpers and pipelines the modules query with, and explained
+# against the configured database. Any winning plan with a COLLSCAN stage is
+# flagged unless the query is expected to read the whole collection. Exits
+# with status 1 on unexpected scans, so it can gate a deploy:
+#
+#   python index_audit.py --ensure-indexes
+
+SAMPLE_ADDRESS = "AUDIT_SAMPLE_ADDRESS"
+SAMPLE_CONTRACT_ID = 1
+
+def find(collection, filter, projection=None, sort=None):
+  command = {"find": collection.name, "filter": filter}
+  if projection:
+    command["projection"] = projection
+  if sort:
+    command["sort"] = sort
+  return command
+
+def update(collection, filter, multi=False):
+  return {"update": collection.name, "updates": [{"q": filter, "u": {"$set": {"audit": True}}, "multi": multi}]}
+
+def find_and_modify(collection, query):
+  return {"findAndModify": collection.name, "query": query, "update": {"$set": {"audit": True}}}
+
+def aggregate(collection, pipeline):
+  return {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}}
+
+def audit_queries():
+  now = datetime.now(timezone.utc)
+  address, contract_id = SAMPLE_ADDRESS, SAMPLE_CONTRACT_ID
+  after = ObjectId()
+  return [
+    # name, explained command, whether a full scan is expected
+    ("get_user_by_address", find(user_collection, user_filter(address)), False),
+    ("update_user_reputation", update(user_collection, user_filter(address)), False),
+    ("bump_listings_version", update(user_collection, users_filter([address]), multi=True), False),
+    ("apply_reputation_changes.update", update(user_collection, scored_user_filter(address)), False),
+    ("apply_reputation_changes.read", find(user_collection, users_filter([address])), False),
+    ("apply_reputation_changes.cleanup", update(user_collection, empty_batches_filter([address]), multi=True), False),
+    ("get_created_listings", find(
+      created_listing_collection, page_filter(creator_filter(address), after), CREATED_LISTING_PROJECTION, {"_id": 1}
+    ), False),
+    ("get_filtered_listings", aggregate(created_listing_collection, filtered_listings_pipeline(100, now, 50)), False),
+    ("get_filtered_listings.cursor", aggregate(
+      created_listing_collection, filtered_listings_pipeline(100, now, 50, (now, contract_id))
+    ), False),
+    ("marketplace_feed.rebuild", find(created_listing_collection, unexpired_filter(now), FEED_FIELDS), False),
+    ("marketplace_feed.sync", find(created_listing_collection, changed_since_filter(now), FEED_FIELDS), False),
+    ("sync_creator_reputation", update(created_listing_collection, creator_filter(address), multi=True), False),
+    ("mark_contract_as_paid", update(created_listing_collection, created_listing_filter(address, contract_id)), False),
+    ("add_reported_listing.creator", find(created_listing_collection, contract_filter(contract_id)), False),
+    ("update_reported_listing_status.listing", find_and_modify(created_listing_collection, contract_filter(contract_id)), False),
+    ("get_subscribed_listings", find(
+      subscribed_listing_collection, page_filter(subscriber_filter(address), after), SUBSCRIBED_LISTING_PROJECTION, {"_id": 1}
+    ), False),
+    ("update_feedback", update(subscribed_listing_collection, subscription_filter(address, contract_id)), False),
+    ("add_reported_listing.subscribers", find(subscribed_listing_collection, contract_filter(contract_id)), False),
+    ("get_contract_contributors.archived", find(archived_subscribed_listing_collection, contract_filter(contract_id)), False),
+    ("add_reported_listing.existing", find(reported_listing_collection, contract_filter(contract_id)), False),
+    ("update_reported_listing_status", update(reported_listing_collection, contract_filter(contract_id)), False),
+    ("archive_listings.candidates", find(created_listing_collection, archive_query(now, [contract_id]), None, {"expiresAtTs": 1}), False),
+    ("archive_listings.subscriptions", find(subscribed_listing_collection, contracts_filter([contract_id])), False),
+    ("archive_listings.archived_created", update(archived_created_listing_collection, contracts_filter([contract_id]), multi=True), False),
+    ("archive_listings.archived_subscribed", update(archived_subscribed_listing_collection, contracts_filter([contract_id]), multi=True), False),
+    ("archive_listings.pending_reports", find(reported_listing_collection, pending_reports_filter()), False),
+    ("get_archived_created_listings", find(
+      archived_created_listing_collection, creator_filter(address), ARCHIVED_LISTING_PROJECTION, {"expiresAtTs": -1, "contractId": -1}
+    ), False),
+    ("get_archived_subscribed_listings", find(
+      archived_subscribed_listing_collection, subscriber_filter(address), ARCHIVED_LISTING_PROJECTION, {"expiresAtTs": -1, "contractId": -1}
+    ), False),
+    # the moderation view pages through the reports on _id
+    ("get_reported_listings", find(reported_listing_collection, page_filter({}, after), None, {"_id": 1}), False),
+  ]
+
+# stage names of the winning plan; rejected plans are not what runs.
+def plan_stages(explain):
+  stages = []
+
+  def walk(node):
+    if isinstance(node, dict):
+      if isinstance(node.get("stage"), str):
+        stages.append(node["stage"])
+      for key, value in node.items():
+        if key not in ("rejectedPlans", "slotBasedPlan", "command"):
+          walk(value)
+    elif isinstance(node, list):
+      for value in node:
+        walk(value)
+
+  walk(explain)
+  return stages
+
+def run_audit():
+  report = []
+  for name, command, full_scan_expected in audit_queries():
+    entry = {"query": name, "collection": command[next(iter(command))], "expectedFullScan": full_scan_expected}
+    try:
+      explain = db.command({"explain": command, "verbosity": "queryPlanner"})
+      entry["stages"] = sorted(set(plan_stages(explain)))
+      entry["collscan"] = "COLLSCAN" in entry["stages"]
+    except Exception as e:
+      entry["error"] = str(e)
+      entry["collscan"] = None
+    entry["flagged"] = bool(entry.get("error")) or (entry["collscan"] and not full_scan_expected)
+    report.append(entry)
+  return report
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Explain every query in database.py and flag collection scans.")
+  parser.add_argument('--ensure-indexes', action='store_true', help="create the indexes before auditing")
+  parser.add_argument('--json', action='store_true', help="print the report as JSON")
+  args = parser.parse_args()
+
+  if args.ensure_indexes and not ensure_indexes():
+    print("Some indexes could not be created, see above")
+  report = run_audit()
+  if args.json:
+    print(json.dumps(report, indent=2))
+  else:
+    for entry in report:
+      status = "FLAGGED" if entry["flagged"] else "ok"
+      detail = entry.get("error") or ", ".join(entry["stages"])
+      print(f"{status:8} {entry['collection']:20} {entry['query']:42} {detail}")
+  sys.exit(1 if any(entry["flagged"] for entry in report) else 0)
@@ -0,0 +1,221 @@
+import io
+import os
+import json
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+from dotenv import load_dotenv
+
+from model_registry import model_registry
+
+load_dotenv()
+
+# Fraud scoring with the published global models.
+#
+# Each contract's latest model is loaded from the registry once and kept in
+# memory; the registry is re-checked every MODEL_REFRESH_SECONDS and a newly
+# published version is swapped in without interrupting requests. Requests are
+# not scored one by one: every contract has a micro-batcher thread that
+# gathers whatever rows arrive within INFERENCE_MAX_WAIT_MS (up to
+# INFERENCE_MAX_BATCH_ROWS) into one matrix, runs a single predict_proba over
+# it and hands each request its slice of the result.
+
+INFERENCE_MAX_BATCH_ROWS = int(os.getenv("INFERENCE_MAX_BATCH_ROWS", "8192"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "2"))
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", "30"))
+INFERENCE_N_JOBS = int(os.getenv("INFERENCE_N_JOBS", "1"))
+MODEL_REFRESH_SECONDS = float(os.getenv("MODEL_REFRESH_SECONDS", "5"))
+STATS_WINDOW = int(os.getenv("INFERENCE_STATS_WINDOW", "10000"))
+
+class ModelNotFound(LookupError):
+  pass
+
+class LatencyStats:
+  def __init__(self, window=STATS_WINDOW):
+    self._samples = deque(maxlen=window)
+    self._lock = threading.Lock()
+    self.requests = 0
+    self.rows = 0
+    self.batches = 0
+    self.batch_rows = 0
+
+  def record_request(self, seconds, rows):
+    with self._lock:
+      self._samples.append((time.monotonic(), seconds, rows))
+      self.requests += 1
+      self.rows += rows
+
+  def record_batch(self, rows):
+    with self._lock:
+      self.batches += 1
+      self.batch_rows += rows
+
+  def snapshot(self):
+    with self._lock:
+      samples = list(self._samples)
+      totals = {
+        "requests": self.requests,
+        "rows": self.rows,
+        "batches": self.batches,
+        "meanBatchRows": round(self.batch_rows / self.batches, 2) if self.batches else 0
+      }
+    if not samples:
+      return dict(totals, p50Ms=None, p99Ms=None, requestsPerSecond=0.0, rowsPerSecond=0.0)
+
+    latencies = np.array([sample[1] for sample in samples]) * 1000
+    elapsed = max(time.monotonic() - samples[0][0], 1e-9)
+    return dict(
+      totals,
+      p50Ms=round(float(np.percentile(latencies, 50)), 3),
+      p99Ms=round(float(np.percentile(latencies, 99)), 3),
+      requestsPerSecond=round(len(samples) / elapsed, 2),
+      rowsPerSecond=round(sum(sample[2] for sample in samples) / elapsed, 2)
+    )
+
+class MicroBatcher:
+  def __init__(self, predict, stats, max_batch_rows=INFERENCE_MAX_BATCH_ROWS, max_wait=INFERENCE_MAX_WAIT_MS / 1000):
+    self.predict = predict
+    self.stats = stats
+    self.max_batch_rows = max_batch_rows
+    self.max_wait = max_wait
+    self._queue = queue.Queue()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def submit(self, rows):
+    future = Future()
+    self._queue.put((rows, future))
+    return future
+
+  def _collect(self):
+    batch = [self._queue.get()]
+    size = len(batch[0][0])
+    deadline = time.monotonic() + self.max_wait
+    while size < self.max_batch_rows:
+      timeout = deadline - time.monotonic()
+      if timeout <= 0:
+        break
+      try:
+        item = self._queue.get(timeout=timeout)
+      except queue.Empty:
+        break
+      batch.append(item)
+      size += len(item[0])
+    return batch, size
+
+  def _run(self):
+    while True:
+      batch, size = self._collect()
+      try:
+        rows = batch[0][0] if len(batch) == 1 else np.concatenate([item[0] for item in batch])
+        probabilities = self.predict(rows)
+      except Exception as e:
+        for _, future in batch:
+          future.set_exception(e)
+        continue
+      self.stats.record_batch(size)
+      start = 0
+      for item_rows, future in batch:
+        future.set_result(probabilities[start:start + len(item_rows)])
+        start += len(item_rows)
+
+class ContractScorer:
+  def __init__(self, contract_id):
+    self.contract_id = contract_id
+    self.model = None
+    self.version = None
+    self.checked_at = 0.0
+    self.stats = LatencyStats()
+    self._lock = threading.Lock()
+    self.batcher = MicroBatcher(self._predict, self.stats)
+
+  def refresh(self, force=False):
+    if not force and time.monotonic() - self.checked_at < MODEL_REFRESH_SECONDS:
+      return
+    with self._lock:
+      if not force and time.monotonic() - self.checked_at < MODEL_REFRESH_SECONDS:
+        return
+      latest = model_registry.latest_version(self.contract_id)
+      if latest is not None and latest != self.version:
+        model, version = model_registry.load(self.contract_id, latest)
+        model.n_jobs = INFERENCE_N_JOBS
+        self.model, self.version = model, version
+      self.checked_at = time.monotonic()
+
+  def _predict(self, rows):
+    return self.model.predict_proba(rows)
+
+  def positive_column(self):
+    classes = list(self.model.classes_)
+    return classes.index(1) if 1 in classes else len(classes) - 1
+
+  def score(self, rows):
+    started = time.perf_counter()
+    self.refresh()
+    if self.model is None:
+      raise ModelNotFound(f"No global model has been published for contract {self.contract_id}")
+    if rows.ndim != 2 or rows.shape[1] != self.model.n_features_in_:
+      raise ValueError(f"Expected rows of {self.model.n_features_in_} features, got shape {rows.shape}")
+
+    version = self.version
+    probabilities = self.batcher.submit(rows).result(timeout=INFERENCE_TIMEOUT_SECONDS)
+    self.stats.record_request(time.perf_counter() - started, len(rows))
+    return probabilities[:, self.positive_column()], version
+
+class ScoringService:
+  def __init__(self):
+    self._scorers = {}
+    self._lock = threading.Lock()
+
+  def scorer(self, contract_id):
+    scorer = self._scorers.get(contract_id)
+    if scorer is None:
+      # no scorer (and batcher thread) for contracts without a model
+      if model_registry.latest_version(contract_id) is None:
+        raise ModelNotFound(f"No global model has been published for contract {contract_id}")
+      with self._lock:
+        scorer = self._scorers.get(contract_id)
+        if scorer is None:
+          scorer = self._scorers[contract_id] = ContractScorer(contract_id)
+    return scorer
+
+  def score(self, contract_id, rows):
+    return self.scorer(contract_id).score(rows)
+
+  def stats(self):
+    return {
+      contract_id: dict(scorer.stats.snapshot(), modelVersion=scorer.version)
+      for contract_id, scorer in list(self._scorers.items())
+    }
+
+scoring_service = ScoringService()
+
+# float32 row matrix from a request body: a JSON list of rows (or {"rows": [...]}),
+# an .npy array, or raw little-endian float32 values.
+def parse_rows(body, content_type, n_features=None):
+  content_type = (content_type or "").split(";")[0].strip().lower()
+  if content_type == "application/x-npy":
+    rows = np.lib.format.read_array(io.BytesIO(body), allow_pickle=False)
+  elif content_type == "application/octet-stream":
+    if not n_features:
+      raise ValueError("Raw float32 bodies need the X-Row-Width header")
+    if len(body) % (4 * n_features):
+      raise ValueError(f"Body is not a whole number of {n_features}-feature float32 rows")
+    rows = np.frombuffer(body, dtype="<f4").reshape(-1, n_features)
+  else:
+    data = json.loads(body)
+    rows = data.get("rows") if isinstance(data, dict) else data
+    if rows is None:
+      raise ValueError("JSON body must be a list of rows or an object with 'rows'")
+    rows = np.asarray(rows, dtype=np.float32)
+
+  if rows.ndim == 1 and rows.size:
+    rows = rows.reshape(1, -1)
+  if rows.ndim != 2 or rows.shape[0] == 0:
+    raise ValueError("Expected a non-empty two-dimensional batch of rows")
+  if rows.dtype != np.float32:
+    rows = rows.astype(np.float32)
+  return rows
@@ -0,0 +1,405 @@
+import os
+import glob
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+from bisect import bisect_left
+from pymongo import monitoring
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Logging and metrics for the backend.
+#
+# Modules log through get_logger(), which writes one JSON object per line (or
+# plain text with LOG_FORMAT=text) at LOG_LEVEL; keyword fields passed with
+# extra= end up as keys of the JSON object. Metrics are kept in memory by the
+# module-level `metrics` registry and rendered in the Prometheus text format
+# at /metrics: a latency histogram per Flask route (instrument_app) and a
+# latency and document-count histogram per Mongo command and collection
+# (mongo_listener, registered on the MongoClient).
+#
+# With METRICS_DIR set (serve.py sets it for gunicorn's workers), every
+# process writes a snapshot of its metrics to its own file there every
+# METRICS_FLUSH_SECONDS, and when it exits. A scrape merges every snapshot,
+# so whichever worker serves it reports the whole server: counters and
+# histograms are summed over all processes, including exited ones, so they
+# never go backwards when a worker is recycled, and gauges are reported per
+# live process with a pid label. The directory must be emptied whenever the
+# server starts. Without METRICS_DIR each process reports only its own
+# metrics.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+ROUTE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+DOCUMENT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# attributes every LogRecord has, anything else came in through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+  def format(self, record):
+    entry = {
+      "ts": round(record.created, 3),
+      "level": record.levelname,
+      "logger": record.name,
+      "message": record.getMessage()
+    }
+    for key, value in vars(record).items():
+      if key not in _RECORD_ATTRIBUTES:
+        entry[key] = value
+    if record.exc_info:
+      entry["exception"] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+_root_logger = logging.getLogger("dmlchain")
+
+def configure_logging(level=LOG_LEVEL, format=LOG_FORMAT):
+  handler = logging.StreamHandler()
+  if format == "json":
+    handler.setFormatter(JsonFormatter())
+  else:
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+  _root_logger.handlers[:] = [handler]
+  _root_logger.setLevel(level)
+  # gunicorn and the Flask dev server configure the root logger themselves
+  _root_logger.propagate = False
+
+configure_logging()
+
+def get_logger(name):
+  return _root_logger.getChild(name)
+
+log = get_logger("instrumentation")
+
+def _escape(value):
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra=()):
+  pairs = list(zip(names, values)) + list(extra)
+  if not pairs:
+    return ""
+  return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _number(value):
+  if value == float("inf"):
+    return "+Inf"
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _alive(pid):
+  if pid == os.getpid():
+    return True
+  if os.name == "nt":
+    # a single waitress process serves Windows, other PIDs are gone
+    return False
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+class Counter:
+  type = "counter"
+
+  def __init__(self, name, help, labels=()):
+    self.name = name
+    self.help = help
+    self.label_names = tuple(labels)
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def inc(self, *labels, amount=1):
+    with self._lock:
+      self._values[labels] = self._values.get(labels, 0) + amount
+
+  # [(label pairs, value)]
+  def series(self):
+    with self._lock:
+      values = dict(self._values)
+    return [(list(zip(self.label_names, labels)), value) for labels, value in values.items()]
+
+class Histogram:
+  type = "histogram"
+
+  def __init__(self, name, help, labels=(), buckets=ROUTE_BUCKETS):
+    self.name = name
+    self.help = help
+    self.label_names = tuple(labels)
+    self.buckets = tuple(sorted(buckets))
+    self._series = {}
+    self._lock = threading.Lock()
+
+  def observe(self, value, *labels):
+    # counts per bucket, made cumulative when rendered
+    index = bisect_left(self.buckets, value)
+    with self._lock:
+      series = self._series.get(labels)
+      if series is None:
+        series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+      series[0][index] += 1
+      series[1] += value
+      series[2] += 1
+
+  # [(label pairs, [bucket counts, sum, count])]
+  def series(self):
+    with self._lock:
+      return [
+        (list(zip(self.label_names, labels)), [list(counts), total, count])
+        for labels, (counts, total, count) in self._series.items()
+      ]
+
+# the label pairs of a series as a hashable, sortable key
+def _series_key(labels):
+  return tuple((str(name), str(value)) for name, value in labels)
+
+# merges the families of several processes' snapshots, given as
+# (pid, alive, families); see the comment at the top.
+def merge_families(processes, label_gauges=True):
+  merged = {}
+  for pid, alive, families in processes:
+    for family in families:
+      target = merged.setdefault(family["name"], dict(family, series={}))
+      for labels, value in family["series"]:
+        if family["type"] == "gauge":
+          if not alive:
+            continue
+          if label_gauges:
+            labels = list(labels) + [("pid", pid)]
+        key = _series_key(labels)
+        current = target["series"].get(key)
+        if current is None:
+          target["series"][key] = value if family["type"] != "histogram" else [list(value[0]), value[1], value[2]]
+        elif family["type"] == "histogram":
+          current[0] = [a + b for a, b in zip(current[0], value[0])]
+          current[1] += value[1]
+          current[2] += value[2]
+        else:
+          target["series"][key] = current + value
+  return list(merged.values())
+
+def render_families(families):
+  lines = []
+  for family in families:
+    name = family["name"]
+    lines.append(f"# HELP {name} {family['help']}")
+    lines.append(f"# TYPE {name} {family['type']}")
+    for key, value in sorted(family["series"].items()):
+      names, values = [pair[0] for pair in key], [pair[1] for pair in key]
+      if family["type"] != "histogram":
+        lines.append(f"{name}{_labels(names, values)} {_number(value)}")
+        continue
+      counts, total, count = value
+      cumulative = 0
+      for bound, bucket_count in zip(list(family["buckets"]) + [float("inf")], counts):
+        cumulative += bucket_count
+        lines.append(f"{name}_bucket{_labels(names, values, [('le', _number(bound))])} {cumulative}")
+      lines.append(f"{name}_sum{_labels(names, values)} {_number(total)}")
+      lines.append(f"{name}_count{_labels(names, values)} {count}")
+  return lines
+
+class MetricsRegistry:
+  def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_SECONDS):
+    self.directory = directory
+    self.flush_interval = flush_interval
+    self._metrics = []
+    self._collectors = []
+    self._flush_lock = threading.Lock()
+    # (pid, snapshot path), renewed in a forked child
+    self._snapshot = None
+    self._flusher = None
+
+  def counter(self, name, help, labels=()):
+    metric = Counter(name, help, labels)
+    self._metrics.append(metric)
+    return metric
+
+  def histogram(self, name, help, labels=(), buckets=ROUTE_BUCKETS):
+    metric = Histogram(name, help, labels, buckets)
+    self._metrics.append(metric)
+    return metric
+
+  # collect() is called on every scrape and flush and returns (name, type,
+  # help, [(labels dict, value), ...]) tuples, for stats other modules
+  # already keep. Counters must only grow while the process runs.
+  def register_collector(self, collect):
+    self._collectors.append(collect)
+
+  # this process's metrics as JSON-serializable families
+  def families(self):
+    families = []
+    for metric in self._metrics:
+      family = {"name": metric.name, "type": metric.type, "help": metric.help, "series": metric.series()}
+      if metric.type == "histogram":
+        family["buckets"] = list(metric.buckets)
+      families.append(family)
+    for collect in self._collectors:
+      try:
+        collected = list(collect())
+      except Exception:
+        log.exception("Metrics collector failed")
+        continue
+      for name, type, help, samples in collected:
+        families.append({
+          "name": name, "type": type, "help": help,
+          "series": [(list(labels.items()), value) for labels, value in samples]
+        })
+    return families
+
+  def _snapshot_path(self):
+    pid = os.getpid()
+    if self._snapshot is None or self._snapshot[0] != pid:
+      # a PID reused by a later process must not overwrite an exited one's counts
+      self._snapshot = (pid, os.path.join(self.directory, f"metrics-{pid}-{uuid.uuid4().hex[:8]}.json"))
+    return self._snapshot[1]
+
+  # writes this process's snapshot to the shared directory
+  def flush(self):
+    if self.directory is None:
+      return
+    families = self.families()
+    with self._flush_lock:
+      path = self._snapshot_path()
+      os.makedirs(self.directory, exist_ok=True)
+      with open(path + ".part", "w") as f:
+        json.dump({"pid": os.getpid(), "families": families}, f)
+      os.replace(path + ".part", path)
+
+  def _flush_periodically(self):
+    while True:
+      time.sleep(self.flush_interval)
+      try:
+        self.flush()
+      except Exception:
+        log.exception("Could not write the metrics snapshot")
+
+  # starts flushing in the background, in each worker once it has forked
+  def start_flushing(self):
+    if self.directory is None or self._flusher is not None:
+      return
+    self._flusher = threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True)
+    self._flusher.start()
+    atexit.register(self.flush)
+
+  def _processes(self):
+    self.flush()
+    own = self._snapshot_path()
+    processes = []
+    for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+      try:
+        with open(path) as f:
+          snapshot = json.load(f)
+      except (OSError, ValueError):
+        # removed, or from a server that ran before, while it's read
+        continue
+      processes.append((snapshot["pid"], path == own or _alive(snapshot["pid"]), snapshot["families"]))
+    return processes
+
+  def render(self):
+    if self.directory is None:
+      families = merge_families([(os.getpid(), True, self.families())], label_gauges=False)
+    else:
+      families = merge_families(self._processes())
+    lines = render_families(families)
+    lines.append("# HELP dmlchain_process_info The worker process that served this scrape")
+    lines.append("# TYPE dmlchain_process_info gauge")
+    lines.append(f"dmlchain_process_info{_labels(('pid',), (os.getpid(),))} 1")
+    return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+request_seconds = metrics.histogram(
+  "dmlchain_http_request_duration_seconds", "Latency of backend requests by route",
+  labels=("route", "method", "status")
+)
+mongo_seconds = metrics.histogram(
+  "dmlchain_mongo_command_duration_seconds", "Latency of MongoDB commands",
+  labels=("command", "collection"), buckets=MONGO_BUCKETS
+)
+mongo_documents = metrics.histogram(
+  "dmlchain_mongo_command_documents", "Documents returned or written per MongoDB command",
+  labels=("command", "collection"), buckets=DOCUMENT_BUCKETS
+)
+mongo_failures = metrics.counter(
+  "dmlchain_mongo_command_failures_total", "MongoDB commands that failed",
+  labels=("command", "collection")
+)
+
+def instrument_app(app):
+  from flask import g, request
+
+  metrics.start_flushing()
+
+  @app.before_request
+  def start_timer():
+    g.request_started = time.perf_counter()
+
+  @app.after_request
+  def record_request(response):
+    started = g.pop("request_started", None)
+    if started is None:
+      return response
+    seconds = time.perf_counter() - started
+    # the URL rule, not the path, keeps addresses and IDs out of the labels
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    request_seconds.observe(seconds, route, request.method, response.status_code)
+    if seconds * 1000 >= SLOW_REQUEST_MS:
+      log.warning("Slow request", extra={
+        "route": route, "method": request.method, "status": response.status_code, "ms": round(seconds * 1000, 1)
+      })
+    return response
+
+  return app
+
+# documents a command read or wrote, from its reply
+def _reply_documents(command_name, reply):
+  cursor = reply.get("cursor")
+  if isinstance(cursor, dict):
+    batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+    return len(batch) if batch is not None else None
+  if command_name == "findAndModify":
+    return 1 if reply.get("value") else 0
+  if command_name in ("insert", "update", "delete", "count"):
+    return reply.get("n")
+  return None
+
+class MongoCommandListener(monitoring.CommandListener):
+  def __init__(self):
+    self._started = {}
+    self._lock = threading.Lock()
+
+  def _key(self, event):
+    return event.connection_id, event.request_id
+
+  def started(self, event):
+    name = event.command_name
+    collection = event.command.get("collection") if name == "getMore" else event.command.get(name)
+    with self._lock:
+      self._started[self._key(event)] = collection if isinstance(collection, str) else ""
+
+  def _finish(self, event):
+    with self._lock:
+      return self._started.pop(self._key(event), "")
+
+  def succeeded(self, event):
+    collection = self._finish(event)
+    mongo_seconds.observe(event.duration_micros / 1e6, event.command_name, collection)
+    documents = _reply_documents(event.command_name, event.reply)
+    if documents is not None:
+      mongo_documents.observe(documents, event.command_name, collection)
+
+  def failed(self, event):
+    collection = self._finish(event)
+    mongo_seconds.observe(event.duration_micros / 1e6, event.command_name, collection)
+    mongo_failures.inc(event.command_name, collection)
+
+mongo_listener = MongoCommandListener()
@@ -1,66 +1,168 @@
 # type: ignore
+import io
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from dotenv import load_dotenv
 import base64
 from cryptography.fernet import Fernet
-import pickle
+from param_codec import decode_params
+from package_crypto import is_stream_encrypted, decrypt_bytes, decrypt_file
+from blob_cache import blob_cache
 
 load_dotenv()
 
 
-def retrieve_from_pinata(filepath, jwt_token):
-    url = "https://api.pinata.cloud/pinning/pinFileToIPFS"
-    headers = {"Authorization": f"Bearer {jwt_token}"}
-
-    with open(filepath, "rb") as file:
-        response = requests.post(url, files={"file": file}, headers=headers)
-        return response.json()
+# Pinata's pinning endpoint, or any stand-in that speaks the same API.
+PINATA_PIN_FILE_URL = os.getenv("PINATA_PIN_FILE_URL", "https://api.pinata.cloud/pinning/pinFileToIPFS")
+# when set, files are added to this IPFS node's HTTP API (/api/v0/add) instead.
+IPFS_API_URL = os.getenv("IPFS_API_URL")
+UPLOAD_POOL_SIZE = int(os.getenv("IPFS_UPLOAD_POOL_SIZE", "4"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_TIMEOUT = (10, 300)
+
+upload_session = requests.Session()
+upload_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=UPLOAD_POOL_SIZE))
+upload_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=UPLOAD_POOL_SIZE))
+
+
+class MultipartFileStream:
+    """A multipart/form-data body for one file that is read from disk in
+    chunks as it is sent, with a known length so no chunked encoding is needed."""
+
+    def __init__(self, filepath, field_name="file"):
+        self.boundary = uuid.uuid4().hex
+        filename = os.path.basename(filepath)
+        self._preamble = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        self._epilogue = f"\r\n--{self.boundary}--\r\n".encode()
+        self._file = open(filepath, "rb")
+        self._parts = [io.BytesIO(self._preamble), self._file, io.BytesIO(self._epilogue)]
+        self.len = len(self._preamble) + os.path.getsize(filepath) + len(self._epilogue)
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        chunks = []
+        while size > 0 and self._parts:
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pin_file(filepath):
+    with MultipartFileStream(filepath) as body:
+        headers = {"Content-Type": body.content_type, "Content-Length": str(body.len)}
+        if IPFS_API_URL:
+            url = f"{IPFS_API_URL.rstrip('/')}/api/v0/add?pin=true"
+            hash_field = "Hash"
+        else:
+            url = PINATA_PIN_FILE_URL
+            headers["Authorization"] = f"Bearer {os.getenv('PINATA_JWT_TOKEN')}"
+            hash_field = "IpfsHash"
+
+        response = upload_session.post(url, data=body, headers=headers, timeout=UPLOAD_TIMEOUT)
+        response.raise_for_status()
+        return response.json()[hash_field]
 
 
 def upload_file_to_ipfs(filepath):
-    PINATA_JWT_TOKEN = os.getenv("PINATA_JWT_TOKEN")
-    ipfs_hash = retrieve_from_pinata(filepath, PINATA_JWT_TOKEN).get("IpfsHash")
+    return pin_file(filepath)
 
-    with open("model_hash", "w") as hash_file:
-        hash_file.write(ipfs_hash)
 
-    return ipfs_hash
+# uploads several artifacts concurrently, returning {filepath: ipfs_hash}.
+def upload_files_to_ipfs(filepaths, max_workers=UPLOAD_POOL_SIZE):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashes = executor.map(pin_file, filepaths)
+        return dict(zip(filepaths, hashes))
 
-def retrieve_model(ipfs_hash, contract_id):
-  url = f"https://gateway.pinata.cloud/ipfs/{ipfs_hash}"
-  response = requests.get(url, timeout=10)
-  response.raise_for_status()
+IPFS_GATEWAY = os.getenv("IPFS_GATEWAY", "https://gateway.pinata.cloud/ipfs")
+GATEWAY_POOL_SIZE = int(os.getenv("IPFS_GATEWAY_POOL_SIZE", "16"))
+GATEWAY_CHUNK_SIZE = 1024 * 1024
 
-  folder_path = f'{contract_id}_model'
-  os.makedirs(folder_path, exist_ok=True)
+# keep-alive connections to the gateway, shared by every download thread.
+gateway_session = requests.Session()
+gateway_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=GATEWAY_POOL_SIZE))
+gateway_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=GATEWAY_POOL_SIZE))
 
-  filepath = os.path.join(folder_path, f'model.ipynb')
-  with open(filepath, 'wb') as f:
-    f.write(response.content)
-  return filepath
+# path of the blob in the local CID cache, downloading it on a miss.
+def fetch_to_cache(ipfs_hash):
+  cached_path = blob_cache.path(ipfs_hash)
+  if cached_path:
+    return cached_path
 
-def retrieve_model_params(model_params_ipfs_hash, key):
-    url = f"https://gateway.pinata.cloud/ipfs/{model_params_ipfs_hash}"
-    response = requests.get(url, timeout=10)
+  url = f"{IPFS_GATEWAY}/{ipfs_hash}"
+  with gateway_session.get(url, timeout=10, stream=True) as response:
     response.raise_for_status()
-
-    decoded_key = base64.b64decode(key)
-    cipher_suite = Fernet(decoded_key)
-    decrypted_content = cipher_suite.decrypt(response.content)
-
-    temp_file_path = f"{model_params_ipfs_hash}_params.pkl"
-    try:
-        with open(temp_file_path, 'wb') as temp_file:
-            temp_file.write(decrypted_content)
-        with open(temp_file_path, 'rb') as temp_file:
-            decrypted_params = pickle.load(temp_file)
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-
-    return decrypted_params
-
-
-
+    return blob_cache.put_stream(ipfs_hash, response.iter_content(chunk_size=GATEWAY_CHUNK_SIZE))
+
+# (chunks, content length) of a blob that isn't cached yet. The chunks are
+# forwarded as they arrive from the gateway and written to the cache on the
+# way; the length is None when the gateway doesn't send one.
+def stream_from_ipfs(ipfs_hash):
+  response = gateway_session.get(f"{IPFS_GATEWAY}/{ipfs_hash}", timeout=10, stream=True)
+  try:
+    response.raise_for_status()
+  except Exception:
+    response.close()
+    raise
+  length = response.headers.get("Content-Length")
+  if response.headers.get("Content-Encoding", "identity") != "identity":
+    # requests decodes the body, the upstream length no longer applies
+    length = None
+
+  def chunks():
+    with response:
+      yield from blob_cache.stream_through(ipfs_hash, response.iter_content(chunk_size=GATEWAY_CHUNK_SIZE))
+
+  return chunks(), int(length) if length else None
+
+def fetch_from_ipfs(ipfs_hash):
+  with open(fetch_to_cache(ipfs_hash), 'rb') as f:
+    return f.read()
+
+def retrieve_model_params(model_params_ipfs_hash, key, allow_pickle=None):
+    return decrypt_model_params_file(fetch_to_cache(model_params_ipfs_hash), key, allow_pickle)
+
+# decrypts and decodes a parameter package entirely in memory. Packages
+# sealed with package_crypto are recognised by their header, anything else is
+# treated as a Fernet token. allow_pickle is passed on to decode_params.
+def decrypt_model_params(encrypted_content, key, allow_pickle=None):
+    if is_stream_encrypted(encrypted_content):
+        return decode_params(decrypt_bytes(encrypted_content, base64.b64decode(key)), allow_pickle)
+    cipher_suite = Fernet(base64.b64decode(key))
+    decrypted_content = cipher_suite.decrypt(encrypted_content)
+    del encrypted_content
+    return decode_params(decrypted_content, allow_pickle)
+
+# same as decrypt_model_params for a package on disk; stream-encrypted
+# packages are decrypted chunk by chunk without reading the file in whole.
+def decrypt_model_params_file(filepath, key, allow_pickle=None):
+    with open(filepath, 'rb') as f:
+        stream_encrypted = is_stream_encrypted(f.read(16))
+    if stream_encrypted:
+        return decode_params(decrypt_file(filepath, base64.b64decode(key)), allow_pickle)
+    with open(filepath, 'rb') as f:
+        return decrypt_model_params(f.read(), key, allow_pickle)
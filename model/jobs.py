@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from instrumentation import get_logger, metrics
+
+load_dotenv()
+
+log = get_logger("jobs")
+
+# Background jobs for slow, I/O-bound requests.
+#
+# A route submits the slow part of its work as a job and answers right away
+# with the job's ID; clients poll /jobs/<id> for the status and result. Jobs
+# run on a bounded thread pool in the worker process that accepted them, and
+# at most JOB_QUEUE_SIZE of them wait for a thread, beyond that submissions
+# are refused. Job records live in a SQLite database in WAL mode, so any
+# worker can answer a status request. While a job for a (kind, key) pair,
+# e.g. an IPFS hash or a contract ID, is queued or running, submitting the
+# same pair returns that job instead of starting another one. Finished jobs
+# are kept for JOB_RESULT_TTL seconds.
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "256"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+PRUNE_INTERVAL = 60
+
+IN_FLIGHT = ("queued", "running")
+
+class JobQueueFull(Exception):
+  pass
+
+# raised by a job for an expected failure, its message is the job's error
+class JobFailed(Exception):
+  pass
+
+job_wait_seconds = metrics.histogram(
+  "dmlchain_job_wait_seconds", "Time jobs spent queued before a worker thread picked them up", labels=("kind",)
+)
+job_run_seconds = metrics.histogram(
+  "dmlchain_job_run_seconds", "Time jobs spent running", labels=("kind",)
+)
+jobs_finished = metrics.counter(
+  "dmlchain_jobs_total", "Finished jobs by outcome", labels=("kind", "status")
+)
+jobs_deduplicated = metrics.counter(
+  "dmlchain_jobs_deduplicated_total", "Submissions answered with an in-flight job", labels=("kind",)
+)
+
+def _alive(pid):
+  if pid == os.getpid():
+    return True
+  if os.name == "nt":
+    # a single waitress process serves Windows, other PIDs are gone
+    return False
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+class JobQueue:
+  def __init__(self, path, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE):
+    self.path = path
+    self.max_queued = max_queued
+    self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._queued = 0
+    self._running = 0
+    self._pruned_at = 0.0
+    with self._connection() as connection:
+      connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+          job_id TEXT PRIMARY KEY,
+          kind TEXT NOT NULL,
+          key TEXT NOT NULL,
+          status TEXT NOT NULL,
+          result TEXT,
+          error TEXT,
+          pid INTEGER NOT NULL,
+          created_at REAL NOT NULL,
+          started_at REAL,
+          finished_at REAL
+        )
+      """)
+      connection.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (kind, key)
+        WHERE status IN ('queued', 'running')
+      """)
+      connection.execute("CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)")
+
+  def _connection(self):
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      self._local.connection = connection
+    return connection
+
+  def _in_flight(self, kind, key):
+    return self._connection().execute(
+      "SELECT job_id, pid FROM jobs WHERE kind = ? AND key = ? AND status IN ('queued', 'running')", (kind, key)
+    ).fetchone()
+
+  def _finish(self, job_id, status, result=None, error=None):
+    self._connection().execute(
+      "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+      (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+    )
+
+  def _prune(self):
+    now = time.time()
+    if now - self._pruned_at < PRUNE_INTERVAL:
+      return
+    self._pruned_at = now
+    self._connection().execute("DELETE FROM jobs WHERE finished_at < ?", (now - JOB_RESULT_TTL,))
+
+  # (job, created) for running fn(*args) as a `kind` job identified by key.
+  # fn's return value must be JSON-serializable, it is the job's result.
+  def submit(self, kind, key, fn, *args):
+    key = str(key)
+    self._prune()
+    while True:
+      existing = self._in_flight(kind, key)
+      if existing is not None:
+        job_id, pid = existing
+        if _alive(pid):
+          jobs_deduplicated.inc(kind)
+          return self.get(job_id), False
+        # the worker running it exited, e.g. it was recycled or crashed
+        self._finish(job_id, "failed", error="Abandoned by an exited worker")
+        continue
+
+      with self._lock:
+        if self._queued >= self.max_queued:
+          raise JobQueueFull(f"{self._queued} jobs are already queued")
+        job_id = uuid.uuid4().hex
+        try:
+          self._connection().execute(
+            "INSERT INTO jobs (job_id, kind, key, status, pid, created_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (job_id, kind, key, os.getpid(), time.time())
+          )
+        except sqlite3.IntegrityError:
+          # another worker submitted the same job in the meantime
+          continue
+        self._queued += 1
+      self._executor.submit(self._run, job_id, kind, fn, args)
+      return self.get(job_id), True
+
+  def _run(self, job_id, kind, fn, args):
+    started_at = time.time()
+    with self._lock:
+      self._queued -= 1
+      self._running += 1
+    try:
+      created_at = self._connection().execute(
+        "UPDATE jobs SET status = 'running', started_at = ? WHERE job_id = ? RETURNING created_at", (started_at, job_id)
+      ).fetchone()[0]
+      job_wait_seconds.observe(max(started_at - created_at, 0.0), kind)
+      try:
+        result = fn(*args)
+      except JobFailed as e:
+        status, result, error = "failed", None, str(e)
+      except Exception as e:
+        log.exception("Job %s (%s) failed", job_id, kind)
+        status, result, error = "failed", None, f"Internal error: {e}"
+      else:
+        status, error = "succeeded", None
+      self._finish(job_id, status, result, error)
+      job_run_seconds.observe(time.time() - started_at, kind)
+      jobs_finished.inc(kind, status)
+    except Exception:
+      log.exception("Could not record the outcome of job %s", job_id)
+    finally:
+      with self._lock:
+        self._running -= 1
+
+  def get(self, job_id):
+    row = self._connection().execute(
+      "SELECT job_id, kind, key, status, result, error, created_at, started_at, finished_at FROM jobs WHERE job_id = ?",
+      (job_id,)
+    ).fetchone()
+    if row is None:
+      return None
+    return {
+      "jobId": row[0],
+      "kind": row[1],
+      "key": row[2],
+      "status": row[3],
+      "result": json.loads(row[4]) if row[4] is not None else None,
+      "error": row[5],
+      "createdAt": row[6],
+      "startedAt": row[7],
+      "finishedAt": row[8]
+    }
+
+  def stats(self):
+    with self._lock:
+      return {"queued": self._queued, "running": self._running, "maxQueued": self.max_queued}
+
+job_queue = JobQueue(
+  os.getenv("JOB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3"))
+)
+
+def collect_job_metrics():
+  stats = job_queue.stats()
+  yield "dmlchain_job_queue_depth", "gauge", "Jobs waiting for a worker thread in this process", [({}, stats["queued"])]
+  yield "dmlchain_jobs_running", "gauge", "Jobs running in this process", [({}, stats["running"])]
+
+metrics.register_collector(collect_job_metrics)
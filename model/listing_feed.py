@@ -0,0 +1,210 @@
+import os
+import time
+import threading
+from bisect import bisect_right, insort
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+from instrumentation import get_logger
+
+load_dotenv()
+
+log = get_logger("listing_feed")
+
+# Materialized marketplace feed.
+#
+# The listings a user may see are every unexpired listing whose creator's
+# reputation is at most the user's own, soonest expiry first. Instead of
+# running that query per request, each process keeps the unexpired listings
+# in memory together with, for every reputation threshold that has been asked
+# for, the sorted (expiresAtTs, contractId) keys visible at that threshold.
+# A read is a bisect past the expired keys (and the cursor) plus a slice.
+#
+# Every write to createdListings sets feedUpdatedAt, so a process catches up
+# with the writes of all workers with one indexed query for the listings
+# changed since its last sync, at most every FEED_REFRESH_SECONDS or right
+# after a write it made itself. A full reload every FEED_REBUILD_SECONDS
+# picks up deleted listings and anything a clock skew larger than
+# FEED_SYNC_OVERLAP_SECONDS between workers made a sync miss.
+
+FEED_REFRESH_SECONDS = float(os.getenv("FEED_REFRESH_SECONDS", "1"))
+FEED_REBUILD_SECONDS = float(os.getenv("FEED_REBUILD_SECONDS", "600"))
+FEED_SYNC_OVERLAP_SECONDS = float(os.getenv("FEED_SYNC_OVERLAP_SECONDS", "5"))
+
+FEED_FIELDS = {
+  "_id": 0, "contractId": 1, "createdAt": 1, "expiresAt": 1, "expiresAtTs": 1, "url": 1, "paid": 1,
+  "creatorAddress": 1, "creatorReputation": 1, "feedUpdatedAt": 1
+}
+EPOCH = datetime(1970, 1, 1)
+
+# filters of the feed's reads, also explained by index_audit.py
+def unexpired_filter(now):
+  return {"expiresAtTs": {"$gt": now}}
+
+def changed_since_filter(since):
+  return {"feedUpdatedAt": {"$gte": since}}
+
+def utc_naive(value):
+  # Mongo hands back naive UTC datetimes, cursors and clocks are aware
+  if value.tzinfo is not None:
+    value = value.astimezone(timezone.utc).replace(tzinfo=None)
+  return value
+
+def feed_timestamp():
+  return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# the response shape of /get-filtered-listings
+def feed_entry(document):
+  entry = {
+    "contractId": document["contractId"],
+    "createdAt": document.get("createdAt"),
+    "expiresAt": document.get("expiresAt"),
+    "url": document.get("url"),
+    "creator": document.get("creatorAddress"),
+    "reputation": document.get("creatorReputation", 0)
+  }
+  if "paid" in document:
+    entry["paid"] = document["paid"]
+  return entry
+
+class ThresholdView:
+  def __init__(self, keys, modified_at):
+    self.keys = keys
+    self.modified_at = modified_at
+
+class ListingFeed:
+  def __init__(self, collection):
+    self.collection = collection
+    self._lock = threading.RLock()
+    self._sync_lock = threading.Lock()
+    # contractId -> (key, reputation, entry, modified at)
+    self._listings = {}
+    self._keys = []
+    self._views = {}
+    self._built_at = None
+    self._synced_at = 0.0
+    self._sync_from = None
+    self._dirty = False
+    # listings can disappear in a rebuild without a write we saw
+    self._modified_floor = EPOCH
+
+  def _view(self, reputation):
+    view = self._views.get(reputation)
+    if view is None:
+      keys = [key for key in self._keys if self._listings[key[1]][1] <= reputation]
+      modified_at = max((self._listings[key[1]][3] for key in keys), default=self._modified_floor)
+      modified_at = max(modified_at, self._modified_floor)
+      view = self._views[reputation] = ThresholdView(keys, modified_at)
+    return view
+
+  def _remove(self, contract_id, modified_at):
+    current = self._listings.pop(contract_id, None)
+    if current is None:
+      return
+    key, reputation = current[0], current[1]
+    self._keys.pop(bisect_right(self._keys, key) - 1)
+    for threshold, view in self._views.items():
+      if reputation <= threshold:
+        view.keys.pop(bisect_right(view.keys, key) - 1)
+        view.modified_at = max(view.modified_at, modified_at)
+
+  def _put(self, document, now):
+    modified_at = utc_naive(document.get("feedUpdatedAt") or EPOCH)
+    contract_id = document["contractId"]
+    self._remove(contract_id, modified_at)
+    expires_at = document.get("expiresAtTs")
+    if expires_at is None or utc_naive(expires_at) <= now:
+      return
+    key = (utc_naive(expires_at), contract_id)
+    reputation = document.get("creatorReputation", 0)
+    self._listings[contract_id] = (key, reputation, feed_entry(document), modified_at)
+    insort(self._keys, key)
+    for threshold, view in self._views.items():
+      if reputation <= threshold:
+        insort(view.keys, key)
+        view.modified_at = max(view.modified_at, modified_at)
+
+  def _drop_expired(self, now):
+    end = bisect_right(self._keys, (now, float("inf")))
+    if not end:
+      return
+    for key in self._keys[:end]:
+      del self._listings[key[1]]
+    del self._keys[:end]
+    for view in self._views.values():
+      expired = bisect_right(view.keys, (now, float("inf")))
+      if expired:
+        view.modified_at = max(view.modified_at, view.keys[expired - 1][0])
+        del view.keys[:expired]
+
+  def rebuild(self):
+    started = feed_timestamp()
+    documents = list(self.collection.find(unexpired_filter(started), FEED_FIELDS))
+    with self._lock:
+      previous = {contract_id: listing[:3] for contract_id, listing in self._listings.items() if listing[0][0] > started}
+      self._listings, self._keys, self._views = {}, [], {}
+      for document in documents:
+        self._put(document, started)
+      if {contract_id: listing[:3] for contract_id, listing in self._listings.items()} != previous:
+        self._modified_floor = started
+      self._built_at = time.monotonic()
+      self._sync_from = started
+    log.info("Rebuilt the marketplace feed with %d listings", len(self._listings))
+
+  def _sync(self):
+    if self._built_at is None or time.monotonic() - self._built_at >= FEED_REBUILD_SECONDS:
+      self.rebuild()
+      return
+    started = feed_timestamp()
+    since = self._sync_from.timestamp() - FEED_SYNC_OVERLAP_SECONDS
+    changed = list(self.collection.find(
+      changed_since_filter(datetime.fromtimestamp(since, tz=timezone.utc)), FEED_FIELDS
+    ))
+    with self._lock:
+      for document in changed:
+        self._put(document, started)
+      self._drop_expired(started)
+      self._sync_from = started
+
+  def refresh(self):
+    if not self._dirty and time.monotonic() - self._synced_at < FEED_REFRESH_SECONDS:
+      return
+    blocking = self._built_at is None
+    # one thread syncs, the others keep reading the current feed meanwhile
+    if not self._sync_lock.acquire(blocking=blocking):
+      return
+    try:
+      if self._built_at is not None and not self._dirty and time.monotonic() - self._synced_at < FEED_REFRESH_SECONDS:
+        return
+      self._dirty = False
+      self._sync()
+      self._synced_at = time.monotonic()
+    finally:
+      self._sync_lock.release()
+
+  # called after this process wrote to createdListings
+  def invalidate(self):
+    self._dirty = True
+
+  # (listings, next cursor, last modified) visible at the reputation,
+  # starting after the cursor's (expiresAtTs, contractId).
+  def page(self, reputation, limit=None, cursor=None):
+    self.refresh()
+    now = feed_timestamp()
+    with self._lock:
+      view = self._view(reputation)
+      expired = bisect_right(view.keys, (now, float("inf")))
+      start = expired
+      if cursor:
+        start = max(start, bisect_right(view.keys, (utc_naive(cursor[0]), cursor[1])))
+      keys = view.keys[start:start + limit] if limit else view.keys[start:]
+      listings = [dict(self._listings[key[1]][2]) for key in keys]
+      # a listing dropping out on expiry changes the view as well
+      last_modified = max(view.modified_at, view.keys[expired - 1][0] if expired else EPOCH)
+
+    next_cursor = keys[-1] if limit and len(keys) == limit else None
+    return listings, next_cursor, last_modified.replace(tzinfo=timezone.utc)
+
+  def stats(self):
+    with self._lock:
+      return {"listings": len(self._listings), "thresholds": len(self._views)}
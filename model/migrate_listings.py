@@ -0,0 +1,99 @@
+# One-shot migration of the createdListings / subscribedListings arrays embedded
+# in user documents into their own collections.
+#
+#   python migrate_listings.py [--dry-run]
+#
+# Listings are upserted by contractId (created) and subscriber + contractId
+# (subscribed), so the script can be rerun safely if it is interrupted.
+# Created listings get a feedUpdatedAt, so the marketplace feed of running
+# workers picks them up on its next sync rather than its next full rebuild.
+import argparse
+from pymongo import UpdateOne
+from database import (
+  user_collection,
+  created_listing_collection,
+  subscribed_listing_collection,
+  ensure_indexes,
+  parse_expiry
+)
+from listing_feed import feed_timestamp
+
+BATCH_SIZE = 500
+
+def created_listing_ops(user):
+  ops = []
+  for listing in user.get('createdListings', []):
+    record = {key: value for key, value in listing.items() if key != 'expiresAtTs'}
+    record['creatorAddress'] = user['address']
+    record['creatorReputation'] = user.get('reputation', 0)
+    if record.get('expiresAt'):
+      record['expiresAtTs'] = parse_expiry(record['expiresAt'])
+    record['feedUpdatedAt'] = feed_timestamp()
+    ops.append(UpdateOne(
+      {"contractId": record['contractId']},
+      {"$setOnInsert": record},
+      upsert=True
+    ))
+  return ops
+
+def subscribed_listing_ops(user):
+  ops = []
+  for listing in user.get('subscribedListings', []):
+    record = dict(listing)
+    record['subscriberAddress'] = user['address']
+    ops.append(UpdateOne(
+      {"subscriberAddress": user['address'], "contractId": record['contractId']},
+      {"$setOnInsert": record},
+      upsert=True
+    ))
+  return ops
+
+def migrate(dry_run=False):
+  ensure_indexes()
+
+  stats = {"users": 0, "createdListings": 0, "subscribedListings": 0}
+  users = user_collection.find({
+    "$or": [
+      {"createdListings": {"$exists": True}},
+      {"subscribedListings": {"$exists": True}}
+    ]
+  })
+
+  for user in users:
+    created_ops = created_listing_ops(user)
+    subscribed_ops = subscribed_listing_ops(user)
+    stats["users"] += 1
+    stats["createdListings"] += len(created_ops)
+    stats["subscribedListings"] += len(subscribed_ops)
+
+    if dry_run:
+      continue
+
+    for start in range(0, len(created_ops), BATCH_SIZE):
+      created_listing_collection.bulk_write(created_ops[start:start + BATCH_SIZE], ordered=False)
+    for start in range(0, len(subscribed_ops), BATCH_SIZE):
+      subscribed_listing_collection.bulk_write(subscribed_ops[start:start + BATCH_SIZE], ordered=False)
+
+    # only drop the embedded arrays once both collections hold the listings
+    user_collection.update_one(
+      {"_id": user["_id"]},
+      {"$unset": {"createdListings": "", "subscribedListings": ""}}
+    )
+
+  if not dry_run:
+    # listings migrated before they were given a feedUpdatedAt
+    created_listing_collection.update_many(
+      {"feedUpdatedAt": {"$exists": False}},
+      {"$set": {"feedUpdatedAt": feed_timestamp()}}
+    )
+
+  return stats
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Move embedded user listings into their own collections.")
+  parser.add_argument('--dry-run', action='store_true', help="count the listings without writing anything")
+  args = parser.parse_args()
+
+  stats = migrate(dry_run=args.dry_run)
+  prefix = "Would migrate" if args.dry_run else "Migrated"
+  print(f"{prefix} {stats['createdListings']} created and {stats['subscribedListings']} subscribed listings from {stats['users']} users")
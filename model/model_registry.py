@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from aggregation import export_trees, forest_from_package
+from param_codec import encode_params, decode_npz_params
+
+try:
+  import fcntl
+except ImportError:
+  # Windows runs a single waitress process, the thread lock is enough there
+  fcntl = None
+
+load_dotenv()
+
+# Published global models, one numbered version per aggregation of a contract.
+#
+# Each version is stored as <dir>/<contract_id>/<version>.npz, an npz
+# parameter package holding the forest's exported trees, and a LATEST file in
+# the contract's directory names the current version. Files are written to a
+# temp file and renamed into place, so readers in other processes (the
+# backend's workers) never see a partial model.
+
+MODEL_REGISTRY_DIR = os.getenv(
+  "MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "global_models")
+)
+
+class ModelRegistry:
+  def __init__(self, directory):
+    self.directory = directory
+    self._lock = threading.Lock()
+    self._contract_locks = {}
+
+  def _contract_dir(self, contract_id):
+    contract_id = str(contract_id)
+    if not contract_id or os.sep in contract_id or contract_id.startswith("."):
+      raise ValueError(f"Invalid contract ID: {contract_id}")
+    return os.path.join(self.directory, contract_id)
+
+  def _write(self, path, data):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    with open(temp_path, "wb") as f:
+      f.write(data)
+    os.replace(temp_path, path)
+
+  # exclusive per-contract lock shared by every thread and worker process.
+  @contextmanager
+  def lock(self, contract_id):
+    contract_dir = self._contract_dir(contract_id)
+    os.makedirs(contract_dir, exist_ok=True)
+    with self._lock:
+      contract_lock = self._contract_locks.setdefault(str(contract_id), threading.Lock())
+    with contract_lock:
+      with open(os.path.join(contract_dir, ".lock"), "a") as lock_file:
+        if fcntl:
+          fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+          yield
+        finally:
+          if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def latest_version(self, contract_id):
+    try:
+      with open(os.path.join(self._contract_dir(contract_id), "LATEST")) as f:
+        return int(f.read().strip())
+    except (OSError, ValueError):
+      return None
+
+  def versions(self, contract_id):
+    try:
+      names = os.listdir(self._contract_dir(contract_id))
+    except OSError:
+      return []
+    return sorted(int(name[:-4]) for name in names if name.endswith(".npz") and name[:-4].isdigit())
+
+  # extra holds additional arrays or scalars stored alongside the trees.
+  def publish(self, contract_id, forest, metadata=None, extra=None):
+    package = {
+      "feature_importances": forest.feature_importances_,
+      "n_estimators": len(forest.estimators_),
+      "published_at": time.time(),
+      "metadata": metadata or {}
+    }
+    package.update(export_trees(forest))
+    package.update(extra or {})
+
+    contract_dir = self._contract_dir(contract_id)
+    with self._lock:
+      os.makedirs(contract_dir, exist_ok=True)
+      # claim the version number with an exclusive create, another process
+      # may be publishing the same contract
+      version = max(self.versions(contract_id), default=0) + 1
+      while True:
+        try:
+          os.close(os.open(os.path.join(contract_dir, f"{version}.npz"), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+          break
+        except FileExistsError:
+          version += 1
+      self._write(os.path.join(contract_dir, f"{version}.npz"), encode_params(package))
+      if version > (self.latest_version(contract_id) or 0):
+        self._write(os.path.join(contract_dir, "LATEST"), str(version).encode())
+    return version
+
+  def load_package(self, contract_id, version=None):
+    version = version or self.latest_version(contract_id)
+    if version is None:
+      return None, None
+    with open(os.path.join(self._contract_dir(contract_id), f"{version}.npz"), "rb") as f:
+      return decode_npz_params(f.read()), version
+
+  # (forest, version) of a published model, (None, None) if there is none.
+  def load(self, contract_id, version=None):
+    package, version = self.load_package(contract_id, version)
+    if package is None:
+      return None, None
+    return forest_from_package(package), version
+
+  def describe(self, contract_id):
+    package, version = self.load_package(contract_id)
+    if package is None:
+      return None
+    return {
+      "contractId": str(contract_id),
+      "version": version,
+      "versions": self.versions(contract_id),
+      "publishedAt": package["published_at"],
+      "nEstimators": package["n_estimators"],
+      "nFeatures": package["n_features"],
+      "metadata": package["metadata"]
+    }
+
+model_registry = ModelRegistry(MODEL_REGISTRY_DIR)
@@ -0,0 +1,109 @@
+import io
+import json
+import time
+import pickle
+import argparse
+import numpy as np
+from cryptography.fernet import Fernet
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+from aggregation import export_trees
+from param_codec import encode_params, encode_compact_params, decode_params
+from package_crypto import generate_key, encrypt_stream, decrypt_bytes
+
+# Size and throughput of the federation package formats, from a forest
+# trained on synthetic data shaped like the credit card dataset (or on a CSV
+# via data_loader). Every format is encoded, encrypted, decrypted and decoded
+# `repeat` times and the best time of each step is reported as JSON.
+#
+#   pickle         - the notebook's original package: pickled predictions,
+#                    importances and hyperparameters, Fernet-encrypted
+#   pickle+trees   - the same with the exported trees, for a like-for-like
+#                    comparison with the formats that ship trees
+#   npz            - stored npz (v1 layout) with predictions and trees, Fernet
+#   compact        - compact npz without predictions, quantized and deflated,
+#                    encrypted with chunked AES-GCM
+
+def fernet_codec(encode, decode):
+  cipher_suite = Fernet(Fernet.generate_key())
+  return (
+    lambda params: cipher_suite.encrypt(encode(params)),
+    lambda sealed: decode(cipher_suite.decrypt(sealed))
+  )
+
+def gcm_codec(encode, decode):
+  key = generate_key()
+
+  def seal(params):
+    sealed = io.BytesIO()
+    encrypt_stream(io.BytesIO(encode(params)), sealed, key)
+    return sealed.getvalue()
+  return seal, lambda sealed: decode(decrypt_bytes(sealed, key))
+
+def build_packages(rows, features, n_estimators, source=None):
+  if source:
+    from data_loader import load_split
+    xTrain, xTest, yTrain, yTest = load_split(source)
+  else:
+    xData, yData = make_classification(
+      n_samples=rows, n_features=features, weights=[0.998], flip_y=0.001, random_state=42
+    )
+    xTrain, xTest, yTrain, yTest = train_test_split(
+      xData.astype(np.float32), yData, test_size=0.2, random_state=42
+    )
+  rfc = RandomForestClassifier(n_estimators=n_estimators, n_jobs=-1, random_state=42).fit(xTrain, yTrain)
+
+  legacy = {
+    'predictions': rfc.predict(xTest),
+    'feature_importances': rfc.feature_importances_,
+    'n_estimators': rfc.n_estimators,
+    'max_features': rfc.max_features,
+    'max_depth': rfc.max_depth if rfc.max_depth is not None else -1
+  }
+  full = dict(legacy, n_samples=len(xTrain), **export_trees(rfc))
+  return legacy, full, len(xTest)
+
+def measure(params, seal, unseal, repeat):
+  best = {"seal": float("inf"), "unseal": float("inf")}
+  for _ in range(repeat):
+    started = time.perf_counter()
+    sealed = seal(params)
+    best["seal"] = min(best["seal"], time.perf_counter() - started)
+    started = time.perf_counter()
+    unseal(sealed)
+    best["unseal"] = min(best["unseal"], time.perf_counter() - started)
+  return {
+    "bytes": len(sealed),
+    "sealSeconds": round(best["seal"], 5),
+    "unsealSeconds": round(best["unseal"], 5),
+    "sealMBps": round(len(sealed) / best["seal"] / 1e6, 2),
+    "unsealMBps": round(len(sealed) / best["unseal"] / 1e6, 2)
+  }
+
+def run_benchmark(rows=85_000, features=30, n_estimators=100, repeat=5, source=None):
+  legacy, full, test_rows = build_packages(rows, features, n_estimators, source)
+  formats = {
+    "pickle": (legacy, fernet_codec(pickle.dumps, pickle.loads)),
+    "pickle+trees": (full, fernet_codec(pickle.dumps, pickle.loads)),
+    "npz": (full, fernet_codec(encode_params, decode_params)),
+    "compact": (full, gcm_codec(encode_compact_params, decode_params))
+  }
+  report = {"rows": rows if not source else None, "testRows": test_rows, "nEstimators": n_estimators, "formats": {}}
+  for name, (params, (seal, unseal)) in formats.items():
+    report["formats"][name] = measure(params, seal, unseal, repeat)
+  baseline = report["formats"]["pickle+trees"]["bytes"]
+  for result in report["formats"].values():
+    result["sizeVsPickleTrees"] = round(result["bytes"] / baseline, 3)
+  return report
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Compare federation package sizes and encode/encrypt throughput.")
+  parser.add_argument('--rows', type=int, default=85_000, help="synthetic rows, about one 30%% shard of creditcard.csv")
+  parser.add_argument('--features', type=int, default=30)
+  parser.add_argument('--n-estimators', type=int, default=100)
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--source', help="train on this CSV instead of synthetic data")
+  args = parser.parse_args()
+  print(json.dumps(run_benchmark(args.rows, args.features, args.n_estimators, args.repeat, args.source), indent=2))
@@ -0,0 +1,120 @@
+import io
+import os
+import struct
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Chunked AES-256-GCM for parameter packages.
+#
+# Fernet encrypts a whole message at once and base64-encodes the token, so
+# both sides hold the full package (plus a third again) in memory. Here the
+# plaintext is sealed in fixed-size chunks, each with its own nonce (a random
+# per-file prefix plus the chunk index) and its index and a final-chunk flag
+# bound in as associated data, so chunks can't be reordered, dropped or the
+# stream truncated without decryption failing. Files start with MAGIC, which
+# is how readers tell them apart from Fernet tokens.
+
+MAGIC = b"DMLGCM01"
+HEADER = struct.Struct("<8sI8s")
+CHUNK_AAD = struct.Struct(">IB")
+TAG_SIZE = 16
+CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+def generate_key():
+  return AESGCM.generate_key(bit_length=256)
+
+def is_stream_encrypted(data):
+  return bytes(data[:len(MAGIC)]) == MAGIC
+
+def _read_exactly(reader, size):
+  parts = []
+  while size > 0:
+    part = reader.read(size)
+    if not part:
+      break
+    parts.append(part)
+    size -= len(part)
+  return b"".join(parts)
+
+def encrypt_stream(reader, writer, key, chunk_size=CHUNK_SIZE):
+  aead = AESGCM(key)
+  prefix = os.urandom(8)
+  header = HEADER.pack(MAGIC, chunk_size, prefix)
+  writer.write(header)
+
+  written = len(header)
+  index = 0
+  chunk = _read_exactly(reader, chunk_size)
+  while True:
+    following = _read_exactly(reader, chunk_size) if len(chunk) == chunk_size else b""
+    final = not following
+    sealed = aead.encrypt(prefix + struct.pack(">I", index), chunk, header + CHUNK_AAD.pack(index, final))
+    writer.write(sealed)
+    written += len(sealed)
+    if final:
+      return written
+    chunk = following
+    index += 1
+
+def encrypt_file(source_path, target_path, key, chunk_size=CHUNK_SIZE):
+  temp_path = target_path + ".part"
+  with open(source_path, "rb") as reader, open(temp_path, "wb") as writer:
+    written = encrypt_stream(reader, writer, key, chunk_size)
+  os.replace(temp_path, target_path)
+  return written
+
+# yields the plaintext chunk by chunk, raising once the stream is tampered with.
+def decrypt_stream(reader, key):
+  header = _read_exactly(reader, HEADER.size)
+  if len(header) != HEADER.size:
+    raise ValueError("Encrypted package is truncated")
+  magic, chunk_size, prefix = HEADER.unpack(header)
+  if magic != MAGIC:
+    raise ValueError("Not a stream-encrypted package")
+  if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+    raise ValueError(f"Invalid chunk size {chunk_size}")
+
+  aead = AESGCM(key)
+  index = 0
+  sealed = _read_exactly(reader, chunk_size + TAG_SIZE)
+  while True:
+    following = _read_exactly(reader, chunk_size + TAG_SIZE) if len(sealed) == chunk_size + TAG_SIZE else b""
+    final = not following
+    yield aead.decrypt(prefix + struct.pack(">I", index), sealed, header + CHUNK_AAD.pack(index, final))
+    if final:
+      return
+    sealed = following
+    index += 1
+
+# plaintext size of an encrypted stream of total_size bytes.
+def plaintext_size(total_size, chunk_size):
+  body = total_size - HEADER.size
+  chunks = max(1, -(-body // (chunk_size + TAG_SIZE)))
+  return body - chunks * TAG_SIZE
+
+# decrypts a seekable stream into one preallocated buffer.
+def decrypt_to_buffer(reader, key, total_size):
+  start = reader.tell()
+  header = _read_exactly(reader, HEADER.size)
+  reader.seek(start)
+  if len(header) != HEADER.size:
+    raise ValueError("Encrypted package is truncated")
+  buffer = bytearray(max(plaintext_size(total_size, HEADER.unpack(header)[1]), 0))
+  view = memoryview(buffer)
+
+  position = 0
+  for chunk in decrypt_stream(reader, key):
+    if position + len(chunk) > len(buffer):
+      raise ValueError("Encrypted package is larger than expected")
+    view[position:position + len(chunk)] = chunk
+    position += len(chunk)
+  if position != len(buffer):
+    raise ValueError("Encrypted package is truncated")
+  return buffer
+
+def decrypt_bytes(data, key):
+  return decrypt_to_buffer(io.BytesIO(data), key, len(data))
+
+def decrypt_file(path, key):
+  with open(path, "rb") as reader:
+    return decrypt_to_buffer(reader, key, os.path.getsize(path))
@@ -0,0 +1,149 @@
+import io
+import os
+import json
+import pickle
+import struct
+import zipfile
+import numpy as np
+
+# Serialization of federation parameter packages.
+#
+# Packages are written as an uncompressed .npz archive: one .npy member per
+# array plus a __schema__ member describing every field (array dtype/shape or
+# a JSON scalar). Since members are stored rather than deflated, decoding maps
+# each array straight onto the decrypted buffer with np.frombuffer, so large
+# arrays are not copied and nothing is unpickled. Unpickling runs arbitrary
+# code, so legacy pickle packages are only decoded when a caller opts in:
+# ALLOW_PICKLE_PARAMS=true in a notebook or offline tool, or allow_pickle=True.
+# The backend never unpickles anything, see aggregation_scheduler.py.
+#
+# Version 2 adds compact packages: float arrays can be quantized, either cast
+# down to float32/float16 or mapped linearly onto uint8/uint16 with the scale
+# kept in the schema, and the archive members can be deflated. Decoding a
+# compact package copies the deflated members but is otherwise the same.
+
+SCHEMA_NAME = "__schema__"
+FORMAT_NAME = "dml-params-npz"
+FORMAT_VERSION = 2
+
+# quantization applied by encode_compact_params. Node thresholds decide
+# splits, so tree_nodes is never quantized.
+COMPACT_QUANTIZE = {"tree_values": "uint16", "feature_importances": "float32"}
+# per-row outputs that scale with the contributor's data and are left out of
+# compact packages.
+PER_SAMPLE_FIELDS = ("predictions",)
+QUANTIZED_DTYPES = ("float32", "float16", "uint8", "uint16")
+
+ZIP_MAGIC = b"PK\x03\x04"
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+NPY_HEADER_LIMIT = 65536 + 12
+
+ALLOW_PICKLE_PARAMS = os.getenv("ALLOW_PICKLE_PARAMS", "false").lower() == "true"
+
+def _quantize(name, value, mode):
+  if mode not in QUANTIZED_DTYPES:
+    raise ValueError(f"Unknown quantization {mode} for field {name}")
+  if value.dtype.kind != "f":
+    raise ValueError(f"Field {name} is not a float array and can't be quantized")
+  if mode.startswith("float"):
+    return value.astype(mode), {"dtype": value.dtype.str}
+
+  levels = np.iinfo(mode).max
+  low = float(value.min()) if value.size else 0.0
+  high = float(value.max()) if value.size else 0.0
+  scale = (high - low) / levels if high > low else 1.0
+  quantized = np.rint((value - low) / scale).astype(mode)
+  return quantized, {"dtype": value.dtype.str, "offset": low, "scale": scale}
+
+def encode_params(model_params, quantize=None, compress=False):
+  quantize = quantize or {}
+  schema = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "fields": {}}
+  arrays = {}
+  for name, value in model_params.items():
+    if isinstance(value, np.ndarray):
+      if value.dtype == object:
+        raise ValueError(f"Field {name} has an object dtype and can't be stored without pickle")
+      field = {"kind": "array"}
+      if name in quantize:
+        value, field["quantized"] = _quantize(name, value, quantize[name])
+      arrays[name] = value
+      field.update({"dtype": value.dtype.str, "shape": list(value.shape)})
+      schema["fields"][name] = field
+    else:
+      if isinstance(value, np.generic):
+        value = value.item()
+      schema["fields"][name] = {"kind": "scalar", "value": value}
+
+  buffer = io.BytesIO()
+  arrays[SCHEMA_NAME] = np.frombuffer(json.dumps(schema).encode(), dtype=np.uint8)
+  (np.savez_compressed if compress else np.savez)(buffer, **arrays)
+  return buffer.getvalue()
+
+# package without per-sample fields, quantized and deflated for upload.
+def encode_compact_params(model_params, quantize=COMPACT_QUANTIZE):
+  compact = {name: value for name, value in model_params.items() if name not in PER_SAMPLE_FIELDS}
+  quantize = {name: mode for name, mode in quantize.items() if name in compact}
+  return encode_params(compact, quantize=quantize, compress=True)
+
+# allow_pickle defaults to ALLOW_PICKLE_PARAMS; only pass True for packages
+# from a trusted source.
+def decode_params(data, allow_pickle=None):
+  if bytes(data[:4]) == ZIP_MAGIC:
+    return decode_npz_params(data)
+  if not (ALLOW_PICKLE_PARAMS if allow_pickle is None else allow_pickle):
+    raise ValueError("Pickled parameter packages are disabled, set ALLOW_PICKLE_PARAMS=true offline to load trusted ones")
+  return pickle.loads(data)
+
+# every .npy member as an array, mapped onto data without copying when stored.
+def _members(data):
+  view = memoryview(data)
+  with zipfile.ZipFile(io.BytesIO(data)) as archive:
+    for info in archive.infolist():
+      if info.compress_type != zipfile.ZIP_STORED:
+        # deflated members can't be mapped in place, they are inflated instead
+        array = np.lib.format.read_array(io.BytesIO(archive.read(info)), allow_pickle=False)
+        yield info.filename[:-len(".npy")], array
+        continue
+      header = LOCAL_HEADER.unpack_from(view, info.header_offset)
+      name_length, extra_length = header[-2], header[-1]
+      start = info.header_offset + LOCAL_HEADER.size + name_length + extra_length
+
+      # only the .npy header is copied, the array data stays in place
+      member = io.BytesIO(view[start:start + min(info.file_size, NPY_HEADER_LIMIT)])
+      version = np.lib.format.read_magic(member)
+      if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(member)
+      elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(member)
+      else:
+        raise ValueError(f"Unsupported .npy version {version} for member {info.filename}")
+      if dtype.hasobject:
+        raise ValueError(f"Field {info.filename} has an object dtype")
+      count = int(np.prod(shape)) if shape else 1
+      array = np.frombuffer(data, dtype=dtype, count=count, offset=start + member.tell())
+      yield info.filename[:-len(".npy")], array.reshape(shape, order="F" if fortran_order else "C")
+
+def _dequantize(array, quantized):
+  if "scale" in quantized:
+    return (array.astype(quantized["dtype"]) * quantized["scale"] + quantized["offset"]).astype(quantized["dtype"])
+  return array.astype(quantized["dtype"])
+
+def decode_npz_params(data):
+  arrays = dict(_members(data))
+
+  if SCHEMA_NAME not in arrays:
+    raise ValueError("Parameter package has no schema")
+  schema = json.loads(arrays.pop(SCHEMA_NAME).tobytes())
+  if schema.get("format") != FORMAT_NAME or schema.get("version", 0) > FORMAT_VERSION:
+    raise ValueError(f"Unsupported parameter package format {schema.get('format')} v{schema.get('version')}")
+
+  model_params = {}
+  for name, field in schema["fields"].items():
+    if field["kind"] == "array":
+      array = arrays[name]
+      if array.dtype.str != field["dtype"] or list(array.shape) != field["shape"]:
+        raise ValueError(f"Field {name} does not match the package schema")
+      model_params[name] = _dequantize(array, field["quantized"]) if "quantized" in field else array
+    else:
+      model_params[name] = field["value"]
+  return model_params
@@ -0,0 +1,106 @@
+import os
+import re
+import gzip
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from dotenv import load_dotenv
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+load_dotenv()
+
+# Response layer shared by the API routes.
+#
+# JSON is serialized with orjson when it is installed, encoding values the
+# way Flask's own encoder does: sorted keys, dates as HTTP dates. JSON and
+# text bodies of at least COMPRESS_MIN_BYTES are compressed with brotli (when
+# the brotli package is installed) or gzip, whichever the client accepts;
+# files and streamed responses are sent as they are. Compression makes an ETag
+# weak, so conditional requests still match the uncompressed representation.
+#
+# List endpoints take ?fields=a,b for a sparse fieldset, see parse_fields.
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html"}
+
+FIELD_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+
+class OrjsonProvider(DefaultJSONProvider):
+  options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+  def dumps(self, obj, **kwargs):
+    option = self.options | (orjson.OPT_INDENT_2 if kwargs.get("indent") else 0)
+    return orjson.dumps(obj, default=self.default, option=option).decode()
+
+  def loads(self, s, **kwargs):
+    return orjson.loads(s)
+
+  def response(self, *args, **kwargs):
+    if self.compact is False or (self.compact is None and self._app.debug):
+      # indented output for debugging
+      return super().response(*args, **kwargs)
+    obj = self._prepare_response_obj(args, kwargs)
+    body = orjson.dumps(obj, default=self.default, option=self.options | orjson.OPT_APPEND_NEWLINE)
+    return self._app.response_class(body, mimetype=self.mimetype)
+
+def compress_response(response):
+  if (
+    response.direct_passthrough
+    or response.is_streamed
+    or response.status_code != 200
+    or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    or "Content-Encoding" in response.headers
+  ):
+    return response
+  body = response.get_data()
+  if len(body) < COMPRESS_MIN_BYTES:
+    return response
+
+  response.vary.add("Accept-Encoding")
+  accepted = request.accept_encodings
+  if brotli is not None and accepted["br"]:
+    encoding, body = "br", brotli.compress(body, quality=BROTLI_QUALITY)
+  elif accepted["gzip"]:
+    encoding, body = "gzip", gzip.compress(body, GZIP_LEVEL, mtime=0)
+  else:
+    return response
+
+  response.set_data(body)
+  response.headers["Content-Encoding"] = encoding
+  etag, weak = response.get_etag()
+  if etag and not weak:
+    response.set_etag(etag, weak=True)
+  return response
+
+def install_response_layer(app):
+  if orjson is not None:
+    app.json = OrjsonProvider(app)
+  app.after_request(compress_response)
+
+# the fields named by a ?fields=a,b,c parameter, None when it is absent.
+# allowed is the set of fields that may be asked for, None for any field name.
+def parse_fields(value, allowed=None):
+  if value is None:
+    return None
+  fields = {field.strip() for field in value.split(",") if field.strip()}
+  if not fields:
+    raise ValueError("fields must name at least one field")
+  unknown = [field for field in fields if not FIELD_NAME.match(field) or (allowed is not None and field not in allowed)]
+  if unknown:
+    raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+  return fields
+
+def select_fields(document, fields):
+  if fields is None:
+    return document
+  return {key: value for key, value in document.items() if key in fields}
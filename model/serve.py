@@ -0,0 +1,119 @@
+import os
+import glob
+import multiprocessing
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Serving modes for the backend, picked with BACKEND_MODE:
+#   dev  - Flask's development server with the debugger and reloader.
+#   prod - gunicorn with several worker processes, each running a thread
+#          pool. The master never imports the app, so it forks workers (and
+#          replacements for recycled ones) without open sockets, SQLite
+#          handles or threads. Run it with `python serve.py`, or with
+#          `python backend.py`, which hands over here before importing the
+#          app. Workers import the app in load() after forking, open their
+#          Mongo pool and provision indexes before taking traffic, and close
+#          the pool when they exit. Background schedules start in the workers
+#          too, never in the master. On Windows, where gunicorn doesn't run,
+#          waitress serves the app from a single multi-threaded process.
+#
+# The gunicorn master empties METRICS_DIR before it forks the workers, which
+# then share their metrics through it (see instrumentation.py).
+
+BACKEND_MODE = os.getenv("BACKEND_MODE", "dev").lower()
+if BACKEND_MODE not in ("dev", "prod"):
+  raise ValueError(f"BACKEND_MODE must be 'dev' or 'prod', got '{BACKEND_MODE}'")
+BACKEND_BIND = os.getenv("BACKEND_BIND", "127.0.0.1:5000")
+# Each worker is a full copy of the backend: its own marketplace feed and
+# lookup caches in memory, its own job and aggregation thread pools, and a
+# Mongo pool of up to MONGO_MAX_POOL_SIZE connections (at least
+# MONGO_MIN_POOL_SIZE of them kept open). Requests mostly wait on MongoDB and
+# IPFS, so threads carry the concurrency and a few workers are enough. Size
+# the workers against memory and against the cluster's connection limit,
+# which must fit BACKEND_WORKERS * MONGO_MAX_POOL_SIZE for every host.
+BACKEND_WORKERS = int(os.getenv("BACKEND_WORKERS", str(min(multiprocessing.cpu_count(), 4))))
+BACKEND_THREADS = int(os.getenv("BACKEND_THREADS", "8"))
+BACKEND_TIMEOUT = int(os.getenv("BACKEND_TIMEOUT", "60"))
+BACKEND_GRACEFUL_TIMEOUT = int(os.getenv("BACKEND_GRACEFUL_TIMEOUT", "30"))
+BACKEND_KEEPALIVE = int(os.getenv("BACKEND_KEEPALIVE", "5"))
+BACKEND_MAX_REQUESTS = int(os.getenv("BACKEND_MAX_REQUESTS", "10000"))
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".metrics")
+
+def post_worker_init(worker):
+  from database import warm_up
+  from archive_listings import archive_schedule
+  if not warm_up():
+    worker.log.warning("MongoDB warm-up failed, the worker will connect on first use")
+  # one worker at a time runs it, see archive_listings.py
+  archive_schedule.start()
+
+def worker_exit(server, worker):
+  from database import close_connections
+  from archive_listings import archive_schedule
+  from instrumentation import metrics
+  archive_schedule.stop()
+  close_connections()
+  metrics.flush()
+
+# metrics of a previous run would be added to this one's
+def prepare_metrics_dir():
+  os.makedirs(METRICS_DIR, exist_ok=True)
+  for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json*")):
+    os.remove(path)
+  os.environ["METRICS_DIR"] = METRICS_DIR
+
+def gunicorn_options():
+  return {
+    "bind": BACKEND_BIND,
+    "workers": BACKEND_WORKERS,
+    "worker_class": "gthread",
+    "threads": BACKEND_THREADS,
+    "timeout": BACKEND_TIMEOUT,
+    "graceful_timeout": BACKEND_GRACEFUL_TIMEOUT,
+    "keepalive": BACKEND_KEEPALIVE,
+    "max_requests": BACKEND_MAX_REQUESTS,
+    "max_requests_jitter": BACKEND_MAX_REQUESTS // 10,
+    "preload_app": False,
+    "post_worker_init": post_worker_init,
+    "worker_exit": worker_exit
+  }
+
+def run_gunicorn():
+  from gunicorn.app.base import BaseApplication
+
+  class BackendApplication(BaseApplication):
+    def load_config(self):
+      for key, value in gunicorn_options().items():
+        self.cfg.set(key, value)
+
+    # runs in each worker after the fork, the only place the app is imported
+    def load(self):
+      from backend import app
+      return app
+
+  prepare_metrics_dir()
+  BackendApplication().run()
+
+def run_waitress():
+  from waitress import serve
+  from backend import app
+  from database import warm_up, close_connections
+  from archive_listings import archive_schedule
+
+  warm_up()
+  archive_schedule.start()
+  try:
+    serve(app, listen=BACKEND_BIND, threads=BACKEND_THREADS, channel_timeout=BACKEND_TIMEOUT)
+  finally:
+    close_connections()
+
+def run_production():
+  try:
+    import gunicorn
+  except ImportError:
+    return run_waitress()
+  return run_gunicorn()
+
+if __name__ == '__main__':
+  run_production()
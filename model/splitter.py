@@ -0,0 +1,154 @@
+import os
+import zlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Out-of-core dataset splitter for handing shards to contributors.
+#
+# The CSV is read in chunks and every row is assigned to a shard on the fly,
+# so memory stays at one chunk regardless of file size. Assignment is
+# deterministic for a given seed: rows are placed by a hash of their position,
+# or, when stratifying, each class walks its own low-discrepancy sequence so
+# every shard receives its fraction of every class. Each chunk's shards are
+# written in parallel, as CSV or Parquet.
+
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+DEFAULT_FRACTIONS = (0.1, 0.3, 0.3, 0.3)
+
+def _mix(values, seed):
+  # splitmix64 finaliser, vectorised over uint64
+  with np.errstate(over='ignore'):
+    z = values.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+  return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+def shard_names(fractions):
+  percents = [round(fraction * 100) for fraction in fractions]
+  names = []
+  for index, percent in enumerate(percents):
+    name = f"{percent}percent"
+    if percents.count(percent) > 1:
+      name += f"_{percents[:index + 1].count(percent)}"
+    names.append(name)
+  return names
+
+class ShardWriter:
+  def __init__(self, path, output_format):
+    self.path = path
+    self.output_format = output_format
+    self.rows = 0
+    self._parquet_writer = None
+
+  def write(self, frame):
+    if frame.empty:
+      return
+    if self.output_format == 'parquet':
+      try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+      except ImportError:
+        raise ImportError("Parquet output requires pyarrow, install it with `pip install pyarrow`")
+      table = pa.Table.from_pandas(frame, preserve_index=False)
+      if self._parquet_writer is None:
+        self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+      elif table.schema != self._parquet_writer.schema:
+        # later chunks may infer narrower dtypes, e.g. int64 for a float column
+        table = table.cast(self._parquet_writer.schema)
+      self._parquet_writer.write_table(table)
+    else:
+      frame.to_csv(self.path, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+    self.rows += len(frame)
+
+  def close(self, columns):
+    if self.rows == 0:
+      # keep empty shards readable with the same columns
+      self.write_empty(columns)
+    if self._parquet_writer is not None:
+      self._parquet_writer.close()
+
+  def write_empty(self, columns):
+    empty = pd.DataFrame(columns=columns)
+    if self.output_format == 'parquet':
+      empty.to_parquet(self.path, index=False)
+    else:
+      empty.to_csv(self.path, index=False)
+
+class ShardAssigner:
+  def __init__(self, fractions, seed, stratify_column=None):
+    fractions = np.asarray(fractions, dtype=np.float64)
+    if (fractions <= 0).any():
+      raise ValueError("Shard fractions must be positive")
+    self.bounds = np.cumsum(fractions / fractions.sum())
+    self.bounds[-1] = 1.0
+    self.seed = seed
+    self.stratify_column = stratify_column
+    self.rows_seen = 0
+    self.class_counts = {}
+
+  def assign(self, chunk):
+    positions = np.arange(self.rows_seen, self.rows_seen + len(chunk), dtype=np.uint64)
+    self.rows_seen += len(chunk)
+
+    if self.stratify_column is None:
+      draws = _mix(positions, self.seed)
+    else:
+      draws = np.empty(len(chunk), dtype=np.float64)
+      labels = chunk[self.stratify_column].to_numpy()
+      for label in pd.unique(labels):
+        mask = labels == label
+        start = self.class_counts.get(label, 0)
+        ranks = np.arange(start, start + mask.sum(), dtype=np.float64)
+        self.class_counts[label] = start + mask.sum()
+        offset = _mix(np.array([zlib.crc32(str(label).encode())], dtype=np.uint64), self.seed)[0]
+        draws[mask] = np.mod(offset + ranks * GOLDEN_RATIO, 1.0)
+    return np.searchsorted(self.bounds, draws, side='right')
+
+def split_data(input_file, fractions=DEFAULT_FRACTIONS, stratify_column=None, output_format='csv',
+               output_dir=None, chunk_size=100_000, seed=42, max_workers=None):
+  if output_format not in ('csv', 'parquet'):
+    raise ValueError("output_format must be 'csv' or 'parquet'")
+
+  base_name = os.path.splitext(os.path.basename(input_file))[0]
+  output_dir = output_dir or os.path.dirname(os.path.abspath(input_file))
+  os.makedirs(output_dir, exist_ok=True)
+  extension = 'parquet' if output_format == 'parquet' else 'csv'
+  writers = [
+    ShardWriter(os.path.join(output_dir, f"{base_name}_{name}.{extension}"), output_format)
+    for name in shard_names(fractions)
+  ]
+
+  assigner = ShardAssigner(fractions, seed, stratify_column)
+  columns = None
+  with ThreadPoolExecutor(max_workers=max_workers or len(writers)) as executor:
+    for chunk in pd.read_csv(input_file, chunksize=chunk_size):
+      columns = chunk.columns
+      shards = assigner.assign(chunk)
+      # a shard's writes stay ordered because each chunk finishes before the next
+      list(executor.map(
+        lambda item: item[1].write(chunk[shards == item[0]]),
+        enumerate(writers)
+      ))
+
+  for writer in writers:
+    writer.close(columns)
+
+  return {writer.path: writer.rows for writer in writers}
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Split a CSV into contributor shards without loading it into memory.")
+  parser.add_argument('input_file')
+  parser.add_argument('--fractions', type=float, nargs='+', default=list(DEFAULT_FRACTIONS))
+  parser.add_argument('--stratify', dest='stratify_column', help="column whose class balance every shard keeps, e.g. Class")
+  parser.add_argument('--format', dest='output_format', choices=['csv', 'parquet'], default='csv')
+  parser.add_argument('--output-dir')
+  parser.add_argument('--chunk-size', type=int, default=100_000)
+  parser.add_argument('--seed', type=int, default=42)
+  args = parser.parse_args()
+
+  sizes = split_data(**vars(args))
+  for path, rows in sizes.items():
+    print(f"{os.path.basename(path)}: {rows} rows")
@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Round-scoped staging of aggregation inputs, replacing the backend's global
+# shared_data. Payloads are kept as the raw JSON bytes they were posted with,
+# one slot per contract ID, in a SQLite database in WAL mode: they survive
+# backend restarts, several rounds can be staged at once, and the aggregator
+# notebook can read a round straight from the file instead of going through
+# the backend. Requests without a contract ID use the default round.
+
+DEFAULT_ROUND = "default"
+
+class StagingStore:
+  def __init__(self, path):
+    self.path = path
+    self._local = threading.local()
+    with self._connection() as connection:
+      connection.execute("""
+        CREATE TABLE IF NOT EXISTS rounds (
+          round_id TEXT PRIMARY KEY,
+          payload BLOB NOT NULL,
+          version INTEGER NOT NULL,
+          updated_at REAL NOT NULL
+        )
+      """)
+
+  def _connection(self):
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      self._local.connection = connection
+    return connection
+
+  def put(self, round_id, payload):
+    row = self._connection().execute("""
+      INSERT INTO rounds (round_id, payload, version, updated_at) VALUES (?, ?, 1, ?)
+      ON CONFLICT(round_id) DO UPDATE SET
+        payload = excluded.payload,
+        version = rounds.version + 1,
+        updated_at = excluded.updated_at
+      RETURNING version
+    """, (str(round_id), sqlite3.Binary(payload), time.time())).fetchone()
+    return row[0]
+
+  def get(self, round_id):
+    row = self._connection().execute(
+      "SELECT payload FROM rounds WHERE round_id = ?", (str(round_id),)
+    ).fetchone()
+    return bytes(row[0]) if row else None
+
+  def load(self, round_id=DEFAULT_ROUND):
+    payload = self.get(round_id)
+    return json.loads(payload) if payload is not None else None
+
+  def delete(self, round_id):
+    cursor = self._connection().execute("DELETE FROM rounds WHERE round_id = ?", (str(round_id),))
+    return cursor.rowcount > 0
+
+  def rounds(self):
+    rows = self._connection().execute(
+      "SELECT round_id, version, updated_at FROM rounds ORDER BY updated_at DESC"
+    ).fetchall()
+    return [{"roundId": row[0], "version": row[1], "updatedAt": row[2]} for row in rows]
+
+staging_store = StagingStore(
+  os.getenv("STAGING_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "staging.sqlite3"))
+)
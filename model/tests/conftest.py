@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# The modules in model/ import each other by name and read their settings
+# from the environment when they are first imported, so the path and the
+# settings are in place before any test module imports them. Everything a
+# module would write next to itself goes to a scratch directory instead.
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MODEL_DIR)
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="dmlchain-tests-")
+os.environ.update({
+  "IPFS_CACHE_DIR": os.path.join(SCRATCH_DIR, "ipfs_cache"),
+  "STAGING_DB_PATH": os.path.join(SCRATCH_DIR, "staging.sqlite3"),
+  "JOB_DB_PATH": os.path.join(SCRATCH_DIR, "jobs.sqlite3"),
+  "MODEL_REGISTRY_DIR": os.path.join(SCRATCH_DIR, "global_models"),
+  "ARCHIVE_INTERVAL_SECONDS": "0",
+  "LOG_LEVEL": "WARNING"
+})
+
+# a mongomock database in place of every collection database.py,
+# archive_listings.py and migrate_listings.py use, and an empty lookup cache.
+@pytest.fixture
+def mongo(monkeypatch):
+  mongomock = pytest.importorskip("mongomock")
+  import database
+  import archive_listings
+  import migrate_listings
+  from endpoint_benchmark import patch_mongomock_bulk_writes
+
+  if not getattr(mongomock, "_bulk_writes_patched", False):
+    patch_mongomock_bulk_writes(mongomock)
+    mongomock._bulk_writes_patched = True
+
+  db = mongomock.MongoClient()["dmlchain_tests"]
+  for module in (database, archive_listings, migrate_listings):
+    for name, value in list(vars(module).items()):
+      if name.endswith("_collection"):
+        monkeypatch.setattr(module, name, db[value.name])
+  monkeypatch.setattr(database, "lookup_cache", database.LookupCache(max_entries=1000, ttl_seconds=30))
+  # INDEXES is keyed by the real collections
+  for collection, indexes in database.INDEXES.items():
+    for keys, options in indexes:
+      db[collection.name].create_index(keys, **options)
+  return db
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import aggregation
+from aggregation import FederatedAggregator, export_trees, forest_from_package
+from param_codec import encode_params, decode_npz_params
+
+X = np.random.default_rng(0).random((300, 3))
+LABELS = (X[:, 0] > 0.5).astype(int)
+
+def package(labels, n_samples, n_estimators):
+  forest = RandomForestClassifier(n_estimators=n_estimators, random_state=0).fit(X, labels)
+  package = {
+    "feature_importances": forest.feature_importances_,
+    "n_estimators": n_estimators,
+    "max_depth": 0,
+    "max_features": "sqrt",
+    "n_samples": n_samples
+  }
+  package.update(export_trees(forest))
+  return package
+
+def test_merged_votes_follow_the_package_weights():
+  aggregator = FederatedAggregator("samples")
+  # the heavier package has a tenth of the trees, but its vote still wins
+  aggregator.add(package(LABELS, n_samples=1000, n_estimators=5))
+  aggregator.add(package(1 - LABELS, n_samples=10, n_estimators=50))
+
+  forest = aggregator.global_model()
+  assert len(forest.estimators_) == 55
+  assert (forest.predict(X) == LABELS).all()
+
+def test_tree_weights_survive_publishing():
+  aggregator = FederatedAggregator("samples")
+  aggregator.add(package(LABELS, n_samples=30, n_estimators=4))
+  aggregator.add(package(1 - LABELS, n_samples=20, n_estimators=6))
+  forest = aggregator.global_model()
+
+  published = {"feature_importances": forest.feature_importances_, "n_estimators": len(forest.estimators_)}
+  published.update(export_trees(forest))
+  restored = forest_from_package(decode_npz_params(encode_params(published)))
+  np.testing.assert_allclose(restored.predict_proba(X), forest.predict_proba(X))
+
+def test_unknown_scikit_learn_versions_are_refused(monkeypatch):
+  trees = package(LABELS, n_samples=10, n_estimators=2)
+  monkeypatch.setattr(aggregation.sklearn, "__version__", "2.0.0")
+  with pytest.raises(RuntimeError, match="private Tree state"):
+    forest_from_package(trees)
+
+def test_reported_sample_counts_are_capped():
+  aggregator = FederatedAggregator("samples", max_samples=200)
+  # the trees were fitted on 300 rows, whatever the package claims
+  assert aggregator.package_weight(package(LABELS, n_samples=10 ** 9, n_estimators=2)) == 200
+  assert FederatedAggregator("samples").package_weight(package(LABELS, n_samples=10 ** 9, n_estimators=2)) == 300
+  assert aggregator.package_weight(package(LABELS, n_samples=50, n_estimators=2)) == 50
+
+@pytest.mark.parametrize("n_samples", [0, -5, float("nan"), float("inf"), "many"])
+def test_invalid_sample_counts_are_refused(n_samples):
+  with pytest.raises(ValueError, match="n_samples"):
+    FederatedAggregator("samples").add(package(LABELS, n_samples=n_samples, n_estimators=2))
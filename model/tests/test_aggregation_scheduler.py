@@ -0,0 +1,156 @@
+import base64
+import pickle
+
+import numpy as np
+import pytest
+from cryptography.fernet import Fernet
+from sklearn.ensemble import RandomForestClassifier
+
+import aggregation_scheduler
+import federation
+from aggregation import export_trees
+from aggregation_scheduler import AggregationScheduler, ContractAggregate
+from federation import FetchResult, fetch_package
+from model_registry import model_registry
+
+def fit_forest(seed, n_estimators=3):
+  rng = np.random.default_rng(seed)
+  X = rng.normal(size=(80, 4))
+  y = (X[:, 0] + X[:, 1] > 0).astype(int)
+  return RandomForestClassifier(n_estimators=n_estimators, max_depth=3, random_state=seed).fit(X, y)
+
+def contributor_package(seed, n_samples=60):
+  forest = fit_forest(seed)
+  package = {
+    "feature_importances": forest.feature_importances_,
+    "n_estimators": len(forest.estimators_),
+    "max_depth": 3,
+    "max_features": "sqrt",
+    "n_samples": n_samples
+  }
+  package.update(export_trees(forest))
+  return package
+
+# the subscribers of every contract and their reputation
+CONTRIBUTORS = {"alice": 100, "bob": 80}
+
+def scheduler():
+  return AggregationScheduler(1, 1, contributors=lambda contract_id: CONTRIBUTORS)
+
+@pytest.fixture(autouse=True)
+def registry(tmp_path, monkeypatch):
+  monkeypatch.setattr(model_registry, "directory", str(tmp_path))
+  return model_registry
+
+@pytest.fixture
+def packages(monkeypatch):
+  packages = {}
+
+  def fetch(contributor, item, allow_pickle):
+    assert allow_pickle is False
+    return FetchResult(contributor, item["paramHash"], package=packages[item["paramHash"]])
+
+  monkeypatch.setattr(aggregation_scheduler, "fetch_package", fetch)
+  return packages
+
+def run(scheduler, contract_id, params):
+  queued = scheduler.submit(contract_id, params)
+  scheduler._executor.shutdown(wait=True)
+  return queued
+
+def test_fold_extends_a_hand_published_model(packages):
+  hand = fit_forest(0, n_estimators=5)
+  model_registry.publish("7", hand, {"contributors": 2, "total_weight": 120.0, "folded": ["QmHand"]})
+  packages["QmNew"] = contributor_package(1)
+
+  queued = run(scheduler(), "7", {
+    "alice": {"paramHash": "QmHand", "paramKey": "key"},
+    "bob": {"paramHash": "QmNew", "paramKey": "key"}
+  })
+
+  assert queued == 1
+  forest, version = model_registry.load("7")
+  assert version == 2
+  assert len(forest.estimators_) == 5 + 3
+  X = np.random.default_rng(9).normal(size=(20, 4))
+  for published, original in zip(forest.estimators_, hand.estimators_):
+    np.testing.assert_array_equal(published.predict(X), original.predict(X))
+  state = model_registry.describe("7")["metadata"]["aggregate"]
+  assert state["folded"] == ["QmHand", "QmNew"]
+  assert state["summary"]["package_count"] == 3
+  assert state["summary"]["total_weight"] == 180.0
+
+def test_hand_published_model_without_aggregate_metadata_counts_once(packages):
+  model_registry.publish("8", fit_forest(0, n_estimators=4))
+  packages["QmNew"] = contributor_package(1)
+
+  run(scheduler(), "8", {"bob": {"paramHash": "QmNew", "paramKey": "key"}})
+
+  forest, version = model_registry.load("8")
+  assert (version, len(forest.estimators_)) == (2, 7)
+
+def test_restarted_worker_resumes_from_the_registry(packages):
+  packages["QmA"] = contributor_package(1)
+  run(scheduler(), "9", {"alice": {"paramHash": "QmA", "paramKey": "key"}})
+
+  packages["QmB"] = contributor_package(2)
+  queued = run(scheduler(), "9", {
+    "alice": {"paramHash": "QmA", "paramKey": "key"},
+    "bob": {"paramHash": "QmB", "paramKey": "key"}
+  })
+
+  assert queued == 1
+  aggregate = ContractAggregate("9")
+  aggregate.sync()
+  assert aggregate.folded == {"QmA", "QmB"}
+  assert aggregate.version == 2
+  assert len(aggregate.aggregator.estimators) == 6
+
+def test_pickled_packages_are_refused(tmp_path, monkeypatch):
+  key = Fernet.generate_key()
+  path = tmp_path / "package"
+  path.write_bytes(Fernet(key).encrypt(pickle.dumps({"n_estimators": 1})))
+  monkeypatch.setattr(federation, "fetch_to_cache", lambda ipfs_hash: str(path))
+  item = {"paramHash": "QmPickle", "paramKey": base64.b64encode(key).decode()}
+
+  result = fetch_package("mallory", item, allow_pickle=False)
+
+  assert not result.ok
+  assert "Pickled parameter packages are disabled" in result.error
+
+def test_only_subscribers_packages_are_folded(packages):
+  packages["QmA"] = contributor_package(1)
+  packages["QmMallory"] = contributor_package(2, n_samples=10 ** 9)
+
+  queued = run(scheduler(), "10", {
+    "alice": {"paramHash": "QmA", "paramKey": "key"},
+    "mallory": {"paramHash": "QmMallory", "paramKey": "key"}
+  })
+
+  assert queued == 1
+  state = model_registry.describe("10")["metadata"]["aggregate"]
+  assert state["folded"] == ["QmA"]
+
+def test_refused_packages_are_reported(packages):
+  active = scheduler()
+  active.submit("11", {"mallory": {"paramHash": "QmMallory", "paramKey": "key"}})
+  assert active.status("11")["failures"][0]["error"] == "Not a subscriber of the contract"
+
+def test_failures_are_trimmed_as_they_are_recorded():
+  aggregate = ContractAggregate("12")
+  for index in range(aggregation_scheduler.MAX_REPORTED_FAILURES + 10):
+    aggregate.add_failure({"contributor": str(index)})
+  assert len(aggregate.failures) == aggregation_scheduler.MAX_REPORTED_FAILURES
+  assert aggregate.failures[-1]["contributor"] == str(aggregation_scheduler.MAX_REPORTED_FAILURES + 9)
+
+def test_contract_ids_must_be_numbers():
+  active = AggregationScheduler(1, 1)
+  with pytest.raises(ValueError):
+    active.submit("default", {})
+
+def test_aggregation_needs_a_contract_id(monkeypatch):
+  import backend
+  monkeypatch.setattr(backend, "AGGREGATION_AUTO", True)
+  response = backend.app.test_client().post("/aggregate", json={"alice": {"paramHash": "QmA", "paramKey": "key"}})
+  assert response.status_code == 400
+  assert response.get_json()["details"] == "contractId is required"
@@ -0,0 +1,147 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import archive_listings
+import database
+from archive_listings import ArchiveSchedule, archive_batch
+
+def wait_for(condition, timeout=5.0):
+  deadline = time.monotonic() + timeout
+  while not condition() and time.monotonic() < deadline:
+    time.sleep(0.01)
+  return condition()
+
+EXPIRED = "2020-01-01T00:00:00.000Z"
+LIVE = "2099-01-01T00:00:00.000Z"
+
+def add_listing(contract_id, expires_at=EXPIRED, subscribers=("bob",)):
+  database.add_listing_to_created("alice", contract_id, "2019-01-01T00:00:00.000Z", expires_at, f"https://example.com/{contract_id}")
+  for subscriber in subscribers:
+    database.add_listing_to_subscribed(
+      subscriber, contract_id, "2019-01-01T00:00:00.000Z", expires_at, f"https://example.com/{contract_id}", "alice", 100
+    )
+
+def contract_ids(collection):
+  return sorted(collection.distinct("contractId"))
+
+@pytest.fixture
+def schedules(tmp_path, monkeypatch):
+  submitted = []
+  monkeypatch.setattr(ArchiveSchedule, "submit", lambda self: submitted.append(self))
+  lock_path = str(tmp_path / "archive.lock")
+  started = []
+
+  def schedule():
+    started.append(ArchiveSchedule(0.01, lock_path))
+    return started[-1]
+
+  yield schedule, submitted
+  for schedule in started:
+    schedule.stop()
+
+def test_one_schedule_runs_per_lock_file(schedules):
+  schedule, submitted = schedules
+  first, second = schedule(), schedule()
+
+  first.start()
+  assert wait_for(lambda: first.leader)
+  second.start()
+  assert wait_for(lambda: len(submitted) >= 5)
+
+  assert not second.leader
+  assert set(submitted) == {first}
+
+def test_another_schedule_takes_over_when_the_leader_stops(schedules):
+  schedule, submitted = schedules
+  first, second = schedule(), schedule()
+  first.start()
+  assert wait_for(lambda: first.leader)
+  second.start()
+
+  first.stop()
+
+  assert wait_for(lambda: second.leader)
+  assert wait_for(lambda: submitted and submitted[-1] is second)
+
+def test_schedule_is_off_without_an_interval(tmp_path):
+  schedule = ArchiveSchedule(0, str(tmp_path / "archive.lock"))
+  schedule.start()
+  assert schedule._thread is None
+
+def test_importing_the_backend_starts_no_schedule():
+  import backend
+  assert archive_listings.archive_schedule._thread is None
+
+def test_expired_listings_are_archived_with_their_subscriptions(mongo):
+  database.create_user("alice")
+  add_listing(1)
+  add_listing(2, expires_at=LIVE)
+  add_listing(3)
+  database.add_reported_listing(3)
+
+  stats = archive_listings.archive_listings()
+
+  assert (stats["createdListings"], stats["subscribedListings"], stats["skippedPendingReports"]) == (1, 1, 1)
+  assert contract_ids(archive_listings.created_listing_collection) == [2, 3]
+  assert contract_ids(archive_listings.subscribed_listing_collection) == [2, 3]
+  assert contract_ids(archive_listings.archived_created_listing_collection) == [1]
+  assert contract_ids(archive_listings.archived_subscribed_listing_collection) == [1]
+
+def test_listings_written_to_during_a_batch_stay_live(mongo, monkeypatch):
+  database.create_user("alice")
+  add_listing(1)
+  add_listing(2)
+  copy = archive_listings.archived_created_listing_collection.bulk_write
+
+  # listing 1 is paid while the batch is being copied to the archive
+  def concurrent_write(requests, **kwargs):
+    result = copy(requests, **kwargs)
+    database.mark_contract_as_paid("alice", 1)
+    return result
+  monkeypatch.setattr(archive_listings.archived_created_listing_collection, "bulk_write", concurrent_write)
+
+  assert archive_batch(datetime.now(timezone.utc), [], 10) == (1, 1)
+
+  assert contract_ids(archive_listings.created_listing_collection) == [1]
+  assert contract_ids(archive_listings.subscribed_listing_collection) == [1]
+  assert contract_ids(archive_listings.archived_created_listing_collection) == [2]
+  assert contract_ids(archive_listings.archived_subscribed_listing_collection) == [2]
+  assert archive_listings.created_listing_collection.find_one({"contractId": 1})["paid"]
+
+def test_subscriptions_written_to_during_a_batch_are_archived_as_they_are_now(mongo, monkeypatch):
+  database.create_user("alice")
+  add_listing(1, subscribers=("bob", "carol"))
+  delete = archive_listings.created_listing_collection.bulk_write
+
+  # bob gives feedback after his subscription was copied, before it is deleted
+  def concurrent_write(requests, **kwargs):
+    result = delete(requests, **kwargs)
+    database.update_feedback("bob", 1, True)
+    return result
+  monkeypatch.setattr(archive_listings.created_listing_collection, "bulk_write", concurrent_write)
+
+  assert archive_batch(datetime.now(timezone.utc), [], 10) == (1, 2)
+
+  assert archive_listings.subscribed_listing_collection.count_documents({}) == 0
+  archived = {
+    subscription["subscriberAddress"]: subscription["feedback"]
+    for subscription in archive_listings.archived_subscribed_listing_collection.find()
+  }
+  assert archived == {"bob": True, "carol": False}
+
+def test_subscriptions_written_to_on_every_attempt_are_still_moved(mongo, monkeypatch):
+  database.create_user("alice")
+  add_listing(1)
+  copy = archive_listings.copy_subscriptions
+  feedback = iter([True, False, True, False])
+
+  def concurrent_write(subscriptions, expiry, archived_at):
+    copy(subscriptions, expiry, archived_at)
+    database.update_feedback("bob", 1, next(feedback))
+  monkeypatch.setattr(archive_listings, "copy_subscriptions", concurrent_write)
+
+  assert archive_batch(datetime.now(timezone.utc), [], 10) == (1, 1)
+  assert archive_listings.subscribed_listing_collection.count_documents({}) == 0
+  assert archive_listings.archived_subscribed_listing_collection.count_documents({}) == 1
@@ -0,0 +1,139 @@
+import os
+import random
+import shutil
+import subprocess
+import pytest
+
+from blob_cache import BlobCache, BlobMismatch
+from unixfs_cid import CHUNK_SIZE, MAX_LINKS, cid_of, parse_cid
+
+# CIDs `ipfs add` gives these contents with its default settings
+EMPTY_CID = "QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH"
+HELLO_CID = "QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o"
+HELLO_RAW_CID = "bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e"
+
+@pytest.fixture
+def cache(tmp_path):
+  return BlobCache(str(tmp_path / "cache"), max_bytes=10 * CHUNK_SIZE)
+
+def test_cids_match_ipfs_add():
+  assert cid_of(b"") == EMPTY_CID
+  assert cid_of(b"hello world\n") == HELLO_CID
+  assert cid_of(b"hello world", version=1) == HELLO_RAW_CID
+
+def test_large_files_are_hashed_as_a_balanced_dag():
+  data = os.urandom(CHUNK_SIZE) * (MAX_LINKS + 2)
+  cid = cid_of(data)
+  assert cid != cid_of(data[:-1])
+  assert cid_of(data, version=1).startswith("bafybei")
+
+# a kubo repository to hash files with, skips the test where kubo isn't installed
+@pytest.fixture
+def ipfs_add(tmp_path_factory):
+  binary = shutil.which("ipfs")
+  if binary is None:
+    pytest.skip("needs the ipfs (kubo) command line")
+  environment = dict(os.environ, IPFS_PATH=str(tmp_path_factory.mktemp("ipfs")))
+  subprocess.run([binary, "init", "--profile", "test"], env=environment, check=True, capture_output=True)
+
+  def add(path, *options):
+    command = [binary, "add", "--only-hash", "--quieter", *options, str(path)]
+    return subprocess.run(command, env=environment, check=True, capture_output=True, text=True).stdout.strip()
+  return add
+
+# real model packages span many chunks: two chunks, and more chunks than fit
+# in one node, so the tree has intermediate nodes
+@pytest.mark.parametrize("size", [CHUNK_SIZE + 1, (MAX_LINKS + 2) * CHUNK_SIZE + 100])
+def test_multi_chunk_cids_match_ipfs_add(ipfs_add, tmp_path, size):
+  data = random.Random(size).randbytes(size)
+  path = tmp_path / "package.bin"
+  path.write_bytes(data)
+  assert cid_of(data) == ipfs_add(path)
+  # CIDv1 implies raw leaves
+  assert cid_of(data, version=1) == ipfs_add(path, "--cid-version=1")
+
+def test_unsupported_cids_are_refused(cache):
+  with pytest.raises(ValueError):
+    parse_cid("zb2rhe5P4gXftAwvA4eXQ5HJwsER2owDyS9sKaQRRVQPn93bA")
+  with pytest.raises(ValueError):
+    cache.path("not-a-cid")
+
+def test_verified_blobs_are_cached(cache):
+  assert cache.path(HELLO_CID) is None
+  cache.put(HELLO_CID, b"hello world\n")
+  assert cache.get(HELLO_CID) == b"hello world\n"
+  assert cache.stats()["sizeBytes"] == 12
+
+def test_truncated_content_is_never_cached(cache):
+  with pytest.raises(BlobMismatch):
+    cache.put(HELLO_CID, b"hello wor")
+  assert cache.path(HELLO_CID) is None
+  assert cache.stats()["blobs"] == 0
+
+def test_streaming_holds_back_the_last_chunk_of_a_mismatch(cache):
+  received = []
+  with pytest.raises(BlobMismatch):
+    for chunk in cache.stream_through(HELLO_CID, [b"hello ", b"there\n"]):
+      received.append(chunk)
+  assert received == [b"hello "]
+  assert cache.path(HELLO_CID) is None
+
+  received = list(cache.stream_through(HELLO_CID, [b"hello ", b"world\n"]))
+  assert received == [b"hello ", b"world\n"]
+  assert cache.path(HELLO_CID) is not None
+
+def test_a_blob_changed_on_disk_is_dropped(cache):
+  path = cache.put(HELLO_CID, b"hello world\n")
+  with open(path, "ab") as f:
+    f.write(b"more")
+  assert cache.path(HELLO_CID) is None
+  assert not os.path.exists(path)
+
+def test_least_recently_used_blobs_are_evicted(cache, monkeypatch):
+  blobs = [os.urandom(3 * CHUNK_SIZE) for _ in range(4)]
+  cids = [cid_of(blob) for blob in blobs]
+  clock = iter(range(1000, 100000, 1000))
+  monkeypatch.setattr("blob_cache.time.time", lambda: next(clock))
+
+  for cid, blob in zip(cids[:3], blobs[:3]):
+    cache.put(cid, blob)
+  assert cache.path(cids[0]) is not None
+  cache.put(cids[3], blobs[3])
+
+  assert cache.path(cids[1]) is None
+  assert all(cache.path(cid) is not None for cid in (cids[0], cids[2], cids[3]))
+  assert cache.stats()["sizeBytes"] == 9 * CHUNK_SIZE
+  assert cache.evictions == 1
+
+def test_the_index_is_shared_between_instances(cache):
+  cache.put(HELLO_CID, b"hello world\n")
+  other = BlobCache(cache.directory, cache.max_bytes)
+  assert other.get(HELLO_CID) == b"hello world\n"
+  assert other.stats()["blobs"] == 1
+
+def test_blobs_cached_before_the_index_are_dropped(tmp_path):
+  shard = tmp_path / "cache" / HELLO_CID[:2]
+  shard.mkdir(parents=True)
+  (shard / HELLO_CID).write_bytes(b"unverified")
+  (shard / (HELLO_CID + ".sha256")).write_bytes(b"digest")
+
+  cache = BlobCache(str(tmp_path / "cache"), max_bytes=CHUNK_SIZE)
+  assert cache.path(HELLO_CID) is None
+  assert os.listdir(shard) == []
+
+def test_only_blobs_are_dropped_from_a_shared_directory(tmp_path):
+  directory = tmp_path / "shared"
+  shard = directory / HELLO_CID[:2]
+  shard.mkdir(parents=True)
+  (shard / HELLO_CID).write_bytes(b"unverified")
+  (shard / "notes.txt").write_bytes(b"keep")
+  (shard / HELLO_RAW_CID).write_bytes(b"another shard")
+  (directory / "docs").mkdir()
+  (directory / "docs" / HELLO_CID).write_bytes(b"keep")
+  (directory / "settings.json").write_bytes(b"keep")
+
+  BlobCache(str(directory), max_bytes=CHUNK_SIZE).stats()
+
+  assert sorted(os.listdir(shard)) == sorted(["notes.txt", HELLO_RAW_CID])
+  assert os.listdir(directory / "docs") == [HELLO_CID]
+  assert (directory / "settings.json").exists()
@@ -0,0 +1,31 @@
+import os
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from data_loader import load_split
+
+def write_dataset(path, rows=500):
+  rng = np.random.default_rng(0)
+  frame = pd.DataFrame(rng.random((rows, 4)), columns=["V1", "V2", "V3", "Amount"])
+  frame["Class"] = rng.integers(0, 2, rows)
+  frame.to_csv(path, index=False)
+  return frame
+
+def test_split_matches_train_test_split(tmp_path):
+  frame = write_dataset(tmp_path / "data.csv")
+  xTrain, xTest, yTrain, yTest = load_split(str(tmp_path / "data.csv"), test_size=0.25, random_state=7)
+
+  expected = train_test_split(
+    frame.drop(columns="Class").to_numpy(np.float32), frame["Class"].to_numpy(), test_size=0.25, random_state=7
+  )
+  for loaded, reference in zip((xTrain, xTest, yTrain, yTest), expected):
+    np.testing.assert_array_equal(loaded, reference)
+
+def test_only_the_latest_split_copy_is_kept(tmp_path):
+  write_dataset(tmp_path / "data.csv")
+  load_split(str(tmp_path / "data.csv"), random_state=1)
+  load_split(str(tmp_path / "data.csv"), random_state=2)
+
+  splits = {name.split(".")[1] for name in os.listdir(tmp_path / ".data_cache") if ".split-" in name}
+  assert len(splits) == 1
@@ -0,0 +1,147 @@
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+import database
+
+# another worker process: its own lookup cache, the same MongoDB
+@pytest.fixture
+def other_worker(monkeypatch):
+  def run(fn, *args):
+    with monkeypatch.context() as patch:
+      patch.setattr(database, "lookup_cache", database.LookupCache(max_entries=1000, ttl_seconds=30))
+      return fn(*args)
+  return run
+
+def add_listing(address, contract_id):
+  return database.add_listing_to_created(
+    address, contract_id, "2026-01-01T00:00:00.000Z", "2099-01-01T00:00:00.000Z", f"https://example.com/{contract_id}"
+  )
+
+def test_reputation_is_never_served_from_the_cache(mongo, other_worker):
+  database.create_user("alice")
+  assert database.get_user_by_address("alice")["reputation"] == 100
+  other_worker(database.update_user_reputation, "alice", 40)
+  assert database.get_user_by_address("alice")["reputation"] == 40
+
+def test_listings_written_by_another_worker_are_seen_at_once(mongo, other_worker):
+  database.create_user("alice")
+  add_listing("alice", 1)
+  listings, _ = database.get_created_listings("alice")
+  assert [listing["contractId"] for listing in listings] == [1]
+
+  other_worker(add_listing, "alice", 2)
+  other_worker(database.mark_contract_as_paid, "alice", 1)
+  listings, _ = database.get_created_listings("alice")
+  assert [(listing["contractId"], listing.get("paid", False)) for listing in listings] == [(1, True), (2, False)]
+
+def test_unchanged_listings_are_served_from_the_cache(mongo):
+  database.create_user("alice")
+  add_listing("alice", 1)
+  database.get_created_listings("alice")
+  hits = database.lookup_cache.hits
+  database.get_created_listings("alice")
+  assert database.lookup_cache.hits == hits + 1
+  assert "listingsVersion" not in database.get_user_by_address("alice")
+
+def test_cursors_round_trip():
+  expires_at = datetime(2026, 5, 1, 12, 30, 15, 250000, tzinfo=timezone.utc)
+  assert database.decode_cursor(database.encode_cursor(expires_at, 42)) == (expires_at, 42)
+  object_id = ObjectId()
+  assert database.decode_id_cursor(database.encode_id_cursor(object_id)) == object_id
+  assert database.decode_cursor(None) is None
+  assert database.decode_id_cursor("") is None
+
+@pytest.mark.parametrize("decode", [database.decode_cursor, database.decode_id_cursor])
+def test_invalid_cursors_are_refused(decode):
+  with pytest.raises(ValueError):
+    decode("not a cursor")
+
+def test_pages_cover_every_listing_once(mongo):
+  database.create_user("alice")
+  for contract_id in range(1, 6):
+    add_listing("alice", contract_id)
+
+  seen, after = [], None
+  while True:
+    listings, cursor = database.get_created_listings("alice", limit=2, after=after, fields=["contractId"])
+    assert all(listing.keys() == {"contractId"} for listing in listings)
+    seen += [listing["contractId"] for listing in listings]
+    if cursor is None:
+      break
+    after = database.decode_id_cursor(cursor)
+  assert seen == [1, 2, 3, 4, 5]
+
+def test_contract_contributors_are_its_subscribers(mongo):
+  for address in ("alice", "bob", "carol"):
+    database.create_user(address)
+  database.update_user_reputation("bob", 40)
+  for subscriber in ("bob", "carol"):
+    database.add_listing_to_subscribed(
+      subscriber, 7, "2026-01-01T00:00:00.000Z", "2099-01-01T00:00:00.000Z", "https://example.com/7", "alice", 100
+    )
+  mongo["archivedSubscribedListings"].insert_one({"subscriberAddress": "alice", "contractId": 7})
+
+  assert database.get_contract_contributors(7) == {"alice": 100, "bob": 40, "carol": 100}
+  assert database.get_contract_contributors(8) == {}
+
+@pytest.mark.parametrize("path, extra", [
+  ("/add-listing", {}),
+  ("/add-subscribed-listing", {"creatorAddress": "bob", "reputation": 100})
+])
+@pytest.mark.parametrize("key, value", [("expiresAt", "next week"), ("createdAt", "2026-01-01"), ("expiresAt", 1767225600)])
+def test_malformed_timestamps_are_refused(mongo, path, extra, key, value):
+  import backend
+  database.create_user("alice")
+  listing = {
+    "address": "alice", "contractId": 1, "createdAt": "2026-01-01T00:00:00.000Z",
+    "expiresAt": "2099-01-01T00:00:00.000Z", "url": "https://example.com/1", **extra, key: value
+  }
+
+  response = backend.app.test_client().post(path, json=listing)
+
+  assert response.status_code == 400
+  assert key in response.get_json()["error"]
+  assert database.get_created_listings("alice")[0] == []
+  assert database.get_subscribed_listings("alice")[0] == []
+
+@pytest.mark.parametrize("url", [
+  "/get-created-listings/alice?limit=abc",
+  "/get-created-listings/alice?limit=0",
+  "/get-subscribed-listings/alice?limit=2.5",
+  "/get-user/alice?listingsLimit=abc",
+  "/get-reported-listings?subscribersLimit=-1",
+  "/get-reported-listings?subscribersLimit=all"
+])
+def test_malformed_limits_are_refused(mongo, url):
+  import backend
+  database.create_user("alice")
+
+  response = backend.app.test_client().get(url)
+
+  assert response.status_code == 400
+  assert url.split("?")[1].split("=")[0] in response.get_json()["error"]
+
+def test_reputation_changes_are_clamped_and_leave_no_snapshots(mongo):
+  for address in ("alice", "bob"):
+    database.create_user(address)
+  database.update_user_reputation("bob", 1)
+  # left behind by a run whose worker died before cleaning up
+  mongo["users"].update_one({"address": "bob"}, {"$set": {"reputationBatches.1000-dead": 3, "reputationBatches.olduuid": 3}})
+
+  results = database.apply_reputation_changes(["alice", "bob"], ["bob"])
+
+  assert [(change["address"], change["previousReputation"], change["newReputation"]) for change in results["successful"]] == [
+    ("alice", 100, 100), ("bob", 1, 2), ("bob", 2, 0)
+  ]
+  assert [database.get_user_by_address(address)["reputation"] for address in ("alice", "bob")] == [100, 0]
+  assert mongo["users"].count_documents({"reputationBatches": {"$exists": True}}) == 0
+
+def test_reputation_snapshots_are_never_returned(mongo):
+  import backend
+  database.create_user("alice")
+  mongo["users"].update_one({"address": "alice"}, {"$set": {"reputationBatches.1000-dead": 100}})
+
+  assert "reputationBatches" not in database.get_user_by_address("alice")
+  assert "reputationBatches" not in backend.app.test_client().get("/get-user/alice").get_json()
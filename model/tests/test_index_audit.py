@@ -0,0 +1,13 @@
+import database
+import index_audit
+
+def test_the_audit_covers_every_query_filter():
+  helpers = {name for name in vars(database) if name.endswith("_filter")}
+  assert helpers <= set(vars(index_audit))
+
+def test_pending_reports_are_read_through_an_index():
+  assert "status" in [keys for keys, _ in database.INDEXES[database.reported_listing_collection]]
+  queries = {name: (command, scan) for name, command, scan in index_audit.audit_queries()}
+  command, scan = queries["archive_listings.pending_reports"]
+  assert command["filter"] == database.pending_reports_filter()
+  assert not scan
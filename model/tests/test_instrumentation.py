@@ -0,0 +1,56 @@
+import os
+
+import instrumentation
+from instrumentation import MetricsRegistry
+
+def worker(directory):
+  registry = MetricsRegistry(directory and str(directory))
+  requests = registry.counter("requests_total", "Requests", labels=("route",))
+  latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+  queued = []
+  registry.register_collector(lambda: [("queued", "gauge", "Queued jobs", [({}, len(queued))])])
+  return registry, requests, latency, queued
+
+def sample(text, line_start):
+  return [line for line in text.splitlines() if line.startswith(line_start)]
+
+def test_scrapes_report_every_worker(tmp_path):
+  first, first_requests, first_latency, _ = worker(tmp_path)
+  second, second_requests, second_latency, _ = worker(tmp_path)
+  first_requests.inc("/a", amount=2)
+  second_requests.inc("/a")
+  second_requests.inc("/b")
+  first_latency.observe(0.05)
+  second_latency.observe(0.5)
+  second.flush()
+
+  text = first.render()
+  assert sample(text, "requests_total") == ['requests_total{route="/a"} 3', 'requests_total{route="/b"} 1']
+  assert sample(text, "latency_seconds_bucket") == [
+    'latency_seconds_bucket{le="0.1"} 1', 'latency_seconds_bucket{le="1"} 2', 'latency_seconds_bucket{le="+Inf"} 2'
+  ]
+  assert sample(text, "latency_seconds_count") == ["latency_seconds_count 2"]
+
+def test_counters_of_exited_workers_are_kept(tmp_path, monkeypatch):
+  exited, exited_requests, _, exited_queued = worker(tmp_path)
+  exited_requests.inc("/a", amount=5)
+  exited_queued.append("job")
+  exited.flush()
+  live, live_requests, _, live_queued = worker(tmp_path)
+  live_requests.inc("/a")
+  live_queued.extend(["job", "job"])
+
+  # the exited worker's snapshot is the only one another process wrote
+  monkeypatch.setattr(instrumentation, "_alive", lambda pid: False)
+  text = live.render()
+  assert sample(text, "requests_total") == ['requests_total{route="/a"} 6']
+  assert sample(text, "queued{") == [f'queued{{pid="{os.getpid()}"}} 2']
+
+def test_without_a_directory_only_this_process_is_reported(tmp_path):
+  registry, requests, _, queued = worker(None)
+  requests.inc("/a")
+  queued.append("job")
+  text = registry.render()
+  assert sample(text, "requests_total") == ['requests_total{route="/a"} 1']
+  assert sample(text, "queued") == ["queued 1"]
+  assert os.listdir(tmp_path) == []
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueue, JobQueueFull, JobFailed
+
+def wait_for_job(queue, job_id, timeout=5.0):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    job = queue.get(job_id)
+    if job["status"] not in ("queued", "running"):
+      return job
+    time.sleep(0.01)
+  raise AssertionError(f"Job {job_id} didn't finish")
+
+@pytest.fixture
+def queue(tmp_path):
+  return JobQueue(str(tmp_path / "jobs.sqlite3"), workers=1, max_queued=2)
+
+@pytest.fixture
+def release():
+  event = threading.Event()
+  yield event
+  event.set()
+
+def test_in_flight_jobs_are_deduplicated(queue, release):
+  job, created = queue.submit("fetch", "QmA", release.wait)
+  again, created_again = queue.submit("fetch", "QmA", lambda: None)
+  other, created_other = queue.submit("fetch", "QmB", lambda: "b")
+  assert created and not created_again and created_other
+  assert again["jobId"] == job["jobId"]
+  assert other["jobId"] != job["jobId"]
+
+  release.set()
+  assert wait_for_job(queue, job["jobId"])["status"] == "succeeded"
+  assert wait_for_job(queue, other["jobId"])["result"] == "b"
+  rerun, created = queue.submit("fetch", "QmA", lambda: None)
+  assert created and rerun["jobId"] != job["jobId"]
+
+def test_jobs_abandoned_by_an_exited_worker_are_replaced(queue, monkeypatch):
+  queue._connection().execute(
+    "INSERT INTO jobs (job_id, kind, key, status, pid, created_at) VALUES ('stale', 'fetch', 'QmA', 'running', -1, 0)"
+  )
+  monkeypatch.setattr("jobs._alive", lambda pid: pid != -1)
+  job, created = queue.submit("fetch", "QmA", lambda: None)
+  assert created and job["jobId"] != "stale"
+  assert queue.get("stale")["status"] == "failed"
+
+def test_submissions_beyond_the_queue_are_refused(queue, release):
+  queue.submit("fetch", "running", release.wait)
+  while queue.stats()["running"] == 0:
+    time.sleep(0.01)
+  queue.submit("fetch", "first", lambda: None)
+  queue.submit("fetch", "second", lambda: None)
+  with pytest.raises(JobQueueFull):
+    queue.submit("fetch", "third", lambda: None)
+
+def test_failed_jobs_record_their_error(queue):
+  def fail():
+    raise JobFailed("Gateway timed out")
+  job, _ = queue.submit("fetch", "QmA", fail)
+  job = wait_for_job(queue, job["jobId"])
+  assert job["status"] == "failed"
+  assert job["error"] == "Gateway timed out"
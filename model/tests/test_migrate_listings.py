@@ -0,0 +1,25 @@
+import database
+import migrate_listings
+from listing_feed import ListingFeed
+
+LIVE = "2099-01-01T00:00:00.000Z"
+
+def embedded_listing(contract_id):
+  return {"contractId": contract_id, "createdAt": "2026-01-01T00:00:00.000Z", "expiresAt": LIVE, "url": f"https://example.com/{contract_id}"}
+
+def test_migrated_listings_reach_a_running_feed(mongo, monkeypatch):
+  # the fixture already created the indexes on the mongomock collections
+  monkeypatch.setattr(migrate_listings, "ensure_indexes", lambda: True)
+  feed = ListingFeed(migrate_listings.created_listing_collection)
+  feed.rebuild()
+  database.create_user("alice")
+  mongo["users"].update_one({"address": "alice"}, {"$set": {"createdListings": [embedded_listing(1), embedded_listing(2)]}})
+  # migrated by an earlier run that didn't set feedUpdatedAt
+  mongo["createdListings"].insert_one(dict(embedded_listing(3), creatorAddress="alice", expiresAtTs=database.parse_expiry(LIVE)))
+
+  assert migrate_listings.migrate()["createdListings"] == 2
+
+  feed.invalidate()
+  listings, _, _ = feed.page(100)
+  assert [listing["contractId"] for listing in listings] == [1, 2, 3]
+  assert "createdListings" not in mongo["users"].find_one({"address": "alice"})
@@ -0,0 +1,60 @@
+import io
+import os
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from package_crypto import (
+  HEADER, TAG_SIZE, generate_key, encrypt_stream, encrypt_file, decrypt_bytes, decrypt_file, is_stream_encrypted
+)
+
+CHUNK = 64
+
+def encrypt(data, key):
+  sealed = io.BytesIO()
+  encrypt_stream(io.BytesIO(data), sealed, key, chunk_size=CHUNK)
+  return sealed.getvalue()
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK - 1, CHUNK, 3 * CHUNK, 3 * CHUNK + 5])
+def test_packages_round_trip(size):
+  key = generate_key()
+  data = os.urandom(size)
+  sealed = encrypt(data, key)
+  assert is_stream_encrypted(sealed)
+  assert bytes(decrypt_bytes(sealed, key)) == data
+
+def test_files_round_trip(tmp_path):
+  key = generate_key()
+  data = os.urandom(5 * CHUNK)
+  (tmp_path / "package.npz").write_bytes(data)
+  encrypt_file(str(tmp_path / "package.npz"), str(tmp_path / "package.enc"), key, chunk_size=CHUNK)
+  assert bytes(decrypt_file(str(tmp_path / "package.enc"), key)) == data
+  assert not (tmp_path / "package.enc.part").exists()
+
+def test_tampered_chunks_are_rejected():
+  key = generate_key()
+  sealed = bytearray(encrypt(os.urandom(3 * CHUNK), key))
+  sealed[HEADER.size + CHUNK + TAG_SIZE + 1] ^= 1
+  with pytest.raises(InvalidTag):
+    decrypt_bytes(bytes(sealed), key)
+
+def test_reordered_chunks_are_rejected():
+  key = generate_key()
+  sealed = encrypt(os.urandom(3 * CHUNK), key)
+  sealed_chunk = CHUNK + TAG_SIZE
+  first, second = HEADER.size, HEADER.size + sealed_chunk
+  swapped = sealed[:first] + sealed[second:second + sealed_chunk] + sealed[first:second] + sealed[second + sealed_chunk:]
+  with pytest.raises(InvalidTag):
+    decrypt_bytes(swapped, key)
+
+def test_truncated_streams_are_rejected():
+  key = generate_key()
+  sealed = encrypt(os.urandom(3 * CHUNK), key)
+  # dropping whole chunks leaves a chunk that wasn't sealed as the last one
+  with pytest.raises(InvalidTag):
+    decrypt_bytes(sealed[:HEADER.size + 2 * (CHUNK + TAG_SIZE)], key)
+
+def test_the_wrong_key_is_rejected():
+  sealed = encrypt(b"parameters", generate_key())
+  with pytest.raises(InvalidTag):
+    decrypt_bytes(sealed, generate_key())
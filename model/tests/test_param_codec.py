@@ -0,0 +1,53 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from param_codec import encode_params, encode_compact_params, decode_params
+
+def package():
+  rng = np.random.default_rng(0)
+  return {
+    "tree_nodes": rng.random((50, 4)),
+    "tree_values": rng.random((50, 1, 2)),
+    "feature_importances": rng.random(8),
+    "predictions": rng.integers(0, 2, 100),
+    "n_estimators": 10,
+    "criterion": "gini",
+    "max_depth": None
+  }
+
+def test_packages_round_trip():
+  params = package()
+  decoded = decode_params(encode_params(params))
+  assert decoded.keys() == params.keys()
+  for name, value in params.items():
+    if isinstance(value, np.ndarray):
+      assert decoded[name].dtype == value.dtype
+      np.testing.assert_array_equal(decoded[name], value)
+    else:
+      assert decoded[name] == value
+
+def test_stored_arrays_are_not_copied():
+  data = encode_params({"weights": np.arange(1000, dtype=np.float64)})
+  weights = decode_params(data)["weights"]
+  assert np.shares_memory(weights, np.frombuffer(data, dtype=np.uint8))
+
+def test_pickled_packages_are_refused():
+  data = pickle.dumps(package())
+  with pytest.raises(ValueError):
+    decode_params(data)
+  assert decode_params(data, allow_pickle=True)["n_estimators"] == 10
+
+def test_object_arrays_are_refused():
+  with pytest.raises(ValueError):
+    encode_params({"labels": np.array(["a", None], dtype=object)})
+
+def test_compact_packages_are_quantized_and_drop_per_sample_fields():
+  params = package()
+  decoded = decode_params(encode_compact_params(params))
+  assert "predictions" not in decoded
+  np.testing.assert_array_equal(decoded["tree_nodes"], params["tree_nodes"])
+  assert decoded["tree_values"].dtype == np.float64
+  np.testing.assert_allclose(decoded["tree_values"], params["tree_values"], atol=1 / 65535)
+  np.testing.assert_allclose(decoded["feature_importances"], params["feature_importances"], rtol=1e-6)
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import argparse
+import requests
+from dotenv import load_dotenv
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+
+from data_loader import load_split
+from param_codec import encode_params, encode_compact_params, decode_params
+from package_crypto import generate_key, encrypt_file
+from aggregation import export_trees, forest_from_package
+
+load_dotenv()
+
+# Headless version of fraud-detection-model.ipynb for contributors.
+#
+# A run goes through fixed stages - fit, metrics, serialize, encrypt, upload
+# and submit - and records each finished stage, its output and how long it
+# took in <work_dir>/state.json. Rerunning with the same configuration picks
+# up after the last finished stage, so a failed upload or POST is retried
+# without refitting. Changing the data or hyperparameters starts a new run.
+# Forests are fitted across all cores (n_jobs=-1) by default.
+
+STAGES = ("fit", "metrics", "serialize", "encrypt", "upload", "submit")
+BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:5000")
+SUBMIT_TIMEOUT = (10, 60)
+
+class TrainingRunner:
+  def __init__(self, source, work_dir, label_column="Class", test_size=0.2, random_state=42,
+               n_estimators=100, max_depth=None, n_jobs=-1, backend_url=BACKEND_URL, contract_id=None):
+    self.source = source
+    self.work_dir = work_dir
+    self.label_column = label_column
+    self.test_size = test_size
+    self.random_state = random_state
+    self.n_estimators = n_estimators
+    self.max_depth = max_depth
+    self.n_jobs = n_jobs
+    self.backend_url = backend_url.rstrip("/")
+    self.contract_id = contract_id
+    self._split = None
+    os.makedirs(work_dir, exist_ok=True)
+    self.state = self._load_state()
+
+  # -- checkpoints --
+
+  def path(self, name):
+    return os.path.join(self.work_dir, name)
+
+  def config_key(self):
+    stat = os.stat(self.source)
+    config = {
+      "source": os.path.abspath(self.source),
+      "size": stat.st_size,
+      "mtime_ns": stat.st_mtime_ns,
+      "label_column": self.label_column,
+      "test_size": self.test_size,
+      "random_state": self.random_state,
+      "n_estimators": self.n_estimators,
+      "max_depth": self.max_depth
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+  def _load_state(self):
+    try:
+      with open(self.path("state.json")) as f:
+        state = json.load(f)
+    except (OSError, ValueError):
+      state = None
+    if state is None or state.get("config") != self.config_key():
+      state = {"config": self.config_key(), "stages": {}}
+    return state
+
+  def _save_state(self):
+    temp_path = self.path("state.json.part")
+    with open(temp_path, "w") as f:
+      json.dump(self.state, f, indent=2)
+    os.replace(temp_path, self.path("state.json"))
+
+  def completed(self, stage):
+    return stage in self.state["stages"]
+
+  def output(self, stage):
+    return self.state["stages"][stage]["output"]
+
+  # drops the checkpoint of a stage and every stage after it.
+  def reset_from(self, stage):
+    for later in STAGES[STAGES.index(stage):]:
+      self.state["stages"].pop(later, None)
+    self._save_state()
+
+  def _write(self, name, data):
+    temp_path = self.path(name + ".part")
+    with open(temp_path, "wb") as f:
+      f.write(data)
+    os.replace(temp_path, self.path(name))
+
+  def _read(self, name):
+    with open(self.path(name), "rb") as f:
+      return f.read()
+
+  def split(self):
+    if self._split is None:
+      self._split = load_split(self.source, self.label_column, self.test_size, self.random_state)
+    return self._split
+
+  # -- stages --
+
+  def fit(self):
+    xTrain, _, yTrain, _ = self.split()
+    rfc = RandomForestClassifier(
+      n_estimators=self.n_estimators,
+      max_depth=self.max_depth,
+      n_jobs=self.n_jobs,
+      random_state=self.random_state
+    )
+    rfc.fit(xTrain, yTrain)
+    # the fitted forest is checkpointed as a parameter package, not a pickle
+    package = {
+      "feature_importances": rfc.feature_importances_,
+      "n_estimators": rfc.n_estimators,
+      "max_features": rfc.max_features,
+      "max_depth": rfc.max_depth if rfc.max_depth is not None else -1,
+      "n_samples": len(xTrain)
+    }
+    package.update(export_trees(rfc))
+    self._write("forest.npz", encode_params(package))
+    return {"file": "forest.npz", "n_samples": len(xTrain)}
+
+  def load_forest(self):
+    package = decode_params(self._read("forest.npz"))
+    forest = forest_from_package(package)
+    forest.n_jobs = self.n_jobs
+    return package, forest
+
+  def metrics(self):
+    _, xTest, _, yTest = self.split()
+    _, forest = self.load_forest()
+    yPred = forest.predict(xTest)
+    metrics = {
+      "accuracy": accuracy_score(yTest, yPred),
+      "precision": precision_score(yTest, yPred, zero_division=0),
+      "recall": recall_score(yTest, yPred, zero_division=0),
+      "f1score": f1_score(yTest, yPred, zero_division=0)
+    }
+    # same metrics.txt as the notebook writes
+    with open(self.path("metrics.txt"), "w") as f:
+      for key, value in metrics.items():
+        f.write(f"{key}: {value}\n")
+    return {key: float(value) for key, value in metrics.items()}
+
+  # compact package: trees, importances, sample count and metrics, but no
+  # per-row predictions.
+  def serialize(self):
+    package, _ = self.load_forest()
+    package["metrics"] = self.output("metrics")
+    self._write("model_params.npz", encode_compact_params(package))
+    return {"file": "model_params.npz", "bytes": os.path.getsize(self.path("model_params.npz"))}
+
+  def encrypt(self):
+    key = generate_key()
+    self._write("param_key", key)
+    encrypt_file(self.path("model_params.npz"), self.path("model_params_encrypted.bin"), key)
+    return {"file": "model_params_encrypted.bin", "bytes": os.path.getsize(self.path("model_params_encrypted.bin"))}
+
+  def upload(self):
+    from ipfs_configs import upload_file_to_ipfs
+    param_ipfs_hash = upload_file_to_ipfs(self.path("model_params_encrypted.bin"))
+    if not param_ipfs_hash:
+      raise RuntimeError("IPFS upload did not return a hash")
+    return {"param_ipfs_hash": param_ipfs_hash}
+
+  def submit(self):
+    data = {
+      # the notebook reports metrics as whole percentages
+      "metrics": {key: int(value * 100) for key, value in self.output("metrics").items()},
+      "param_ipfs_hash": self.output("upload")["param_ipfs_hash"],
+      "param_key": base64.b64encode(self._read("param_key")).decode("utf-8")
+    }
+    params = {"contractId": self.contract_id} if self.contract_id else None
+    response = requests.post(f"{self.backend_url}/update-data", json=data, params=params, timeout=SUBMIT_TIMEOUT)
+    response.raise_for_status()
+    return {"status": response.status_code}
+
+  # -- driver --
+
+  def run(self, until=STAGES[-1]):
+    for stage in STAGES[:STAGES.index(until) + 1]:
+      if self.completed(stage):
+        print(f"{stage}: done ({self.state['stages'][stage]['seconds']:.2f}s), skipping")
+        continue
+      start = time.perf_counter()
+      output = getattr(self, stage)()
+      seconds = time.perf_counter() - start
+      self.state["stages"][stage] = {"seconds": seconds, "finished_at": time.time(), "output": output}
+      self._save_state()
+      print(f"{stage}: {seconds:.2f}s")
+    return self.state
+
+  def timings(self):
+    return {stage: entry["seconds"] for stage, entry in self.state["stages"].items()}
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Train, package and submit a contributor model without Jupyter.")
+  parser.add_argument('source', help="training CSV or Parquet shard")
+  parser.add_argument('--work-dir', default='training_run')
+  parser.add_argument('--label-column', default='Class')
+  parser.add_argument('--test-size', type=float, default=0.2)
+  parser.add_argument('--random-state', type=int, default=42)
+  parser.add_argument('--n-estimators', type=int, default=100)
+  parser.add_argument('--max-depth', type=int)
+  parser.add_argument('--n-jobs', type=int, default=-1)
+  parser.add_argument('--backend-url', default=BACKEND_URL)
+  parser.add_argument('--contract-id')
+  parser.add_argument('--until', choices=STAGES, default=STAGES[-1], help="stop after this stage")
+  parser.add_argument('--rerun-from', choices=STAGES, help="discard the checkpoint of this stage and the ones after it")
+  args = parser.parse_args()
+
+  until, rerun_from = args.until, args.rerun_from
+  options = {key: value for key, value in vars(args).items() if key not in ('source', 'work_dir', 'until', 'rerun_from')}
+  runner = TrainingRunner(args.source, args.work_dir, **options)
+  if rerun_from:
+    runner.reset_from(rerun_from)
+  try:
+    runner.run(until)
+  except Exception as e:
+    print(f"Run stopped: {e or type(e).__name__}. Rerun the same command to resume.")
+    sys.exit(1)
+  print(json.dumps(runner.timings(), indent=2))
@@ -0,0 +1,167 @@
+import base64
+import hashlib
+
+# CIDs of files as `ipfs add` (and Pinata) import them, so downloaded content
+# can be checked against the hash it was requested by.
+#
+# A file is cut into CHUNK_SIZE chunks that become the leaves of a balanced
+# DAG of UnixFS dag-pb nodes with at most MAX_LINKS children each; the CID is
+# the hash of the root node. CIDv0 (Qm...) files have dag-pb leaves, CIDv1
+# (base32, b...) files raw leaves. Files imported with other settings (another
+# chunker, the trickle layout, a hash other than sha2-256) get different CIDs
+# and are refused.
+
+CHUNK_SIZE = 256 * 1024
+MAX_LINKS = 174
+
+DAG_PB = 0x70
+RAW = 0x55
+SHA2_256 = 0x12
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+def varint(value):
+  out = bytearray()
+  while value >= 0x80:
+    out.append(value & 0x7f | 0x80)
+    value >>= 7
+  out.append(value)
+  return bytes(out)
+
+def read_varint(data, offset):
+  value = shift = 0
+  while True:
+    if offset >= len(data):
+      raise ValueError("Truncated varint")
+    byte = data[offset]
+    value |= (byte & 0x7f) << shift
+    offset += 1
+    if byte < 0x80:
+      return value, offset
+    shift += 7
+
+def base58_decode(text):
+  value = 0
+  for char in text:
+    index = BASE58_ALPHABET.find(char)
+    if index < 0:
+      raise ValueError(f"Invalid base58 character {char!r}")
+    value = value * 58 + index
+  body = value.to_bytes((value.bit_length() + 7) // 8, "big")
+  return b"\0" * (len(text) - len(text.lstrip("1"))) + body
+
+def base58_encode(data):
+  value = int.from_bytes(data, "big")
+  out = ""
+  while value:
+    value, index = divmod(value, 58)
+    out = BASE58_ALPHABET[index] + out
+  return "1" * (len(data) - len(data.lstrip(b"\0"))) + out
+
+def multihash(data):
+  return bytes((SHA2_256, 32)) + hashlib.sha256(data).digest()
+
+# the CID's binary form, as it appears in dag-pb links
+def cid_bytes(version, codec, block):
+  if version == 0:
+    return multihash(block)
+  return varint(1) + varint(codec) + multihash(block)
+
+# (version, codec, binary CID) of a CID string, ValueError for any CID whose
+# content can't be verified here.
+def parse_cid(cid):
+  if len(cid) == 46 and cid.startswith("Qm"):
+    raw = base58_decode(cid)
+    if raw[:2] != bytes((SHA2_256, 32)) or len(raw) != 34:
+      raise ValueError(f"Invalid CIDv0 {cid}")
+    return 0, DAG_PB, raw
+  if cid.startswith("b"):
+    body = cid[1:].upper()
+    try:
+      raw = base64.b32decode(body + "=" * (-len(body) % 8))
+    except ValueError:
+      raise ValueError(f"Invalid CIDv1 {cid}")
+    version, offset = read_varint(raw, 0)
+    codec, offset = read_varint(raw, offset)
+    if version != 1 or codec not in (DAG_PB, RAW) or raw[offset:offset + 2] != bytes((SHA2_256, 32)) or len(raw) != offset + 34:
+      raise ValueError(f"Unsupported CID {cid}, only sha2-256 dag-pb and raw CIDv1 can be verified")
+    return 1, codec, raw
+  raise ValueError(f"Unsupported CID {cid}, only CIDv0 and base32 CIDv1 can be verified")
+
+def _field(number, value):
+  return varint(number << 3 | 2) + varint(len(value)) + value
+
+def _unixfs_file(data, filesize, blocksizes=()):
+  message = b"\x08\x02"
+  if data:
+    message += _field(2, data)
+  message += b"\x18" + varint(filesize)
+  for size in blocksizes:
+    message += b"\x20" + varint(size)
+  return message
+
+def _dag_pb(links, data):
+  node = b""
+  for hash_bytes, tsize in links:
+    node += _field(2, _field(1, hash_bytes) + b"\x12\x00" + b"\x18" + varint(tsize))
+  return node + _field(1, data)
+
+class UnixfsHasher:
+  """Computes the CID a file gets from `ipfs add` while it is fed in pieces.
+  Only the leaves' links are kept, a few dozen bytes per CHUNK_SIZE."""
+
+  def __init__(self, version):
+    self.version = version
+    self._buffer = bytearray()
+    # (binary CID, file bytes, cumulative block bytes) per leaf
+    self._leaves = []
+
+  def update(self, data):
+    self._buffer += data
+    while len(self._buffer) >= CHUNK_SIZE:
+      self._add_leaf(bytes(self._buffer[:CHUNK_SIZE]))
+      del self._buffer[:CHUNK_SIZE]
+
+  def _add_leaf(self, chunk):
+    if self.version == 0:
+      block = _dag_pb((), _unixfs_file(chunk, len(chunk)))
+      self._leaves.append((cid_bytes(0, DAG_PB, block), len(chunk), len(block)))
+    else:
+      self._leaves.append((cid_bytes(1, RAW, chunk), len(chunk), len(chunk)))
+
+  def digest(self):
+    """The binary CID of everything fed so far."""
+    if self._buffer or not self._leaves:
+      self._add_leaf(bytes(self._buffer))
+      self._buffer.clear()
+    nodes = self._leaves
+    while len(nodes) > 1:
+      parents = []
+      for start in range(0, len(nodes), MAX_LINKS):
+        children = nodes[start:start + MAX_LINKS]
+        filesize = sum(size for _, size, _ in children)
+        block = _dag_pb(
+          [(child, tsize) for child, _, tsize in children],
+          _unixfs_file(b"", filesize, [size for _, size, _ in children])
+        )
+        parents.append((
+          cid_bytes(self.version, DAG_PB, block), filesize, len(block) + sum(tsize for _, _, tsize in children)
+        ))
+      nodes = parents
+    return nodes[0][0]
+
+def cid_hasher(cid):
+  """A UnixfsHasher for content expected to have this CID."""
+  version, _, _ = parse_cid(cid)
+  return UnixfsHasher(version)
+
+def matches_cid(hasher, cid):
+  return hasher.digest() == parse_cid(cid)[2]
+
+def cid_of(data, version=0):
+  hasher = UnixfsHasher(version)
+  hasher.update(data)
+  raw = hasher.digest()
+  if version == 0:
+    return base58_encode(raw)
+  return "b" + base64.b32encode(raw).decode().lower().rstrip("=")
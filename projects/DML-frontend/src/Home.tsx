@@ -47,7 +47,7 @@ const Home = () => {
       const checkAccountResponse = await axios.get(`${BACKEND_SERVER}/check-address/${activeAddress}`)
       const isAccountExist = await checkAccountResponse.data.exists
       if (isAccountExist) {
-        const getDataResponse = (await axios.get(`${BACKEND_SERVER}/get-user/${activeAddress}`)).data
+        const getDataResponse = (await axios.get(`${BACKEND_SERVER}/get-user/${activeAddress}?fields=admin`)).data
         const adminStatus = getDataResponse.admin
         setIsAdmin(adminStatus)
       }
@@ -37,7 +37,7 @@ const Account = () => {
     const accountInfo = await algorand.account.getInformation(activeAddress)
     const balance = accountInfo.balance.algos
     setTimeout(async () => {
-      const getDataResponse = await axios.get(`${BACKEND_SERVER}/get-user/${activeAddress}`)
+      const getDataResponse = await axios.get(`${BACKEND_SERVER}/get-user/${activeAddress}?fields=reputation`)
       const reputation = await getDataResponse.data.reputation
       setReputation(reputation)
     }, 1000)
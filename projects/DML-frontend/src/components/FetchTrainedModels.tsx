@@ -210,14 +210,14 @@ const FetchTrainedModels = ({ openModal, closeModal }: UpdateFetchTrainedModelsI
   }, [openModal, appId])
 
   useEffect(() => {
-    if (paramsData) {
+    if (paramsData && appId) {
       const filteredParams = Object.fromEntries(
         Object.entries(paramsData).map(([key, value]) => {
           const { paramHash, paramKey } = value
           return [key, { paramHash, paramKey }]
         }),
       )
-      axios.post(`${BACKEND_SERVER}/aggregate`, filteredParams)
+      axios.post(`${BACKEND_SERVER}/aggregate`, filteredParams, { params: { contractId: appId.toString() } })
     }
   }, [paramsData])
 
@@ -415,7 +415,7 @@ const FetchTrainedModels = ({ openModal, closeModal }: UpdateFetchTrainedModelsI
                 <Box sx={{ border: '2px solid red', borderRadius: 2, mt: 1, color: 'red', textAlign: 'center', mb: 1 }}>
                   <Typography variant="subtitle2">
                     Use this{' '}
-                    <Link href={`${BACKEND_SERVER}/data`} target="_blank" rel="noopener noreferrer">
+                    <Link href={`${BACKEND_SERVER}/data?contractId=${appId}`} target="_blank" rel="noopener noreferrer">
                       end point
                     </Link>{' '}
                     for data aggregation.
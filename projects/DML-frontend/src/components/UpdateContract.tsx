@@ -21,7 +21,7 @@ import axios from 'axios'
 import { useSnackbar } from 'notistack'
 import { useMemo, useState } from 'react'
 import { DmlChainFactory } from '../contracts/DMLChain'
-import { addSubscribedListing, fetchListings } from '../utils/methods'
+import { addSubscribedListing, fetchListings, waitForJob } from '../utils/methods'
 import { AddSubscribedListingsPayload, BACKEND_SERVER, ListingsDTO } from '../utils/types'
 
 interface UpdateContractInterface {
@@ -111,7 +111,18 @@ const UpdateContract = ({ openModal, closeModal }: UpdateContractInterface) => {
         await client.send.commitToListing({ args: { stakeAmountTxn } })
       }
 
-      await axios.get(`${BACKEND_SERVER}/retrieve-model/${id}/${ipfsHash}`)
+      // fetch the notebook into the backend's cache first, then let the browser
+      // stream it to disk from there (it can resume with Range requests)
+      const prefetch = await axios.post(`${BACKEND_SERVER}/prefetch-model/${id}/${ipfsHash}`)
+      if (prefetch.status === 202) {
+        await waitForJob(prefetch.data.jobId)
+      }
+      const link = document.createElement('a')
+      link.href = `${BACKEND_SERVER}/retrieve-model/${id}/${ipfsHash}`
+      link.download = `${id}_model.ipynb`
+      document.body.appendChild(link)
+      link.click()
+      link.remove()
       enqueueSnackbar(`Download will begin shortly`, { variant: 'success' })
       setFileRetrieved(true)
     } catch (error) {
@@ -134,7 +145,7 @@ const UpdateContract = ({ openModal, closeModal }: UpdateContractInterface) => {
     })
 
     try {
-      const getDataResponse = await axios.get(`${BACKEND_SERVER}/get-user/${activeAddress}`)
+      const getDataResponse = await axios.get(`${BACKEND_SERVER}/get-user/${activeAddress}?fields=reputation`)
       const reputation = await getDataResponse.data.reputation
       const client = await factory.getAppClientById({ defaultSender: activeAddress, appId: appId })
 
@@ -190,8 +201,12 @@ const UpdateContract = ({ openModal, closeModal }: UpdateContractInterface) => {
   }
 
   const fetchData = async () => {
+    if (!appId) {
+      enqueueSnackbar('Please select a listing first', { variant: 'warning' })
+      return
+    }
     try {
-      const response = await axios.get(`${BACKEND_SERVER}/data`)
+      const response = await axios.get(`${BACKEND_SERVER}/data`, { params: { contractId: appId.toString() } })
       setData(response.data)
     } catch (error) {
       enqueueSnackbar('Error fetching data', { variant: 'warning' })
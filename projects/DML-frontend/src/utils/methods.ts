@@ -5,6 +5,7 @@ import {
   AddListingPayload,
   AddSubscribedListingsPayload,
   BACKEND_SERVER,
+  JobStatus,
   ParticipantInfo,
   ReportedListing,
   ReportListingResponse,
@@ -43,6 +44,18 @@ export const calculateReward = (paramsData: ParamsData, fixedPool: bigint, baseC
   return { addresses, rewards }
 }
 
+// fetches every page of a list endpoint, following the X-Next-Cursor header
+export const fetchAllPages = async <T>(url: string): Promise<T[]> => {
+  const items: T[] = []
+  let cursor: string | undefined
+  do {
+    const response = await axios.get<T[]>(url, { params: cursor ? { cursor } : undefined })
+    items.push(...response.data)
+    cursor = response.headers['x-next-cursor']
+  } while (cursor)
+  return items
+}
+
 export const addListing = async (payload: AddListingPayload) => {
   const response = await axios.post(`${BACKEND_SERVER}/add-listing`, payload)
 
@@ -54,13 +67,14 @@ export const addListing = async (payload: AddListingPayload) => {
 }
 
 export const fetchListings = async (address: string) => {
-  const response = await axios.get(`${BACKEND_SERVER}/get-filtered-listings/${address}`)
-
-  if (response.status !== 200) {
-    throw new Error(response.data.error || 'Failed to get listings')
+  try {
+    return await fetchAllPages(`${BACKEND_SERVER}/get-filtered-listings/${address}`)
+  } catch (error) {
+    if (axios.isAxiosError(error)) {
+      throw new Error(error.response?.data?.error || 'Failed to get listings')
+    }
+    throw error
   }
-
-  return response.data
 }
 
 export const addSubscribedListing = async (listingData: AddSubscribedListingsPayload) => {
@@ -78,8 +92,7 @@ export const addSubscribedListing = async (listingData: AddSubscribedListingsPay
 }
 
 export const getSubscribedListings = async (address: string): Promise<SubscribedListingDTO[]> => {
-  const response = await axios.get<SubscribedListingDTO[]>(`${BACKEND_SERVER}/get-subscribed-listings/${address}`)
-  return response.data
+  return fetchAllPages<SubscribedListingDTO>(`${BACKEND_SERVER}/get-subscribed-listings/${address}`)
 }
 
 export const calculateTimeRemaining = (endDate: Date): number => {
@@ -107,8 +120,7 @@ export const updateReputation = async (address: string, action: ReputationType):
 }
 
 export const getCreatedListings = async (address: string) => {
-  const response = await axios.get(`${BACKEND_SERVER}/get-created-listings/${address}`)
-  return response.data
+  return fetchAllPages(`${BACKEND_SERVER}/get-created-listings/${address}`)
 }
 
 export const isComplete = (endDate: Date): boolean => {
@@ -179,17 +191,32 @@ export const updateFeedback = async (subscriberAddress: string, contractId: numb
   }
 }
 
+// polls a background job started by the backend until it has finished
+export const waitForJob = async <T>(jobId: string, intervalMs = 500): Promise<T> => {
+  for (;;) {
+    const response = await axios.get<JobStatus<T>>(`${BACKEND_SERVER}/jobs/${jobId}`)
+    const job = response.data
+    if (job.status === 'succeeded') {
+      return job.result as T
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Job failed')
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs))
+  }
+}
+
 export const reportListing = async (contractId: number): Promise<ReportListingResponse> => {
   try {
-    const response = await axios.post<ReportListingResponse>(`${BACKEND_SERVER}/report-listing`, {
+    const response = await axios.post<JobStatus<ReportListingResponse>>(`${BACKEND_SERVER}/report-listing`, {
       contractId,
     })
 
-    if (response.status !== 200) {
-      throw new Error(response.data.error || 'Failed to report listing')
+    if (response.status !== 202) {
+      throw new Error('Failed to report listing')
     }
 
-    return response.data
+    return await waitForJob<ReportListingResponse>(response.data.jobId)
   } catch (error) {
     if (axios.isAxiosError(error)) {
       throw new Error(error.response?.data?.error || 'Failed to report listing')
@@ -200,8 +227,7 @@ export const reportListing = async (contractId: number): Promise<ReportListingRe
 
 export const getReportedListings = async (): Promise<ReportedListing[]> => {
   try {
-    const response = await axios.get<ReportedListing[]>(`${BACKEND_SERVER}/get-reported-listings`)
-    return response.data
+    return await fetchAllPages<ReportedListing>(`${BACKEND_SERVER}/get-reported-listings`)
   } catch (error) {
     if (axios.isAxiosError(error)) {
       throw new Error(error.response?.data?.error || 'Failed to fetch reported listings')
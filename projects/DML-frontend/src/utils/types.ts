@@ -96,6 +96,15 @@ export interface ReportListingResponse {
   reportId: string
 }
 
+export interface JobStatus<T> {
+  jobId: string
+  kind: string
+  key: string
+  status: 'queued' | 'running' | 'succeeded' | 'failed'
+  result: T | null
+  error: string | null
+}
+
 export interface ReportedListing {
   contractId: number
   creatorAddress: string